@@ -1,15 +1,56 @@
-import letsql as ls
+import queue
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+from demo.utils import with_port
+
+if TYPE_CHECKING:
+    from demo.backend import Backend
+    from demo.shard import ShardedBackend
+
+# loaded on first use, so importing demo (or demo.client) does not pay for
+# letsql, ibis, pandas and duckdb
+_lazy = {
+    "Backend": "demo.backend",
+    "ShardedBackend": "demo.shard",
+    "FlightServer": "demo.server",
+    "FlightServerProcess": "demo.process",
+    "BasicAuthServerMiddlewareFactory": "demo.server",
+    "NoOpAuthHandler": "demo.server",
+}
 
-from demo.backend import Backend
-from demo.server import BasicAuthServerMiddlewareFactory, FlightServer, NoOpAuthHandler
 
-DEFAULT_AUTH_MIDDLEWARE = {
-    "basic": BasicAuthServerMiddlewareFactory(
-        {
-            "test": "password",
-        }
-    )
-}
+def _default_auth_middleware():
+    from demo.server import BasicAuthServerMiddlewareFactory
+
+    return {
+        "basic": BasicAuthServerMiddlewareFactory(
+            {
+                "test": "password",
+            }
+        )
+    }
+
+
+def default_connection():
+    """An in memory letsql DuckDB connection, imports letsql when called"""
+    import letsql as ls
+
+    return ls.duckdb.connect()
+
+
+def __getattr__(name):
+    import importlib
+
+    if name == "DEFAULT_AUTH_MIDDLEWARE":
+        value = _default_auth_middleware()
+    elif name in _lazy:
+        value = getattr(importlib.import_module(_lazy[name]), name)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
 
 
 class BasicAuth:
@@ -19,6 +60,8 @@ class BasicAuth:
 
 
 def to_basic_auth_middleware(basic_auth: BasicAuth) -> dict:
+    from demo.server import BasicAuthServerMiddlewareFactory
+
     assert basic_auth is not None
 
     return {
@@ -39,7 +82,9 @@ class EphemeralServer:
         verify_client=False,
         root_certificates=None,
         auth: BasicAuth = None,
-        connection=ls.duckdb.connect,
+        connection=default_connection,
+        process=False,
+        **kwargs,
     ):
         self.location = location
         self.certificate_path = certificate_path
@@ -56,15 +101,42 @@ class EphemeralServer:
 
         tls_certificates.append((tls_cert_chain, tls_private_key))
 
-        self.server = FlightServer(
-            connection,
-            location,
-            tls_certificates=tls_certificates,
-            verify_client=verify_client,
-            root_certificates=root_certificates,
-            auth_handler=NoOpAuthHandler(),
-            middleware=to_basic_auth_middleware(auth),
-        )
+        if process:
+            from demo.process import FlightServerProcess
+
+            # serve from a child process so server work does not hold our GIL
+            self.server = FlightServerProcess(
+                connection,
+                location,
+                tls_certificates=tls_certificates,
+                verify_client=verify_client,
+                root_certificates=root_certificates,
+                auth=auth,
+                **kwargs,
+            )
+        else:
+            from demo.server import FlightServer, NoOpAuthHandler
+
+            self.server = FlightServer(
+                connection,
+                location,
+                tls_certificates=tls_certificates,
+                verify_client=verify_client,
+                root_certificates=root_certificates,
+                auth_handler=NoOpAuthHandler(),
+                middleware=to_basic_auth_middleware(auth),
+                **kwargs,
+            )
+
+        # a location with port 0 binds to any free port
+        self.location = with_port(location, self.port)
+
+    @property
+    def port(self):
+        return self.server.port
+
+    def reset(self):
+        self.server.reset()
 
     def __enter__(self):
         return self
@@ -73,11 +145,83 @@ class EphemeralServer:
         self.server.__exit__(*args)
 
 
+class EphemeralServerPool:
+    """
+    A pool of warm EphemeralServers bound to free ports.
+
+    Servers are started up front, handed out by `acquire` and reset (tables,
+    custom actions and exchangers dropped) by `release`, so getting a server
+    does not pay for startup.
+
+    Parameters
+    ----------
+    size: int
+        The number of warm servers to keep.
+    **kwargs
+        Passed on to every EphemeralServer.
+    """
+
+    def __init__(self, size=2, scheme="grpc+tls", host="localhost", **kwargs):
+        self.size = size
+        self.location = "{}://{}:{}".format(scheme, host, 0)
+        self.kwargs = kwargs
+        self.servers = []
+        self._idle = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        for _ in range(size):
+            self._idle.put(self._start())
+
+    def _start(self):
+        server = EphemeralServer(location=self.location, **self.kwargs)
+        with self._lock:
+            self.servers.append(server)
+        return server
+
+    def acquire(self) -> EphemeralServer:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            # all warm servers are in use, pay for a cold start
+            return self._start()
+
+    def release(self, server: EphemeralServer):
+        server.reset()
+        if self._idle.qsize() < self.size:
+            self._idle.put(server)
+        else:
+            with self._lock:
+                self.servers.remove(server)
+            server.__exit__(None, None, None)
+
+    @contextmanager
+    def server(self):
+        server = self.acquire()
+        try:
+            yield server
+        finally:
+            self.release(server)
+
+    def close(self):
+        with self._lock:
+            servers, self.servers = self.servers, []
+        for server in servers:
+            server.__exit__(None, None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 def make_con(
     con: EphemeralServer,
-) -> Backend:
+    **kwargs,
+) -> "Backend":
     from urllib.parse import urlparse
 
+    from demo.backend import Backend
+
     url = urlparse(con.location)
 
     instance = Backend()
@@ -87,8 +231,25 @@ def make_con(
         username=con.auth.username,
         password=con.auth.password,
         tls_roots=con.certificate_path,
+        **kwargs,
     )
     return instance
 
 
-__all__ = ["EphemeralServer", "make_con", "BasicAuth"]
+def make_sharded_con(
+    servers: list[EphemeralServer],
+) -> "ShardedBackend":
+    from demo.shard import ShardedBackend
+
+    instance = ShardedBackend()
+    instance.do_connect(shards=[make_con(server) for server in servers])
+    return instance
+
+
+__all__ = [
+    "EphemeralServer",
+    "EphemeralServerPool",
+    "make_con",
+    "make_sharded_con",
+    "BasicAuth",
+]
@@ -5,13 +5,28 @@ from abc import (
     abstractclassmethod,
 )
 
+import pyarrow.flight as paf
 from cloudpickle import (
+    dumps,
     loads,
 )
 
+from demo.parquet import (
+    expand_paths,
+)
+from demo.stats import (
+    TableStats,
+)
 from demo.utils import (
     make_flight_result,
 )
+from demo.wire import (
+    restore,
+)
+
+
+# what read_ipc looks for in directories
+IPC_PATTERNS = ("*.arrow", "*.feather", "*.ipc")
 
 
 class AbstractAction(ABC):
@@ -59,7 +74,8 @@ class ClearAction(AbstractAction):
 
     @classmethod
     def do_action(cls, server, context, action):
-        raise NotImplementedError(f"{action.type} is not implemented.")
+        server.clear()
+        yield make_flight_result("cleared")
 
 
 class ShutdownAction(AbstractAction):
@@ -134,6 +150,24 @@ class AddExchangeAction(AbstractAction):
         yield make_flight_result(None)
 
 
+class AddUDFAction(AbstractAction):
+    @classmethod
+    @property
+    def name(cls):
+        return "add-udf"
+
+    @classmethod
+    @property
+    def description(cls):
+        return "Add a vectorized UDF to the server's backend, see demo.udf"
+
+    @classmethod
+    def do_action(cls, server, context, action):
+        udf = loads(action.body)
+        server.add_udf(udf)
+        yield make_flight_result(None)
+
+
 class QueryExchangeAction(AbstractAction):
     @classmethod
     @property
@@ -148,7 +182,7 @@ class QueryExchangeAction(AbstractAction):
     @classmethod
     def do_action(cls, server, context, action):
         exchange_name = loads(action.body)
-        exchanger = server.exchangers.get(exchange_name)
+        exchanger = server.get_exchanger(exchange_name)
         query_result = exchanger.query_result if exchanger else None
         yield make_flight_result(query_result)
 
@@ -166,8 +200,10 @@ class ListTablesAction(AbstractAction):
 
     @classmethod
     def do_action(cls, server, context, action):
-        tables = server._conn.tables
-        yield make_flight_result(tuple(tables))
+        with server._conn_lock:
+            # the names are listed lazily, when iterated
+            tables = tuple(server._conn.tables)
+        yield make_flight_result(tables)
 
 
 class TableInfoAction(AbstractAction):
@@ -184,10 +220,19 @@ class TableInfoAction(AbstractAction):
     @classmethod
     def do_action(cls, server, context, action):
         table_name = action.body.to_pybytes().decode("utf-8")
-        schema = server._conn.get_schema(table_name)
+        with server._conn_lock:
+            schema = server._conn.get_schema(table_name)
         yield make_flight_result(schema)
 
 
+def _drop_args(action):
+    """(table_name, force) of a drop, whose body is a name or a dict of them"""
+    args = loads(action.body)
+    if isinstance(args, str):
+        return args, False
+    return args["table_name"], args.get("force", False)
+
+
 class DropTableAction(AbstractAction):
     @classmethod
     @property
@@ -201,8 +246,15 @@ class DropTableAction(AbstractAction):
 
     @classmethod
     def do_action(cls, server, context, action):
-        table_name = loads(action.body)
-        server._conn.execute(table_name)
+        table_name, force = _drop_args(action)
+        with server._conn_lock:
+            try:
+                server._conn.drop_table(table_name, force=force)
+            except Exception:
+                # uploaded tables are registered as views on DuckDB
+                server._conn.drop_view(table_name, force=force)
+            server.table_written(table_name)
+            server.memory.forget(table_name)
         yield make_flight_result(f"dropped table {table_name}")
 
 
@@ -219,11 +271,70 @@ class DropViewAction(AbstractAction):
 
     @classmethod
     def do_action(cls, server, context, action):
-        table_name = loads(action.body)
-        server._conn.drop_view(table_name)
+        table_name, force = _drop_args(action)
+        with server._conn_lock:
+            server._conn.drop_view(table_name, force=force)
+            server.table_written(table_name)
+            server.memory.forget(table_name)
         yield make_flight_result(f"dropped view {table_name}")
 
 
+class MemoryUsageAction(AbstractAction):
+    @classmethod
+    @property
+    def name(cls):
+        return "memory_usage"
+
+    @classmethod
+    @property
+    def description(cls):
+        return "Get the size and spill state of the tables uploaded to this server."
+
+    @classmethod
+    def do_action(cls, server, context, action):
+        yield make_flight_result(
+            {name: table.to_dict() for name, table in server.memory.tables.items()}
+        )
+
+
+class SchedulerStatsAction(AbstractAction):
+    @classmethod
+    @property
+    def name(cls):
+        return "scheduler_stats"
+
+    @classmethod
+    @property
+    def description(cls):
+        return "Get the running and queued calls of this server's scheduler."
+
+    @classmethod
+    def do_action(cls, server, context, action):
+        yield make_flight_result(server.scheduler.to_dict())
+
+
+class TableStatsAction(AbstractAction):
+    @classmethod
+    @property
+    def name(cls):
+        return "table_stats"
+
+    @classmethod
+    @property
+    def description(cls):
+        return "Get the row count, size and per column statistics of a table."
+
+    @classmethod
+    def do_action(cls, server, context, action):
+        table_name = action.body.to_pybytes().decode("utf-8")
+        stats = server.table_stats(table_name)
+        if stats is None:
+            # not gathered as the data arrived, e.g. a view
+            with server._query_backend() as (conn, lock), lock:
+                stats = TableStats.from_expr(conn.table(table_name), conn.to_pyarrow)
+        yield make_flight_result(stats.to_dict())
+
+
 class ReadParquetAction(AbstractAction):
     @classmethod
     @property
@@ -242,10 +353,207 @@ class ReadParquetAction(AbstractAction):
         table_name = args["table_name"]
         source_list = args["source_list"]
 
-        server._conn.read_parquet(source_list, table_name)
+        paths = expand_paths(source_list)
+        infos = server.parquet_cache.get_all(paths) if paths else None
+        with server._conn_lock:
+            registered = server.parquet_tables.get(table_name)
+            if (
+                infos is None
+                or registered is None
+                or tuple(info.key for info in infos)
+                != tuple(info.key for info in registered)
+                or table_name not in server._conn.tables
+            ):
+                server._conn.read_parquet(source_list, table_name)
+            # the table is no longer one uploaded to the server
+            server.memory.forget(table_name)
+            server.table_written(table_name)
+            if infos is not None:
+                server.parquet_tables[table_name] = infos
         yield make_flight_result(f"read parquet file {table_name}")
 
 
+class ReadIPCAction(AbstractAction):
+    @classmethod
+    @property
+    def name(cls):
+        return "read_ipc"
+
+    @classmethod
+    @property
+    def description(cls):
+        return "Memory-map Arrow IPC (Feather v2) files into this server."
+
+    @classmethod
+    def do_action(cls, server, context, action):
+        args = loads(action.body)
+
+        table_name = args["table_name"]
+        paths = expand_paths(args["source_list"], patterns=IPC_PATTERNS)
+        if not paths:
+            raise paf.FlightServerError(
+                f"read_ipc needs files local to the server, got {args['source_list']}"
+            )
+        with server._conn_lock:
+            num_rows = server.memory.map_files(
+                server._conn, table_name, paths, owned=args.get("owned", False)
+            )
+            server.table_written(table_name)
+        yield make_flight_result(f"mapped {num_rows} rows into {table_name}")
+
+
+class PullFromAction(AbstractAction):
+    @classmethod
+    @property
+    def name(cls):
+        return "pull-from"
+
+    @classmethod
+    @property
+    def description(cls):
+        return "Create a table from a ticket served by another flight server."
+
+    @classmethod
+    def do_action(cls, server, context, action):
+        args = loads(action.body)
+
+        table_name = args["table_name"]
+        kwargs = {}
+        if args.get("tls_root_certs"):
+            kwargs["tls_root_certs"] = args["tls_root_certs"]
+
+        client = paf.FlightClient(args["location"], **kwargs)
+        try:
+            options = paf.FlightCallOptions(headers=args.get("headers") or [])
+            reader = client.do_get(paf.Ticket(args["ticket"]), options=options)
+            data = restore(reader.read_all())
+        finally:
+            client.close()
+
+        stats = TableStats.from_table(data)
+        with server._conn_lock:
+            server.memory.register(server._conn, table_name, data, stats)
+            server.table_written(table_name)
+        yield make_flight_result(f"pulled {data.num_rows} rows into {table_name}")
+
+
+class BatchAction(AbstractAction):
+    @classmethod
+    @property
+    def name(cls):
+        return "batch"
+
+    @classmethod
+    @property
+    def description(cls):
+        return (
+            "Run a list of (action, body) pairs in one call, optionally as a"
+            " transaction, and return the results of each in order."
+        )
+
+    @classmethod
+    def _run(cls, server, context, actions):
+        for i, (action_type, body) in enumerate(actions):
+            action = paf.Action(
+                action_type, body if isinstance(body, bytes) else dumps(body)
+            )
+            try:
+                results = tuple(
+                    loads(result.body.to_pybytes())
+                    for result in server.actions[action_type].do_action(
+                        server, context, action
+                    )
+                )
+            except Exception as e:
+                raise paf.FlightServerError(
+                    f"batch action {i} ({action_type}) failed: {e}"
+                )
+            yield make_flight_result(results)
+
+    @classmethod
+    def do_action(cls, server, context, action):
+        args = loads(action.body)
+        actions = list(args["actions"])
+        unknown = {action_type for action_type, _ in actions} - set(server.actions)
+        if unknown:
+            raise paf.FlightServerError(f"unknown actions {sorted(unknown)}")
+        if not args.get("transaction"):
+            yield from cls._run(server, context, actions)
+            return
+
+        if getattr(server._conn, "name", None) != "duckdb":
+            raise paf.FlightServerError("transactions need a DuckDB backend")
+        with server._conn_lock:
+            parquet_tables = dict(server.parquet_tables)
+            memory = server.memory.snapshot()
+            server._conn.raw_sql("BEGIN TRANSACTION")
+            try:
+                results = list(cls._run(server, context, actions))
+            except Exception:
+                server._conn.raw_sql("ROLLBACK")
+                server.parquet_tables = parquet_tables
+                server.memory.restore(memory)
+                raise
+            server._conn.raw_sql("COMMIT")
+        yield from results
+
+
+class CancelQueryAction(AbstractAction):
+    @classmethod
+    @property
+    def name(cls):
+        return "cancel-query"
+
+    @classmethod
+    @property
+    def description(cls):
+        return "Cancel a running query by the query_id it was sent with."
+
+    @classmethod
+    def do_action(cls, server, context, action):
+        query_id = loads(action.body)
+        yield make_flight_result(server.queries.cancel(query_id))
+
+
+class PrepareAction(AbstractAction):
+    @classmethod
+    @property
+    def name(cls):
+        return "prepare"
+
+    @classmethod
+    @property
+    def description(cls):
+        return "Keep an expression on this server and return a handle to execute it by."
+
+    @classmethod
+    def do_action(cls, server, context, action):
+        from demo.prepared import PreparedStatement
+
+        kwargs = loads(action.body)
+        statement = PreparedStatement(kwargs.pop("expr"), **kwargs)
+        server.prepared[statement.handle] = statement
+        yield make_flight_result(statement.to_dict())
+
+
+class ClosePreparedAction(AbstractAction):
+    @classmethod
+    @property
+    def name(cls):
+        return "close-prepared"
+
+    @classmethod
+    @property
+    def description(cls):
+        return "Drop a prepared statement."
+
+    @classmethod
+    def do_action(cls, server, context, action):
+        handle = loads(action.body)
+        server.prepared.pop(handle, None)
+        yield make_flight_result(f"closed {handle}")
+
+
 actions = {
     action.name: action
     for action in (
@@ -256,10 +564,20 @@ actions = {
         QueryExchangeAction,
         AddActionAction,
         AddExchangeAction,
+        AddUDFAction,
         ListTablesAction,
         TableInfoAction,
         DropTableAction,
         DropViewAction,
+        MemoryUsageAction,
+        SchedulerStatsAction,
+        TableStatsAction,
         ReadParquetAction,
+        ReadIPCAction,
+        PullFromAction,
+        PrepareAction,
+        ClosePreparedAction,
+        CancelQueryAction,
+        BatchAction,
     )
 }
@@ -0,0 +1,187 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow
+import pyarrow.flight
+
+from demo.client import FlightClient
+from demo.coalesce import coalesce_batches, coalesce_options
+from demo.wire import original_schema, restore
+
+# pyarrow.flight only has blocking calls: every call runs on one of these
+# executors and a stream only holds a thread while it waits for a batch.
+# Exchange writes get their own threads so that readers waiting on server
+# output can never starve the writes that server output depends on.
+read_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="flight-read")
+write_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="flight-write")
+
+
+async def _run(executor, f, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(f, *args, **kwargs))
+
+
+async def _aiter_batches(batches, coalesce=None):
+    if hasattr(batches, "__aiter__"):
+        async for batch in batches:
+            yield batch
+    else:
+        if options := coalesce_options(coalesce):
+            batches = coalesce_batches(batches, **options)
+        iterator = iter(batches)
+        while (batch := await _run(write_executor, next, iterator, None)) is not None:
+            yield batch
+
+
+def _read_next(reader):
+    # a StopIteration can not travel through a Future
+    try:
+        return reader.read_chunk().data
+    except StopIteration:
+        return None
+
+
+class AsyncRecordBatchStream:
+    """
+    Async iteration over the batches of a flight stream
+
+        async for batch in stream:
+            ...
+    """
+
+    def __init__(self, reader, writer=None, write_task=None):
+        self._reader = reader
+        self._writer = writer
+        self._write_task = write_task
+
+    @functools.cached_property
+    def _original_schema(self):
+        # batches sent with wire_optimize are restored as they are read
+        return original_schema(self._reader.schema)
+
+    @property
+    def schema(self):
+        return self._original_schema or self._reader.schema
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        batch = await _run(read_executor, _read_next, self._reader)
+        if batch is None:
+            await self._finish()
+            raise StopAsyncIteration
+        return restore(batch, self._original_schema)
+
+    async def _finish(self):
+        if self._write_task is not None:
+            await self._write_task
+            self._write_task = None
+        if self._writer is not None:
+            await _run(write_executor, self._writer.close)
+            self._writer = None
+
+    async def read_all(self):
+        batches = [batch async for batch in self]
+        return pyarrow.Table.from_batches(batches, schema=self.schema)
+
+    async def read_pandas(self, **kwargs):
+        return (await self.read_all()).to_pandas(**kwargs)
+
+    def cancel(self):
+        self._reader.cancel()
+        if self._write_task is not None:
+            self._write_task.cancel()
+
+
+class AsyncFlightClient:
+    """
+    An asyncio interface to a FlightClient
+
+    All calls are awaitable and results are iterated with `async for`, so one
+    event loop can drive many concurrent queries and exchanges, against one or
+    more servers, without a thread per stream.
+
+    Args:
+        client: a connected FlightClient
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    async def connect(cls, **kwargs):
+        """Create the FlightClient (healthcheck and login) off the event loop"""
+        return cls(await _run(read_executor, FlightClient, **kwargs))
+
+    @property
+    def _options(self):
+        return self.client._options
+
+    async def action(self, action_type, action_body=""):
+        return await _run(
+            read_executor,
+            self.client.do_action,
+            action_type,
+            action_body,
+            options=self._options,
+        )
+
+    async def execute(self, expr, **kwargs):
+        reader = await _run(read_executor, self.client.execute_batches, expr, **kwargs)
+        return AsyncRecordBatchStream(reader)
+
+    async def execute_query(self, expr, **kwargs):
+        return await (await self.execute(expr, **kwargs)).read_all()
+
+    async def upload(self, table_name, batches, schema=None, coalesce=False):
+        """
+        Upload batches to create or replace a table
+
+        Args:
+            table_name: Name of the table to create
+            batches: a pyarrow.Table, RecordBatchReader or (async) iterable of
+                record batches, which then needs schema
+            coalesce: merge small batches before sending, see demo.coalesce
+        """
+        if isinstance(batches, pyarrow.Table):
+            batches = batches.to_reader()
+        schema = schema or batches.schema
+        writer, _ = await _run(
+            write_executor,
+            self.client._client.do_put,
+            pyarrow.flight.FlightDescriptor.for_command(table_name.encode("utf-8")),
+            schema,
+            options=self._options,
+        )
+        async for batch in _aiter_batches(batches, coalesce):
+            await _run(write_executor, writer.write_batch, batch)
+        await _run(write_executor, writer.done_writing)
+        await _run(write_executor, writer.close)
+
+    async def exchange(self, command, batches, schema=None, coalesce=False):
+        """
+        Stream batches through an exchanger
+
+        Returns an AsyncRecordBatchStream of the exchanger's output, the input
+        is written concurrently while it is read.
+        """
+        if isinstance(batches, pyarrow.Table):
+            batches = batches.to_reader()
+        schema = schema or batches.schema
+        writer, reader = await _run(
+            write_executor,
+            self.client._client.do_exchange,
+            pyarrow.flight.FlightDescriptor.for_command(command),
+            options=self._options,
+        )
+
+        async def write():
+            await _run(write_executor, writer.begin, schema)
+            async for batch in _aiter_batches(batches, coalesce):
+                await _run(write_executor, writer.write_batch, batch)
+            await _run(write_executor, writer.done_writing)
+
+        write_task = asyncio.ensure_future(write())
+        return AsyncRecordBatchStream(reader, writer=writer, write_task=write_task)
@@ -1,3 +1,6 @@
+import collections
+import os
+import uuid
 from pathlib import Path
 from typing import Mapping, Any, Iterable
 
@@ -6,20 +9,47 @@ import pyarrow as pa
 from ibis import util
 from ibis.expr import types as ir, schema as sch
 from letsql.backends.duckdb import Backend as DuckDBBackend
+from letsql.expr.relations import into_backend as _into_backend
 
 from demo.action import (
+    AddUDFAction,
     DropTableAction,
     DropViewAction,
+    ReadIPCAction,
     ReadParquetAction,
     ListTablesAction,
+    TableInfoAction,
 )
 from demo.client import FlightClient
+from demo.materialize import arrow_pandas_result, batches_to_pandas, pandas_result
+from demo.tracing import span
+from demo.udf import VectorizedUDF
+from demo.wire import original_schema, restore, restore_batches
+
+
+# the batch size results are read in when they are read whole
+MATERIALIZE_CHUNK_SIZE = 1_000_000
+
+# prepared statements a backend keeps open on its server by default
+MAX_PREPARED = 64
 
 
 class Backend(DuckDBBackend):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.con = None
+        # (op, limit, chunk_size) -> PreparedStatement for queries with params,
+        # least recently used first
+        self._prepared = collections.OrderedDict()
+        self._max_prepared = MAX_PREPARED
+        # catalog calls without a result, sent along with the next call
+        self._pending = []
+        # schemas fetched ahead of self.table
+        self._schemas = {}
+        # where read_in_memory writes IPC files for the server to map
+        self._ipc_dir = None
+        # whether execute returns pandas.ArrowDtype columns
+        self._arrow_dtypes = False
 
     def do_connect(
         self,
@@ -28,14 +58,48 @@ class Backend(DuckDBBackend):
         username="test",
         password="password",
         tls_roots=None,
+        wire_optimize=False,
+        ipc_dir=None,
+        arrow_dtypes=False,
+        max_prepared=MAX_PREPARED,
     ) -> None:
+        """
+        ipc_dir is a directory both this process and the server can read,
+        e.g. for a server on the same machine: read_in_memory then writes
+        tables there as Arrow IPC files the server memory-maps, instead of
+        sending them over gRPC.
+
+        arrow_dtypes makes execute return columns of pandas.ArrowDtype, which
+        keep the Arrow buffers instead of converting them to NumPy.
+
+        max_prepared bounds the statements prepared for queries with params,
+        the least recently used is closed on the server to make room.
+        """
         self.con = FlightClient(
             host=host,
             port=port,
             username=username,
             password=password,
             tls_roots=tls_roots,
+            wire_optimize=wire_optimize,
         )
+        self._prepared = collections.OrderedDict()
+        self._max_prepared = max_prepared
+        self._pending = []
+        self._schemas = {}
+        self._ipc_dir = ipc_dir
+        self._arrow_dtypes = arrow_dtypes
+
+    def _batch(self, *actions):
+        """Send the pending catalog calls and actions in one round trip"""
+        pending, self._pending = self._pending, []
+        results = self.con.do_batch([*pending, *actions])
+        return results[len(pending) :]
+
+    def flush(self):
+        """Send the pending catalog calls"""
+        if self._pending:
+            self._batch()
 
     def get_schema(
         self,
@@ -44,6 +108,13 @@ class Backend(DuckDBBackend):
         catalog: str | None = None,
         database: str | None = None,
     ) -> sch.Schema:
+        if (schema := self._schemas.pop(table_name, None)) is not None:
+            return schema
+        if self._pending:
+            ((schema,),) = self._batch(
+                (TableInfoAction.name, table_name.encode("utf-8"))
+            )
+            return schema
         return self.con.get_table_info(table_name)
 
     def read_in_memory(
@@ -52,6 +123,11 @@ class Backend(DuckDBBackend):
         table_name: str | None = None,
     ) -> ir.Table:
         table_name = table_name or util.gen_name("read_in_memory")
+        if self._ipc_dir is not None and isinstance(
+            source, (pa.Table, pa.RecordBatchReader)
+        ):
+            return self._read_in_memory_ipc(source, table_name)
+        self.flush()
 
         if isinstance(source, pa.Table):
             self.con.upload_data(table_name, source)
@@ -59,19 +135,66 @@ class Backend(DuckDBBackend):
             self.con.upload_batches(table_name, source)
         return self.table(table_name)
 
+    def _read_in_memory_ipc(self, source, table_name):
+        path = os.path.join(self._ipc_dir, f"{table_name}-{uuid.uuid4().hex}.arrow")
+        try:
+            with pa.OSFile(path, "wb") as sink:
+                with pa.ipc.new_file(sink, source.schema) as writer:
+                    if isinstance(source, pa.Table):
+                        writer.write_table(source)
+                    else:
+                        for batch in source:
+                            writer.write_batch(batch)
+            # the server removes the file along with the table
+            return self._read_ipc(path, table_name, owned=True)
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+
+    def read_ipc(
+        self,
+        source_list: str | Iterable[str],
+        table_name: str | None = None,
+        **kwargs: Any,
+    ) -> ir.Table:
+        """
+        Memory-map Arrow IPC (Feather v2) files on the server's file system
+        into a table, without copying them
+        """
+        table_name = table_name or util.gen_name("read_ipc")
+        return self._read_ipc(source_list, table_name)
+
+    def _read_ipc(self, source_list, table_name, owned=False):
+        args = {
+            "source_list": source_list,
+            "table_name": table_name,
+            "owned": owned,
+        }
+        _, (schema,) = self._batch(
+            (ReadIPCAction.name, args),
+            (TableInfoAction.name, table_name.encode("utf-8")),
+        )
+        self._schemas[table_name] = schema
+        return self.table(table_name)
+
     def read_parquet(
         self,
         source_list: str | Iterable[str],
         table_name: str | None = None,
         **kwargs: Any,
     ) -> ir.Table:
+        table_name = table_name or util.gen_name("read_parquet")
         args = {
             "source_list": source_list,
             "table_name": table_name,
         }
-        self.con.do_action(
-            ReadParquetAction.name, action_body=args, options=self.con._options
+        # read and fetch the schema for self.table in one round trip
+        _, (schema,) = self._batch(
+            (ReadParquetAction.name, args),
+            (TableInfoAction.name, table_name.encode("utf-8")),
         )
+        self._schemas[table_name] = schema
         return self.table(table_name)
 
     def register(
@@ -80,23 +203,50 @@ class Backend(DuckDBBackend):
         table_name: str | None = None,
         **kwargs: Any,
     ) -> ir.Table:
+        self.flush()
         if isinstance(source, pd.DataFrame):
             source = pa.Table.from_pandas(source)
             source = pa.RecordBatchReader.from_batches(
                 source.schema, source.to_batches()
             )
 
+        if isinstance(source, ir.Table):
+            backends, _ = source._find_backends()
+            if len(backends) == 1 and isinstance(backends[0], Backend):
+                # both ends are flight servers, let this one pull the data
+                self.con.pull_from(backends[0].con, source.unbind(), table_name)
+                return self.table(table_name)
+            source = source.to_pyarrow_batches()
+
         if isinstance(source, pa.RecordBatchReader):
             self.con.upload_batches(table_name, source)
 
         return self.table(table_name)
 
+    def insert(
+        self,
+        table_name: str,
+        obj: pd.DataFrame | ir.Table | pa.Table | pa.RecordBatchReader,
+        database: str | None = None,
+        overwrite: bool = False,
+    ) -> None:
+        """Append obj to a table, or replace its rows with overwrite=True"""
+        self.flush()
+        if isinstance(obj, ir.Table):
+            obj = obj.to_pyarrow_batches()
+        elif isinstance(obj, pd.DataFrame):
+            obj = pa.Table.from_pandas(obj, preserve_index=False)
+        if isinstance(obj, pa.Table):
+            obj = obj.to_reader()
+        if overwrite:
+            self.con.upload_batches(table_name, obj)
+        else:
+            self.con.append_batches(table_name, obj)
+
     @property
     def tables(self):
-        res = self.con.do_action(
-            ListTablesAction.name, action_body="list_tables", options=self.con._options
-        )
-        return res[0]
+        ((tables,),) = self._batch((ListTablesAction.name, "list_tables"))
+        return tables
 
     def drop_table(
         self,
@@ -104,9 +254,8 @@ class Backend(DuckDBBackend):
         database: tuple[str, str] | str | None = None,
         force: bool = False,
     ) -> None:
-        self.con.do_action(
-            DropTableAction.name, action_body=name, options=self.con._options
-        )
+        # sent now, with the pending calls, so a failing drop fails here
+        self._batch((DropTableAction.name, {"table_name": name, "force": force}))
 
     def drop_view(
         self,
@@ -116,9 +265,24 @@ class Backend(DuckDBBackend):
         schema: str | None = None,
         force: bool = False,
     ) -> None:
-        self.con.do_action(
-            DropViewAction.name, action_body=name, options=self.con._options
-        )
+        self._batch((DropViewAction.name, {"table_name": name, "force": force}))
+
+    def register_udf(
+        self,
+        fn,
+        input_types: Iterable[pa.DataType],
+        output_type: pa.DataType,
+        name: str | None = None,
+    ):
+        """
+        Register fn, a function of Arrow arrays, with the server's backend
+
+        Returns a builtin ibis UDF, expressions calling it run fn on the server
+        next to the data. The registration is sent along with the next call.
+        """
+        udf = VectorizedUDF(fn, input_types, output_type, name=name)
+        self._pending.append((AddUDFAction.name, udf))
+        return udf.to_ibis()
 
     def to_pyarrow_batches(
         self,
@@ -131,8 +295,123 @@ class Backend(DuckDBBackend):
     ) -> pa.ipc.RecordBatchReader:
 
         def gen(chunks):
-            for chunk in chunks:
-                yield chunk.data
+            exhausted = False
+            try:
+                for chunk in chunks:
+                    yield chunk.data
+                exhausted = True
+            finally:
+                if not exhausted:
+                    # the reader was closed early, stop the server's work
+                    chunks.cancel()
+
+        self.flush()
+        if params:
+            batches = self._execute_prepared(expr, params, limit, chunk_size)
+        else:
+            batches = self.con.execute_batches(expr, limit=limit, chunk_size=chunk_size)
+        schema = original_schema(batches.schema) or batches.schema
+        return pa.RecordBatchReader.from_batches(
+            schema, restore_batches(gen(batches), batches.schema)
+        )
+
+    def _materialize(self, expr, params=None, limit=None):
+        """
+        Execute expr for its whole result, returns (FlightInfo, reader)
+
+        Results read whole are sent in large batches.
+        """
+        self.flush()
+        if params:
+            return self._execute_prepared(
+                expr, params, limit, MATERIALIZE_CHUNK_SIZE, with_info=True
+            )
+        return self.con.execute_batches(
+            expr, with_info=True, limit=limit, chunk_size=MATERIALIZE_CHUNK_SIZE
+        )
+
+    def to_pyarrow(
+        self,
+        expr: ir.Expr,
+        *,
+        params: Mapping[ir.Scalar, Any] | None = None,
+        limit: int | str | None = None,
+        **_: Any,
+    ) -> pa.Table:
+        # read by Arrow in one call, not batch by batch through Python
+        with span("to_pyarrow"):
+            _, reader = self._materialize(expr, params, limit)
+            return expr.__pyarrow_result__(restore(reader.read_all()))
+
+    def execute(
+        self,
+        expr: ir.Expr,
+        params: Mapping | None = None,
+        limit: str | None = "default",
+        arrow_dtypes: bool | None = None,
+        **_: Any,
+    ) -> Any:
+        """
+        Execute expr and return a DataFrame, Series or scalar
+
+        The result is converted to pandas as it arrives, see
+        demo.materialize, so the peak memory is about the size of the
+        DataFrame instead of twice or three times that. arrow_dtypes
+        overrides the connection's option, see do_connect.
+        """
+        if arrow_dtypes is None:
+            arrow_dtypes = self._arrow_dtypes
+        with span("execute"):
+            flight_info, reader = self._materialize(expr, params, limit)
+            # the do_get call ends once to_pandas has read its stream
+            with span("to_pandas"):
+                if arrow_dtypes:
+                    # the DataFrame wraps the Arrow buffers
+                    table = restore(reader.read_all())
+                    df = table.to_pandas(types_mapper=pd.ArrowDtype)
+                    return arrow_pandas_result(expr, df)
+                schema = original_schema(reader.schema) or reader.schema
+                batches = restore_batches(
+                    (chunk.data for chunk in reader), reader.schema
+                )
+                df = batches_to_pandas(batches, schema, flight_info.total_records)
+                return pandas_result(expr, df)
+
+    def _execute_prepared(self, expr, params, limit, chunk_size, with_info=False):
+        from pyarrow.flight import FlightServerError
+
+        # the same query shape with other params only sends the params
+        key = (expr.op(), limit, chunk_size)
+        if (statement := self._prepared.get(key)) is not None:
+            self._prepared.move_to_end(key)
+            try:
+                return statement.execute_batches(params, with_info=with_info)
+            except FlightServerError as e:
+                if "Unknown prepared statement" not in str(e):
+                    raise
+                # the server was cleared since, prepare again
+        statement = self._prepared[key] = self.con.prepare(
+            expr, limit=limit, chunk_size=chunk_size
+        )
+        while len(self._prepared) > self._max_prepared:
+            _, evicted = self._prepared.popitem(last=False)
+            evicted.close()
+        return statement.execute_batches(params, with_info=with_info)
+
+
+def into_backend(expr, con, name=None):
+    """
+    Move the result of expr into con, see letsql.expr.relations.into_backend
 
-        batches = self.con.execute_batches(expr, params=params, limit=limit, chunk_size=chunk_size)
-        return pa.RecordBatchReader.from_batches(batches.schema, gen(batches))
+    When expr and con both live on flight servers the table is transferred
+    server to server and created eagerly, otherwise this defers to letsql.
+    """
+    backends, _ = expr._find_backends()
+    if (
+        isinstance(con, Backend)
+        and len(backends) == 1
+        and isinstance(backends[0], Backend)
+        and backends[0] is not con
+    ):
+        return con.register(expr, table_name=name or util.gen_name("into_backend"))
+    return _into_backend(expr, con, name=name)
@@ -0,0 +1,134 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import pyarrow.flight
+
+
+def check_cancelled(context):
+    """Raise if the client went away or cancelled the call"""
+    if context is not None and context.is_cancelled():
+        raise pyarrow.flight.FlightCancelledError("call cancelled by the client")
+
+
+def interrupt_backend(conn):
+    """
+    Interrupt the query running on a backend connection
+
+    Returns whether the backend could be interrupted: DuckDB can, DataFusion
+    has no way to abort a running plan and only stops between batches.
+    """
+    interrupt = getattr(getattr(conn, "con", None), "interrupt", None)
+    if interrupt is None:
+        return False
+    interrupt()
+    return True
+
+
+class RunningQuery:
+    def __init__(self, query_id, context=None):
+        self.query_id = query_id
+        self.context = context
+        self.cancelled = threading.Event()
+
+    @property
+    def is_cancelled(self):
+        return self.cancelled.is_set() or (
+            self.context is not None and self.context.is_cancelled()
+        )
+
+    def check(self):
+        """Raise if the query was cancelled, call between batches"""
+        if self.is_cancelled:
+            raise pyarrow.flight.FlightCancelledError(
+                f"query {self.query_id} cancelled"
+            )
+
+
+class QueryRegistry:
+    """
+    The queries a server is running, by id, so they can be cancelled
+
+    A query is cancelled by `cancel`, or when its client goes away: a monitor
+    thread polls the calls' contexts every `poll_interval` seconds. A
+    cancelled query stops at its next batch, and one executing on the backend
+    is interrupted right away.
+
+    Parameters
+    ----------
+    interrupt: callable
+        Interrupts whatever runs on the backend connection, for queries
+        executing without an interrupt of their own.
+    poll_interval: float
+        Seconds between checks of the running calls.
+    """
+
+    def __init__(self, interrupt, poll_interval=0.05):
+        self.interrupt = interrupt
+        self.poll_interval = poll_interval
+        self.queries = {}
+        # query id -> the interrupt of the connection it executes on
+        self._executing = {}
+        self._lock = threading.Lock()
+        self._monitor = None
+
+    @contextmanager
+    def track(self, query_id=None, context=None):
+        query = RunningQuery(query_id or uuid.uuid4().hex, context)
+        with self._lock:
+            self.queries[query.query_id] = query
+            if context is not None and self._monitor is None:
+                self._monitor = threading.Thread(
+                    target=self._watch, name="query-monitor", daemon=True
+                )
+                self._monitor.start()
+        try:
+            yield query
+        finally:
+            with self._lock:
+                if self.queries.get(query.query_id) is query:
+                    del self.queries[query.query_id]
+
+    @contextmanager
+    def executing(self, query, interrupt=None):
+        """
+        Mark query as running on the backend, cancelling it calls interrupt,
+        that of the connection it runs on
+        """
+        with self._lock:
+            self._executing[query.query_id] = interrupt or self.interrupt
+        try:
+            query.check()
+            yield
+        finally:
+            with self._lock:
+                self._executing.pop(query.query_id, None)
+
+    def cancel(self, query_id):
+        """Cancel a query, returns whether it was running"""
+        with self._lock:
+            query = self.queries.get(query_id)
+            if query is None:
+                return False
+            query.cancelled.set()
+            if (interrupt := self._executing.get(query_id)) is not None:
+                interrupt()
+            return True
+
+    def _watch(self):
+        while True:
+            with self._lock:
+                if not self.queries:
+                    self._monitor = None
+                    return
+                abandoned = [
+                    query.query_id
+                    for query in self.queries.values()
+                    if not query.cancelled.is_set()
+                    and query.context is not None
+                    and query.context.is_cancelled()
+                ]
+            for query_id in abandoned:
+                self.cancel(query_id)
+            time.sleep(self.poll_interval)
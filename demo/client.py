@@ -1,6 +1,7 @@
 import argparse
 import json
-import time
+import threading
+import weakref
 
 from concurrent.futures import ThreadPoolExecutor
 from queue import Queue
@@ -10,8 +11,28 @@ import pyarrow.flight
 
 from cloudpickle import dumps, loads
 
+from demo.coalesce import coalesce_batches, coalesce_options, coalesce_table
+from demo.ingest import COMMIT, decode_ack, put_command
+from demo.session import Session, SessionClient, pool as session_pool
+from demo.tracing import span
+from demo.wire import (
+    optimize_batches,
+    optimize_table,
+    original_schema,
+    restore,
+    restore_batches,
+    wire_options,
+)
+
 executor = ThreadPoolExecutor()
 
+# errors after which a spooled stream is resumed
+retryable_errors = (
+    pyarrow.flight.FlightUnavailableError,
+    pyarrow.flight.FlightTimedOutError,
+    pyarrow.flight.FlightInternalError,
+)
+
 
 class FlightClient:
     def __init__(
@@ -21,6 +42,8 @@ class FlightClient:
         username="test",
         password="password",
         tls_roots=None,
+        wire_optimize=False,
+        pool=None,
     ):
         """
         Initialize the DuckDB Flight Client
@@ -28,44 +51,48 @@ class FlightClient:
         Args:
             host: Server host
             port: Server port
+            wire_optimize: dictionary-encode and narrow columns of query results
+                and uploads on the wire, see demo.wire
+            pool: the SessionPool to share the channel and token from, None for
+                the process wide one, False for a session of its own
         """
-        kwargs = {}
-
+        tls_root_certs = None
         if tls_roots:
             with open(tls_roots, "rb") as root_certs:
-                kwargs["tls_root_certs"] = root_certs.read()
+                tls_root_certs = root_certs.read()
+
+        self.location = f"grpc+tls://{host}:{port}"
+        self._tls_root_certs = tls_root_certs
+        self._pool = session_pool if pool is None else pool
+        if self._pool:
+            self._session = self._pool.acquire(
+                self.location, username, password, tls_root_certs
+            )
+            self._release = weakref.finalize(self, self._pool.release, self._session)
+        else:
+            self._session = Session(self.location, username, password, tls_root_certs)
+            self._session.check()
+            self._release = weakref.finalize(self, self._session.close)
+        self._client = SessionClient(self._session)
+        self.wire_optimize = wire_options(wire_optimize)
 
-        self._client = pyarrow.flight.FlightClient(
-            f"grpc+tls://{host}:{port}", **kwargs
-        )
-        self._wait_on_healthcheck()
-        token_pair = self._client.authenticate_basic_token(
-            username.encode(), password.encode()
-        )
-        self._options = pyarrow.flight.FlightCallOptions(headers=[token_pair])
-
-    def _wait_on_healthcheck(self):
-        while True:
-            try:
-                self.do_action(
-                    "healthcheck",
-                    options=pyarrow.flight.FlightCallOptions(timeout=1),
-                )
-                print("done healthcheck")
-                break
-            except pyarrow.ArrowIOError as e:
-                if "Deadline" in str(e):
-                    print("Server is not ready, waiting...")
-                else:
-                    raise e
-            except pyarrow.flight.FlightUnavailableError:
-                pass
-            except pyarrow.flight.FlightUnauthenticatedError:
-                break
-            finally:
-                n_seconds = 1
-                print(f"Flight server unavailable, sleeping {n_seconds} seconds")
-                time.sleep(n_seconds)
+    @property
+    def _token_pair(self):
+        return self._session.token_pair
+
+    @property
+    def _options(self):
+        return self._session.options
+
+    def close(self):
+        """Release the session, see demo.session"""
+        self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def execute_query(self, query):
         """
@@ -79,15 +106,26 @@ class FlightClient:
         """
 
         batches = self.execute_batches(query)
-        return batches.read_all()
+        return restore(batches.read_all())
+
+    def execute_batches(self, expr, with_info=False, **kwargs):
+        """
+        Execute an expression and return a FlightStreamReader of the results,
+        or (FlightInfo, FlightStreamReader) with_info
+
+        With wire_optimize the batches read are in the wire schema, use
+        demo.wire.restore or restore_batches to get the original one back.
+        """
+        return self._execute_command({"expr": expr, **kwargs}, with_info)
 
-    def execute_batches(self, expr, **kwargs):
+    def _execute_command(self, command, with_info=False):
+        if self.wire_optimize:
+            command.setdefault("wire_optimize", self.wire_optimize)
+        with span("pickle"):
+            command = dumps(command)
         # Get FlightInfo
         flight_info = self._client.get_flight_info(
-            pyarrow.flight.FlightDescriptor.for_command(dumps({
-                "expr": expr,
-                **kwargs,
-            })),
+            pyarrow.flight.FlightDescriptor.for_command(command),
             options=self._options,
         )
 
@@ -97,16 +135,133 @@ class FlightClient:
         # Get the result
         reader = self._client.do_get(endpoint.ticket, options=self._options)
 
-        return reader
+        return (flight_info, reader) if with_info else reader
+
+    def cancel_query(self, query_id):
+        """
+        Cancel a query sent with query_id, e.g. execute_batches(expr, query_id=...)
+
+        Returns whether the query was running.
+        """
+        (cancelled,) = self.do_action("cancel-query", query_id, options=self._options)
+        return cancelled
+
+    def prepare(self, expr, **kwargs):
+        """
+        Keep an expression on the server to execute it repeatedly
+
+        Later executions only send the statement's handle and the values of
+        the expression's ibis.param()s.
+
+        Args:
+            expr: the expression, with ibis.param()s for the values that vary
+            kwargs: execution options, e.g. limit and chunk_size
+
+        Returns:
+            PreparedStatement
+        """
+        (result,) = self.do_action(
+            "prepare", {"expr": expr, **kwargs}, options=self._options
+        )
+        return PreparedStatement(self, **result)
+
+    def execute_spooled(self, expr, retries=3, **kwargs):
+        """
+        Execute an expression with a resumable, spooled result
+
+        The server writes the result to disk as it streams it. If the stream
+        breaks, reading resumes from the last batch received instead of running
+        the query again, up to `retries` times.
+
+        Returns:
+            pyarrow.RecordBatchReader
+        """
+        if self.wire_optimize:
+            kwargs.setdefault("wire_optimize", self.wire_optimize)
+        flight_info = self._client.get_flight_info(
+            pyarrow.flight.FlightDescriptor.for_command(dumps({
+                "expr": expr,
+                "spool": True,
+                **kwargs,
+            })),
+            options=self._options,
+        )
+        ticket = loads(flight_info.endpoints[0].ticket.ticket)
+
+        def read_from(offset):
+            return self._client.do_get(
+                pyarrow.flight.Ticket(dumps({**ticket, "offset": offset})),
+                options=self._options,
+            )
+
+        def gen(reader):
+            offset, attempts = 0, 0
+            while True:
+                try:
+                    for chunk in reader:
+                        offset += 1
+                        yield chunk.data
+                    return
+                except retryable_errors:
+                    attempts += 1
+                    if attempts > retries:
+                        raise
+                    print(f"Stream broke after {offset} batches, resuming")
+                    reader = read_from(offset)
+
+        reader = read_from(0)
+        schema = original_schema(reader.schema) or reader.schema
+        return pyarrow.RecordBatchReader.from_batches(
+            schema, restore_batches(gen(reader), reader.schema)
+        )
+
+    def pull_from(self, other, expr, table_name, **kwargs):
+        """
+        Create a table from the result of a query on another server
+
+        The other server's stream goes straight to this server, the data never
+        passes through the client.
+
+        Args:
+            other: FlightClient connected to the server to run expr on
+            expr: the expression to run on the other server
+            table_name: Name of the table to create on this server
+        """
+        flight_info = other._client.get_flight_info(
+            pyarrow.flight.FlightDescriptor.for_command(dumps({
+                "expr": expr,
+                **kwargs,
+            })),
+            options=other._options,
+        )
+        endpoint = flight_info.endpoints[0]
+        locations = [location.uri.decode() for location in endpoint.locations]
+        return self.do_action(
+            "pull-from",
+            {
+                "table_name": table_name,
+                "ticket": endpoint.ticket.ticket,
+                "location": locations[0] if locations else other.location,
+                # the other server's bearer token, so our password stays here
+                "headers": [other._token_pair],
+                "tls_root_certs": other._tls_root_certs,
+            },
+            options=self._options,
+        )
 
-    def upload_data(self, table_name, data):
+    def upload_data(self, table_name, data, coalesce=False):
         """
         Upload data to create or replace a table
 
         Args:
             table_name: Name of the table to create
             data: pyarrow.Table containing the data
+            coalesce: re-chunk the table before sending, see demo.coalesce
         """
+        if options := coalesce_options(coalesce):
+            data = coalesce_table(data, **options)
+        if self.wire_optimize:
+            data = optimize_table(data, **self.wire_optimize)
         writer, _ = self._client.do_put(
             pyarrow.flight.FlightDescriptor.for_command(table_name.encode("utf-8")),
             data.schema,
@@ -115,18 +270,52 @@ class FlightClient:
         writer.write_table(data)
         writer.close()
 
-    def upload_batches(self, table_name, reader):
+    def upload_batches(self, table_name, reader, coalesce=False):
+        schema, batches = reader.schema, reader
+        if options := coalesce_options(coalesce):
+            batches = coalesce_batches(reader, **options)
+        if self.wire_optimize:
+            # planned from the first batch, so this reads it before the put
+            schema, batches = optimize_batches(batches, schema, **self.wire_optimize)
         writer, _ = self._client.do_put(
             pyarrow.flight.FlightDescriptor.for_command(table_name.encode("utf-8")),
-            reader.schema,
+            schema,
             options=self._options,
         )
 
-        for i, batch in enumerate(reader, 1):
+        for i, batch in enumerate(batches, 1):
             writer.write_batch(batch)
         writer.done_writing()
         writer.close()
 
+    def appender(self, table_name, schema, **options):
+        """
+        Open a long lived stream appending to a table, see Appender
+
+        Args:
+            table_name: the table to append to, created if need be
+            schema: the schema of the batches, the table's if it exists
+            options: commit_rows, commit_bytes and commit_interval, when the
+                server commits what it received, see demo.ingest
+        """
+        writer, metadata_reader = self._client.do_put(
+            pyarrow.flight.FlightDescriptor.for_command(
+                put_command(table_name, append=options)
+            ),
+            schema,
+            options=self._options,
+        )
+        return Appender(writer, metadata_reader)
+
+    def append_batches(self, table_name, reader, **options):
+        """Append a RecordBatchReader (or Table) to a table, returns the acks"""
+        if isinstance(reader, pyarrow.Table):
+            reader = reader.to_reader()
+        with self.appender(table_name, reader.schema, **options) as appender:
+            for batch in reader:
+                appender.write(batch)
+        return appender.acks
+
     def list_tables(self):
         """
         List all available tables
@@ -151,15 +340,28 @@ class FlightClient:
             Table schema information
         """
         action = pyarrow.flight.Action("table_info", table_name.encode("utf-8"))
-        return next(
-            map(
-                loads,
-                (
-                    result.body.to_pybytes()
-                    for result in self._client.do_action(action, options=self._options)
-                ),
-            )
-        )
+        # read to the end, which completes the call
+        (result,) = self._client.do_action(action, options=self._options)
+        return loads(result.body.to_pybytes())
+
+    def get_table_stats(self, table_name):
+        """
+        Get the statistics the server gathered about a table
+
+        Returns:
+            A dict of num_rows, nbytes and per column null_count, nbytes,
+            min, max and approximate distinct count
+        """
+        action = pyarrow.flight.Action("table_stats", table_name.encode("utf-8"))
+        (result,) = self._client.do_action(action, options=self._options)
+        return loads(result.body.to_pybytes())
+
+    def add_udf(self, udf):
+        """
+        Register a demo.udf.VectorizedUDF with the server's backend, queries
+        the server executes can then call it by name
+        """
+        return self.do_action("add-udf", udf, options=self._options)
 
     def do_action(self, action_type, action_body="", options=None):
         try:
@@ -180,11 +382,43 @@ class FlightClient:
         except pyarrow.lib.ArrowIOError as e:
             print("Error calling action:", e)
 
-    def do_exchange_batches(self, command, reader):
+    def do_batch(self, actions, transaction=False):
+        """
+        Run several actions in one round trip
+
+        Args:
+            actions: (action_type, action_body) pairs, bodies are pickled like
+                do_action's unless they are bytes
+            transaction: run them atomically, all or nothing (DuckDB only)
+
+        Returns:
+            A tuple of results per action, in order
+        """
+        action = pyarrow.flight.Action(
+            "batch", dumps({"actions": list(actions), "transaction": transaction})
+        )
+        return [
+            loads(result.body.to_pybytes())
+            for result in self._client.do_action(action, options=self._options)
+        ]
+
+    def do_exchange_batches(self, command, reader, coalesce=False, output_schema=None):
+        """
+        Stream reader through an exchanger, or a list of exchangers chained on
+        the server, returns (future of counts, RecordBatchReader of results)
+
+        The output schema is asked of the server unless given.
+        """
+        if isinstance(command, (list, tuple)):
+            command = json.dumps(list(command))
+
         def do_writes(writer, reader):
             writer.begin(reader.schema)
+            batches = reader
+            if options := coalesce_options(coalesce):
+                batches = coalesce_batches(reader, **options)
             i = -1
-            for i, batch in enumerate(reader, 1):
+            for i, batch in enumerate(batches, 1):
                 writer.write_batch(batch)
             writer.done_writing()
             return i
@@ -221,13 +455,153 @@ class FlightClient:
             return output_schema
 
         queue = Queue()
-        output_schema = get_output_schema(command, reader)
+        if output_schema is None:
+            output_schema = get_output_schema(command, reader)
         fut = executor.submit(do_writes_reads, command, reader, queue)
         rbr = queue_to_rbr(output_schema, queue)
         return fut, rbr
 
     do_exchange = do_exchange_batches
 
+    def do_exchange_expr(self, expr, reader, coalesce=False):
+        """
+        Evaluate expr on the server against the batches of reader, streamed
+        through one do_exchange, see demo.expr.ExprExchanger
+
+        expr reads a placeholder table, e.g. ls.table(reader.schema, name="t"),
+        returns (future of counts, RecordBatchReader of results).
+        """
+        from demo.expr import ExprExchanger
+
+        exchanger = ExprExchanger(expr)
+        if not exchanger.schema_in_condition(reader.schema):
+            raise ValueError(f"expr needs {exchanger.schema_in}, got {reader.schema}")
+        return self.do_exchange_batches(
+            exchanger.command,
+            reader,
+            coalesce=coalesce,
+            output_schema=exchanger.calc_schema_out(reader.schema),
+        )
+
+
+class Appender:
+    """
+    A do_put stream appending to a table, see FlightClient.appender
+
+    The server acknowledges each commit with a dict: its sequence number
+    "commit", the "rows" it added, the rows "appended" by the stream so far
+    and the table's "num_rows". They are collected in `acks`.
+    """
+
+    def __init__(self, writer, metadata_reader):
+        self._writer = writer
+        self._metadata_reader = metadata_reader
+        self.rows_written = 0
+        self.acks = []
+        self.error = None
+        self._cond = threading.Condition()
+        self._acks_thread = threading.Thread(
+            target=self._read_acks, name="append-acks", daemon=True
+        )
+        self._acks_thread.start()
+
+    def _read_acks(self):
+        try:
+            while (buf := self._metadata_reader.read()) is not None:
+                with self._cond:
+                    self.acks.append(decode_ack(buf))
+                    self._cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._cond:
+                self._cond.notify_all()
+
+    def write(self, data):
+        """Send a RecordBatch or Table"""
+        if isinstance(data, pyarrow.Table):
+            for batch in data.to_batches():
+                self._writer.write_batch(batch)
+        else:
+            self._writer.write_batch(data)
+        self.rows_written += data.num_rows
+
+    def commit(self, timeout=None):
+        """Ask the server to commit what was sent, and wait for its ack"""
+        self._writer.write_metadata(pyarrow.py_buffer(COMMIT))
+        return self._wait_for(self.rows_written, timeout)
+
+    def _wait_for(self, rows, timeout=None):
+        with self._cond:
+            self._cond.wait_for(
+                lambda: (self.acks and self.acks[-1]["appended"] >= rows)
+                or self.error is not None
+                or not self._acks_thread.is_alive(),
+                timeout,
+            )
+            if self.error is not None:
+                raise self.error
+            return self.acks[-1] if self.acks else None
+
+    def close(self):
+        """Finish the stream, the server commits what is left"""
+        self._writer.done_writing()
+        self._acks_thread.join()
+        self._writer.close()
+        if self.error is not None:
+            raise self.error
+        return self.acks[-1] if self.acks else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PreparedStatement:
+    """
+    A handle to an expression prepared on the server, see FlightClient.prepare
+    """
+
+    def __init__(self, client, handle, schema, parameters):
+        self.client = client
+        self.handle = handle
+        self.schema = schema
+        # parameter name -> ibis dtype
+        self.parameters = parameters
+
+    def _bind(self, params):
+        # bind by ibis.param() or by its name
+        return {
+            key.op().name if hasattr(key, "op") else key: value
+            for key, value in (params or {}).items()
+        }
+
+    def execute_batches(self, params=None, with_info=False, **kwargs):
+        """
+        Execute with params, a mapping of ibis.param()s (or their names) to
+        values, and return a FlightStreamReader of the results, see
+        FlightClient.execute_batches
+        """
+        return self.client._execute_command(
+            {"handle": self.handle, "params": self._bind(params), **kwargs}, with_info
+        )
+
+    def execute(self, params=None, **kwargs):
+        return restore(self.execute_batches(params, **kwargs).read_all())
+
+    def close(self):
+        self.client.do_action(
+            "close-prepared", self.handle, options=self.client._options
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -0,0 +1,183 @@
+import queue
+import threading
+import time
+
+import pyarrow as pa
+
+
+DEFAULT_TARGET_ROWS = 64 * 1024
+DEFAULT_TARGET_BYTES = 4 * 1024 * 1024
+DEFAULT_MAX_LATENCY = 0.05
+
+
+def coalesce_options(coalesce):
+    """
+    Normalise a `coalesce` argument: None or False turn coalescing off, True
+    uses the defaults and a dict overrides any of target_rows, target_bytes
+    and max_latency
+    """
+    if not coalesce:
+        return None
+    options = {
+        "target_rows": DEFAULT_TARGET_ROWS,
+        "target_bytes": DEFAULT_TARGET_BYTES,
+        "max_latency": DEFAULT_MAX_LATENCY,
+    }
+    if isinstance(coalesce, dict):
+        unknown = set(coalesce) - set(options)
+        if unknown:
+            raise ValueError(f"unknown coalesce options {sorted(unknown)}")
+        options.update(coalesce)
+    return options
+
+
+def _merge(batches):
+    if len(batches) == 1:
+        return batches[0]
+    table = pa.Table.from_batches(batches).combine_chunks()
+    return table.to_batches()[0]
+
+
+def _split(batch, target_rows):
+    for offset in range(0, batch.num_rows, target_rows):
+        yield batch.slice(offset, target_rows)
+
+
+class Chunk:
+    """A stand-in for FlightStreamChunk"""
+
+    def __init__(self, data, app_metadata=None):
+        self.data = data
+        self.app_metadata = app_metadata
+
+
+def _prefetch(chunks, stopped):
+    """
+    A queue the chunks are put on by a thread of their own, as (chunk, None)
+    pairs ending with (None, error), error being None once they all were
+    """
+    pending = queue.Queue(maxsize=1)
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def pull():
+        try:
+            for chunk in chunks:
+                if not put((chunk, None)):
+                    return
+        except BaseException as e:
+            put((None, e))
+            return
+        put((None, None))
+
+    threading.Thread(target=pull, name="coalesce", daemon=True).start()
+    return pending
+
+
+def _arrivals(chunks, deadline, stopped):
+    """
+    The chunks, and None whenever deadline() (a time.monotonic() or None
+    for no deadline) passes before the next one arrives; without a stopped
+    event the chunks are read here and the deadline is not kept
+    """
+    if stopped is None:
+        yield from chunks
+        return
+    pending = _prefetch(chunks, stopped)
+    while True:
+        due = deadline()
+        timeout = None if due is None else max(due - time.monotonic(), 0)
+        try:
+            chunk, error = pending.get(timeout=timeout)
+        except queue.Empty:
+            yield None
+            continue
+        if chunk is None:
+            if error is not None:
+                raise error
+            return
+        yield chunk
+
+
+def coalesce_chunks(
+    chunks,
+    target_rows=DEFAULT_TARGET_ROWS,
+    target_bytes=DEFAULT_TARGET_BYTES,
+    max_latency=DEFAULT_MAX_LATENCY,
+):
+    """
+    Merge small chunks of a flight stream and split large ones
+
+    Batches are buffered until they reach target_rows or target_bytes, or the
+    oldest buffered batch has waited max_latency seconds, whether or not
+    more arrive: with a max_latency the chunks are read by a thread of their
+    own, so a stalled upstream, e.g. a peer waiting for a reply, still gets
+    what was buffered. Chunks carrying app_metadata flush the buffer and pass
+    through as they are.
+    """
+    buffered, rows, nbytes, started = [], 0, 0, None
+
+    def flush():
+        nonlocal buffered, rows, nbytes
+        chunk = Chunk(_merge(buffered))
+        buffered, rows, nbytes = [], 0, 0
+        return chunk
+
+    def deadline():
+        if buffered and max_latency is not None:
+            return started + max_latency
+        return None
+
+    stopped = None if max_latency is None else threading.Event()
+    try:
+        for chunk in _arrivals(chunks, deadline, stopped):
+            if chunk is None:
+                # the oldest batch waited max_latency
+                yield flush()
+                continue
+            if chunk.app_metadata is not None or chunk.data is None:
+                if buffered:
+                    yield flush()
+                yield chunk
+                continue
+            for batch in _split(chunk.data, target_rows):
+                if not buffered:
+                    started = time.monotonic()
+                buffered.append(batch)
+                rows += batch.num_rows
+                nbytes += batch.nbytes
+                if (
+                    rows >= target_rows
+                    or nbytes >= target_bytes
+                    or (deadline() is not None and time.monotonic() >= deadline())
+                ):
+                    yield flush()
+        if buffered:
+            yield flush()
+    finally:
+        if stopped is not None:
+            # a consumer gone early lets go of the thread
+            stopped.set()
+
+
+def coalesce_batches(batches, **options):
+    """Like coalesce_chunks, for an iterable of record batches"""
+    chunks = coalesce_chunks((Chunk(batch) for batch in batches), **options)
+    return (chunk.data for chunk in chunks)
+
+
+def coalesce_table(table, target_rows=DEFAULT_TARGET_ROWS, **_):
+    """Re-chunk a table into batches of target_rows"""
+    if table.num_rows == 0:
+        return table
+    return pa.Table.from_batches(
+        table.combine_chunks().to_batches(max_chunksize=target_rows)
+    )
+
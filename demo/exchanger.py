@@ -5,9 +5,9 @@ from abc import (
     abstractproperty,
 )
 
-import pandas as pd
 import pyarrow as pa
-import requests
+
+from demo.cancel import check_cancelled
 
 
 def schemas_equal(s0, s1):
@@ -20,6 +20,8 @@ def schemas_equal(s0, s1):
 def streaming_exchange(f, context, reader, writer, options=None, **kwargs):
     started = False
     for chunk in (chunk for chunk in reader if chunk.data):
+        # stop working for a client that went away
+        check_cancelled(context)
         out = f(chunk.data, metadata=chunk.app_metadata)
         if not started:
             writer.begin(out.schema, options=options)
@@ -82,6 +84,7 @@ class EchoExchanger(AbstractExchanger):
             """Run a simple echo server."""
             started = False
             for chunk in reader:
+                check_cancelled(context)
                 if not started and chunk.data:
                     writer.begin(chunk.data.schema, options=options)
                     started = True
@@ -245,6 +248,9 @@ class UrlOperatorExchanger(AbstractExchanger):
     def exchange_f(cls):
         def exchange_transform(context, reader, writer):
             """fetch the url and return the length of the response content"""
+            import pandas as pd
+            import requests
+
             if not cls.schema_in_condition(reader.schema):
                 raise pa.ArrowInvalid("Input does not satisfy schema_in_condition")
             table = reader.read_all()
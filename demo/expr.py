@@ -0,0 +1,162 @@
+import base64
+
+import pyarrow as pa
+from cloudpickle import dumps, loads
+
+from demo.cancel import check_cancelled
+from demo.exchanger import AbstractExchanger
+
+
+# the prefix of an exchange command carrying an expression
+PREFIX = "expr:"
+
+
+def is_expr(command):
+    """An expression command is PREFIX and the base64 of the pickled expression"""
+    return command.startswith(PREFIX)
+
+
+class ExprExchanger(AbstractExchanger):
+    """
+    An expression evaluated against the batches of an exchange
+
+    The expression reads a single placeholder table, e.g. one made with
+    ls.table(schema, name=...), which stands for the uploaded stream. The
+    command carries the expression, so a client needs no action to set it up
+    and can compute the output schema itself. Filters and projections run on
+    each batch as it arrives and their results stream back, a limit stops
+    evaluating once it has its rows. Aggregates of sums, counts, minimums,
+    maximums and means are computed per batch and merged at the end of the
+    stream. Any other expression runs once the whole stream is read.
+
+    Batches are evaluated by an in-memory connection private to the exchange,
+    nothing is registered with the server's catalog.
+
+    Parameters
+    ----------
+    expr: ibis expression
+        Over a single table, whose columns the stream must have.
+    """
+
+    def __init__(self, expr):
+        import ibis.expr.operations as ops
+
+        (table,) = expr.op().find((ops.UnboundTable, ops.DatabaseTable))
+        self.expr = expr.as_table()
+        self.table_name = table.name
+        self.schema_in = table.schema.to_pyarrow()
+
+    @classmethod
+    def from_command(cls, command):
+        return cls(loads(base64.b64decode(command[len(PREFIX) :])))
+
+    def _run(self, con, expr, data):
+        con.con.register(self.table_name, data)
+        try:
+            return con.to_pyarrow(expr)
+        finally:
+            con.con.unregister(self.table_name)
+
+    @property
+    def exchange_f(self):
+        def exchange_expr(context, reader, writer, **kwargs):
+            import ibis
+            import ibis.expr.operations as ops
+            import letsql as ls
+
+            from demo.plan import is_scan, split_aggregate
+
+            if not self.schema_in_condition(reader.schema):
+                raise pa.ArrowInvalid(
+                    f"the expression's table needs {self.schema_in}, got {reader.schema}"
+                )
+            con = ls.duckdb.connect()
+            schema_out = self.calc_schema_out(reader.schema)
+            writer.begin(schema_out)
+
+            def tables():
+                for chunk in reader:
+                    check_cancelled(context)
+                    if chunk.data is not None and chunk.data.num_rows:
+                        # only the placeholder's columns, in its order
+                        table = pa.Table.from_batches([chunk.data])
+                        yield table.select(self.schema_in.names).cast(self.schema_in)
+
+            def write(table):
+                if table.num_rows:
+                    writer.write_table(table.cast(schema_out))
+
+            op = self.expr.op()
+            limit = None
+            if (
+                isinstance(op, ops.Limit)
+                and isinstance(op.n, int)
+                and op.offset == 0
+                and is_scan(op.parent)
+            ):
+                limit, op = op.n, op.parent
+
+            if is_scan(op):
+                expr = op.to_expr()
+                for table in tables():
+                    if limit is not None and limit <= 0:
+                        # drain the stream, the client still writes it
+                        continue
+                    result = self._run(con, expr, table)
+                    if limit is not None:
+                        result = result.slice(0, limit)
+                        limit -= result.num_rows
+                    write(result)
+            elif (split := split_aggregate(op)) is not None:
+                partial, merge = split
+                partial = partial.to_expr()
+                partials = [self._run(con, partial, table) for table in tables()]
+                if not partials:
+                    # an aggregate without groups has a row even for no rows
+                    partials = [self._run(con, partial, self.schema_in.empty_table())]
+                write(con.to_pyarrow(merge(ibis.memtable(pa.concat_tables(partials)))))
+            else:
+                table = pa.concat_tables([self.schema_in.empty_table(), *tables()])
+                write(self._run(con, self.expr, table))
+
+        return exchange_expr
+
+    @property
+    def schema_in_required(self):
+        return self.schema_in
+
+    @property
+    def schema_in_condition(self):
+        def condition(schema_in):
+            return all(
+                field.name in schema_in.names
+                and schema_in.field(field.name).type == field.type
+                for field in self.schema_in
+            )
+
+        return condition
+
+    @property
+    def calc_schema_out(self):
+        def f(schema_in):
+            return self.expr.schema().to_pyarrow()
+
+        return f
+
+    @property
+    def description(self):
+        return f"an expression over {self.table_name}"
+
+    @property
+    def command(self):
+        return PREFIX + base64.b64encode(dumps(self.expr)).decode("ascii")
+
+    @property
+    def query_result(self):
+        return {
+            "schema-in-required": self.schema_in_required,
+            "schema-in-condition": self.schema_in_condition,
+            "calc-schema-out": self.calc_schema_out,
+            "description": self.description,
+            "command": self.command,
+        }
@@ -0,0 +1,492 @@
+import re
+import uuid
+
+import pyarrow as pa
+import pyarrow.flight as paf
+
+import demo.scheduler as S
+
+from demo.action import AbstractAction
+from demo.stats import TableStats
+
+
+# Flight SQL clients, e.g. ADBC's flightsql driver, send protobuf messages
+# packed in a google.protobuf.Any. The few fields needed are encoded and
+# decoded by hand, see encode and decode, so there is no protobuf dependency.
+TYPE_URL_PREFIX = "type.googleapis.com/arrow.flight.protocol.sql."
+
+# TableDefinitionOptions of a CommandStatementIngest
+IF_NOT_EXIST_CREATE, IF_NOT_EXIST_FAIL = 1, 2
+IF_EXISTS_FAIL, IF_EXISTS_APPEND, IF_EXISTS_REPLACE = 1, 2, 3
+
+CATALOGS_SCHEMA = pa.schema([pa.field("catalog_name", pa.utf8(), nullable=False)])
+DB_SCHEMAS_SCHEMA = pa.schema(
+    [
+        pa.field("catalog_name", pa.utf8()),
+        pa.field("db_schema_name", pa.utf8(), nullable=False),
+    ]
+)
+TABLES_SCHEMA = pa.schema(
+    [
+        pa.field("catalog_name", pa.utf8()),
+        pa.field("db_schema_name", pa.utf8()),
+        pa.field("table_name", pa.utf8(), nullable=False),
+        pa.field("table_type", pa.utf8(), nullable=False),
+    ]
+)
+TABLES_WITH_SCHEMA_SCHEMA = TABLES_SCHEMA.append(
+    pa.field("table_schema", pa.binary(), nullable=False)
+)
+TABLE_TYPES_SCHEMA = pa.schema([pa.field("table_type", pa.utf8(), nullable=False)])
+TABLE_TYPE = "TABLE"
+
+
+def _encode_varint(n):
+    # negative int64s are sent as their two's complement
+    n &= (1 << 64) - 1
+    out = bytearray()
+    while n > 0x7F:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _decode_varint(buf, pos):
+    n = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return n, pos
+        shift += 7
+
+
+def encode(*fields):
+    """
+    A protobuf message of (field number, value) pairs
+
+    ints and bools are varints, str and bytes length-delimited, lists are
+    repeated fields and None values are left out.
+    """
+    out = bytearray()
+    for number, value in fields:
+        for value in value if isinstance(value, list) else [value]:
+            if value is None:
+                continue
+            if isinstance(value, (bool, int)):
+                out += _encode_varint(number << 3) + _encode_varint(int(value))
+            else:
+                if isinstance(value, str):
+                    value = value.encode("utf-8")
+                out += _encode_varint(number << 3 | 2)
+                out += _encode_varint(len(value)) + value
+    return bytes(out)
+
+
+def decode(buf):
+    """
+    The fields of a protobuf message, field number -> list of values
+
+    Varints are ints, length-delimited values bytes, fixed width ones are
+    skipped.
+    """
+    buf = memoryview(bytes(buf))
+    fields, pos = {}, 0
+    while pos < len(buf):
+        key, pos = _decode_varint(buf, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _decode_varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = _decode_varint(buf, pos)
+            value, pos = bytes(buf[pos : pos + length]), pos + length
+        elif wire_type in (1, 5):
+            pos += 8 if wire_type == 1 else 4
+            continue
+        else:
+            raise ValueError(f"unsupported protobuf wire type {wire_type}")
+        fields.setdefault(number, []).append(value)
+    return fields
+
+
+def _get(fields, number, default=None):
+    # the last value wins, as in protobuf
+    values = fields.get(number)
+    return values[-1] if values else default
+
+
+def _str(fields, number, default=None):
+    value = _get(fields, number)
+    return default if value is None else value.decode("utf-8")
+
+
+def pack(name, message=b""):
+    """An Any of the Flight SQL message name, e.g. "CommandStatementQuery" """
+    return encode((1, TYPE_URL_PREFIX + name), (2, message))
+
+
+def unpack(buf):
+    """(name, message) of an Any packing a Flight SQL message, None otherwise"""
+    # an Any starts with its type_url, field 1 length-delimited
+    if not buf or buf[:1] != b"\n":
+        return None
+    try:
+        fields = decode(buf)
+        type_url = _str(fields, 1, "")
+    except (ValueError, IndexError, UnicodeDecodeError):
+        return None
+    if not type_url.startswith(TYPE_URL_PREFIX):
+        return None
+    return type_url[len(TYPE_URL_PREFIX) :], _get(fields, 2, b"")
+
+
+def _like(pattern):
+    """A regex of a SQL LIKE pattern, None matches anything"""
+    if pattern is None:
+        return None
+    parts = (
+        ".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern
+    )
+    return re.compile("".join(parts), re.DOTALL)
+
+
+def _matches(regex, value):
+    return regex is None or regex.fullmatch(value) is not None
+
+
+class SQLStatement:
+    """
+    A Flight SQL prepared statement, a query and its bound parameters
+
+    Parameters are bound as record batches, the query is executed once per
+    row of parameters and the results concatenated.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.parameters = None
+
+    def schema(self, server):
+        """The result's schema, None if it needs the parameters to be known"""
+        if "?" in self.query or "$" in self.query:
+            return None
+        with server._conn_lock:
+            try:
+                return server._conn.sql(self.query).schema().to_pyarrow()
+            except Exception:
+                return None
+
+    def execute(self, server):
+        with server._query_backend() as (conn, lock), lock:
+            con = conn.con
+            if not self.parameters:
+                return con.execute(self.query).arrow()
+            return pa.concat_tables(
+                [con.execute(self.query, row).arrow() for row in self.parameters]
+            )
+
+
+def _update_result(record_count):
+    # DoPutUpdateResult
+    return pa.py_buffer(encode((1, record_count)))
+
+
+def _written_tables(query):
+    """
+    The names of the tables a statement creates, changes or drops, None if
+    they can not be told, e.g. the statement does not parse
+    """
+    import sqlglot
+    from sqlglot import exp
+
+    try:
+        statements = sqlglot.parse(query, read="duckdb")
+    except sqlglot.errors.ParseError:
+        return None
+    names = set()
+    for statement in statements:
+        if statement is None or isinstance(statement, exp.Query):
+            continue
+        if not isinstance(
+            statement,
+            (exp.Create, exp.Drop, exp.Insert, exp.Update, exp.Delete, exp.Alter),
+        ):
+            return None
+        # the tables a subquery reads are left alone
+        names.update(
+            table.name
+            for table in statement.find_all(exp.Table)
+            if table.find_ancestor(exp.Query) is None
+        )
+    return names
+
+
+def _forget_tables(server, names):
+    """
+    Drop what the server cached about the tables a statement may have
+    changed, about every table if they can not be told
+    """
+    if names is None:
+        names = {*server.parquet_tables, *server.memory.tables, *server._conn.tables}
+    for name in names:
+        # not the files, e.g. a renamed view may still read them
+        server.memory.forget(name, remove_files=False)
+        server.table_written(name)
+
+
+def _execute_update(server, query, parameters=None):
+    """Run a statement that returns no rows, returns its row count or -1"""
+    con = server._conn.con
+    with server._conn_lock:
+        try:
+            counts = [
+                con.execute(query, row).fetchall() for row in (parameters or [None])
+            ]
+        finally:
+            # statements commit one by one, so even a failure may change tables
+            _forget_tables(server, _written_tables(query))
+    total = 0
+    for rows in counts:
+        # DuckDB answers inserts, updates and deletes with a count
+        if len(rows) != 1 or len(rows[0]) != 1 or not isinstance(rows[0][0], int):
+            return -1
+        total += rows[0][0]
+    return total
+
+
+def get_flight_info(server, context, descriptor, name, message):
+    fields = decode(message)
+    if name == "CommandStatementQuery":
+        query = _str(fields, 1)
+        with server._conn_lock:
+            try:
+                schema = server._conn.sql(query).schema().to_pyarrow()
+            except Exception as e:
+                raise paf.FlightServerError(f"Error preparing query: {e}")
+        ticket = pack("TicketStatementQuery", encode((1, query)))
+    elif name == "CommandPreparedStatementQuery":
+        statement = _statement(server, _get(fields, 1))
+        schema = statement.schema(server)
+        if schema is None:
+            schema = statement.execute(server).schema
+        ticket = descriptor.command
+    elif name in _metadata_schemas:
+        schema = _metadata_schemas[name](fields)
+        ticket = descriptor.command
+    else:
+        raise paf.FlightServerError(f"Unsupported Flight SQL command {name}")
+    endpoints = [paf.FlightEndpoint(ticket, [server._location])]
+    return paf.FlightInfo(schema, descriptor, endpoints, -1, -1)
+
+
+def do_get(server, context, name, message):
+    fields = decode(message)
+    if name == "TicketStatementQuery":
+        query = _get(fields, 1).decode("utf-8")
+        with server._conn_lock:
+            expr = server._conn.sql(query)
+        with (
+            server.queries.track(None, context) as running,
+            server.scheduler.admit(S.QUERY, server._user(context)),
+        ):
+            try:
+                result = server._execute(running, expr)
+            except paf.FlightCancelledError:
+                raise
+            except Exception as e:
+                raise paf.FlightServerError(f"Error executing query: {e}")
+    elif name == "CommandPreparedStatementQuery":
+        statement = _statement(server, _get(fields, 1))
+        with server.scheduler.admit(S.QUERY, server._user(context)):
+            result = statement.execute(server)
+    elif name in _metadata_tables:
+        result = _metadata_tables[name](server, fields)
+    else:
+        raise paf.FlightServerError(f"Unsupported Flight SQL ticket {name}")
+    return paf.RecordBatchStream(result)
+
+
+def do_put(server, context, name, message, reader, writer):
+    fields = decode(message)
+    if name == "CommandStatementIngest":
+        with server.scheduler.admit(S.WRITE, server._user(context)):
+            num_rows = _ingest(server, fields, reader.read_all())
+        writer.write(_update_result(num_rows))
+    elif name == "CommandStatementUpdate":
+        with server.scheduler.admit(S.WRITE, server._user(context)):
+            count = _execute_update(server, _str(fields, 1))
+        writer.write(_update_result(count))
+    elif name == "CommandPreparedStatementQuery":
+        # binds parameters, answered with a DoPutPreparedStatementResult
+        handle = _get(fields, 1)
+        statement = _statement(server, handle)
+        statement.parameters = [
+            list(row.values()) for row in reader.read_all().to_pylist()
+        ]
+        writer.write(pa.py_buffer(encode((1, handle))))
+    elif name == "CommandPreparedStatementUpdate":
+        statement = _statement(server, _get(fields, 1))
+        parameters = [list(row.values()) for row in reader.read_all().to_pylist()]
+        with server.scheduler.admit(S.WRITE, server._user(context)):
+            count = _execute_update(server, statement.query, parameters)
+        writer.write(_update_result(count))
+    else:
+        raise paf.FlightServerError(f"Unsupported Flight SQL command {name}")
+
+
+def _statement(server, handle):
+    statement = server.sql_statements.get(handle)
+    if statement is None:
+        raise paf.FlightServerError(f"Unknown prepared statement {handle!r}")
+    return statement
+
+
+def _ingest(server, fields, data):
+    """Create, replace or append to a table from a CommandStatementIngest"""
+    options = decode(_get(fields, 1, b""))
+    if_not_exist = _get(options, 1, 0)
+    if_exists = _get(options, 2, 0)
+    table_name = _str(fields, 2)
+    stats = TableStats.from_table(data)
+    with server._conn_lock:
+        exists = table_name in server._conn.tables
+        if exists and if_exists in (0, IF_EXISTS_FAIL):
+            raise paf.FlightServerError(f"Table {table_name} already exists")
+        if not exists and if_not_exist == IF_NOT_EXIST_FAIL:
+            raise paf.FlightServerError(f"Table {table_name} does not exist")
+        if exists and if_exists == IF_EXISTS_APPEND:
+            try:
+                server.memory.append(server._conn, table_name, data, stats)
+            except ValueError as e:
+                raise paf.FlightServerError(str(e))
+        else:
+            server.memory.register(server._conn, table_name, data, stats)
+        server.table_written(table_name)
+    return data.num_rows
+
+
+def _catalog(server):
+    return server._conn.current_catalog, server._conn.current_database
+
+
+def _catalogs(server, fields):
+    catalog, _ = _catalog(server)
+    return pa.Table.from_pylist([{"catalog_name": catalog}], schema=CATALOGS_SCHEMA)
+
+
+def _db_schemas(server, fields):
+    catalog, db_schema = _catalog(server)
+    rows = []
+    if _get(fields, 1, catalog.encode()).decode() == catalog and _matches(
+        _like(_str(fields, 2)), db_schema
+    ):
+        rows.append({"catalog_name": catalog, "db_schema_name": db_schema})
+    return pa.Table.from_pylist(rows, schema=DB_SCHEMAS_SCHEMA)
+
+
+def _tables(server, fields):
+    catalog, db_schema = _catalog(server)
+    include_schema = bool(_get(fields, 5, 0))
+    table_types = [value.decode() for value in fields.get(4, [])]
+    rows = []
+    if (
+        _get(fields, 1, catalog.encode()).decode() == catalog
+        and _matches(_like(_str(fields, 2)), db_schema)
+        and (not table_types or TABLE_TYPE in table_types)
+    ):
+        table_name = _like(_str(fields, 3))
+        with server._conn_lock:
+            for name in server._conn.tables:
+                if not _matches(table_name, name):
+                    continue
+                row = {
+                    "catalog_name": catalog,
+                    "db_schema_name": db_schema,
+                    "table_name": name,
+                    "table_type": TABLE_TYPE,
+                }
+                if include_schema:
+                    schema = server._conn.get_schema(name).to_pyarrow()
+                    row["table_schema"] = schema.serialize().to_pybytes()
+                rows.append(row)
+    schema = TABLES_WITH_SCHEMA_SCHEMA if include_schema else TABLES_SCHEMA
+    return pa.Table.from_pylist(rows, schema=schema)
+
+
+def _table_types(server, fields):
+    return pa.Table.from_pylist([{"table_type": TABLE_TYPE}], schema=TABLE_TYPES_SCHEMA)
+
+
+_metadata_tables = {
+    "CommandGetCatalogs": _catalogs,
+    "CommandGetDbSchemas": _db_schemas,
+    "CommandGetTables": _tables,
+    "CommandGetTableTypes": _table_types,
+}
+_metadata_schemas = {
+    "CommandGetCatalogs": lambda fields: CATALOGS_SCHEMA,
+    "CommandGetDbSchemas": lambda fields: DB_SCHEMAS_SCHEMA,
+    "CommandGetTables": lambda fields: (
+        TABLES_WITH_SCHEMA_SCHEMA if _get(fields, 5, 0) else TABLES_SCHEMA
+    ),
+    "CommandGetTableTypes": lambda fields: TABLE_TYPES_SCHEMA,
+}
+
+
+class CreatePreparedStatementAction(AbstractAction):
+    @classmethod
+    @property
+    def name(cls):
+        return "CreatePreparedStatement"
+
+    @classmethod
+    @property
+    def description(cls):
+        return "Flight SQL: prepare a SQL statement."
+
+    @classmethod
+    def do_action(cls, server, context, action):
+        unpacked = unpack(action.body.to_pybytes())
+        if unpacked is None or unpacked[0] != "ActionCreatePreparedStatementRequest":
+            raise paf.FlightServerError("Expected an ActionCreatePreparedStatementRequest")
+        statement = SQLStatement(_str(decode(unpacked[1]), 1))
+        handle = uuid.uuid4().hex.encode()
+        server.sql_statements[handle] = statement
+        schema = statement.schema(server)
+        result = encode(
+            (1, handle),
+            (2, None if schema is None else schema.serialize().to_pybytes()),
+        )
+        yield paf.Result(pack("ActionCreatePreparedStatementResult", result))
+
+
+class ClosePreparedStatementAction(AbstractAction):
+    @classmethod
+    @property
+    def name(cls):
+        return "ClosePreparedStatement"
+
+    @classmethod
+    @property
+    def description(cls):
+        return "Flight SQL: close a prepared statement."
+
+    @classmethod
+    def do_action(cls, server, context, action):
+        unpacked = unpack(action.body.to_pybytes())
+        if unpacked is None or unpacked[0] != "ActionClosePreparedStatementRequest":
+            raise paf.FlightServerError("Expected an ActionClosePreparedStatementRequest")
+        server.sql_statements.pop(_get(decode(unpacked[1]), 1), None)
+        # answered with no results
+        yield from ()
+
+
+actions = {
+    action.name: action
+    for action in (
+        CreatePreparedStatementAction,
+        ClosePreparedStatementAction,
+    )
+}
@@ -0,0 +1,118 @@
+import json
+import time
+
+import pyarrow as pa
+
+
+DEFAULT_COMMIT_ROWS = 64 * 1024
+DEFAULT_COMMIT_BYTES = 16 * 1024 * 1024
+DEFAULT_COMMIT_INTERVAL = 1.0
+
+# app_metadata of a message asking to commit what was sent so far
+COMMIT = b"commit"
+
+
+def append_options(options):
+    """
+    Normalise the options of an append: None or True use the defaults and a
+    dict overrides any of commit_rows, commit_bytes and commit_interval
+    """
+    defaults = {
+        "commit_rows": DEFAULT_COMMIT_ROWS,
+        "commit_bytes": DEFAULT_COMMIT_BYTES,
+        "commit_interval": DEFAULT_COMMIT_INTERVAL,
+    }
+    if isinstance(options, dict):
+        unknown = set(options) - set(defaults)
+        if unknown:
+            raise ValueError(f"unknown append options {sorted(unknown)}")
+        defaults.update(options)
+    return defaults
+
+
+def parse_put_command(command):
+    """
+    The table name and append options of a do_put descriptor command
+
+    A plain table name creates or replaces the table, a JSON object
+    {"table_name": ..., "mode": "append", ...} appends to it.
+    """
+    if not command.startswith(b"{"):
+        return command.decode("utf-8"), None
+    args = json.loads(command)
+    table_name = args.pop("table_name")
+    mode = args.pop("mode", "append")
+    if mode == "create":
+        return table_name, None
+    if mode != "append":
+        raise ValueError(f"unknown put mode {mode!r}")
+    return table_name, append_options(args)
+
+
+def put_command(table_name, append=None):
+    """The descriptor command of a do_put, see parse_put_command"""
+    if append is None:
+        return table_name.encode("utf-8")
+    options = {} if append is True else dict(append)
+    return json.dumps({"table_name": table_name, "mode": "append", **options}).encode()
+
+
+def append_stream(
+    chunks,
+    commit,
+    commit_rows=DEFAULT_COMMIT_ROWS,
+    commit_bytes=DEFAULT_COMMIT_BYTES,
+    commit_interval=DEFAULT_COMMIT_INTERVAL,
+):
+    """
+    Commit the batches of a stream of chunks in groups, yield an ack per commit
+
+    The batches received are committed by commit(batches) once they reach
+    commit_rows rows or commit_bytes bytes, once the oldest has waited
+    commit_interval seconds, when a chunk's app_metadata asks to commit, and
+    at the end of the stream. The interval is checked as chunks arrive, an
+    idle stream commits with its next message.
+    """
+    pending = []
+    n_rows = n_bytes = 0
+    since = None
+    n_commits = appended = 0
+
+    def flush():
+        nonlocal pending, n_rows, n_bytes, since, n_commits, appended
+        num_rows = commit(pending)
+        n_commits += 1
+        appended += n_rows
+        ack = {
+            "commit": n_commits,
+            "rows": n_rows,
+            "appended": appended,
+            "num_rows": num_rows,
+        }
+        pending, n_rows, n_bytes, since = [], 0, 0, None
+        return ack
+
+    for chunk in chunks:
+        if chunk.data is not None and chunk.data.num_rows:
+            pending.append(chunk.data)
+            n_rows += chunk.data.num_rows
+            n_bytes += chunk.data.nbytes
+            if since is None:
+                since = time.monotonic()
+        if (
+            chunk.app_metadata == COMMIT
+            or n_rows >= commit_rows
+            or n_bytes >= commit_bytes
+            or (since is not None and time.monotonic() - since >= commit_interval)
+        ):
+            yield flush()
+    if pending:
+        yield flush()
+
+
+def encode_ack(ack):
+    return pa.py_buffer(json.dumps(ack).encode())
+
+
+def decode_ack(buf):
+    return json.loads(buf.to_pybytes())
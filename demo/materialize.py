@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from ibis.expr import types as ir
+from ibis.formats.pandas import PandasData
+
+
+def _numeric(typ):
+    return (
+        pa.types.is_integer(typ) or pa.types.is_floating(typ) or pa.types.is_boolean(typ)
+    )
+
+
+class _NumpyColumn:
+    """
+    A numeric column filled batch by batch into a pre-allocated NumPy array
+
+    Nulls are recorded in a mask and applied at the end the way Arrow's
+    to_pandas does: integers become floats with NaN, booleans objects with
+    None.
+    """
+
+    def __init__(self, typ, capacity):
+        self.type = typ
+        self.values = np.empty(capacity, dtype=typ.to_pandas_dtype())
+        self.mask = None
+        self.length = 0
+
+    def _reserve(self, n):
+        capacity = len(self.values)
+        if self.length + n <= capacity:
+            return
+        values = np.empty(max(2 * capacity, self.length + n), dtype=self.values.dtype)
+        values[: self.length] = self.values[: self.length]
+        self.values = values
+        if self.mask is not None:
+            mask = np.zeros(len(values), dtype=bool)
+            mask[: self.length] = self.mask[: self.length]
+            self.mask = mask
+
+    def append(self, array):
+        n = len(array)
+        self._reserve(n)
+        start, stop = self.length, self.length + n
+        if array.null_count and not pa.types.is_floating(self.type):
+            if self.mask is None:
+                self.mask = np.zeros(len(self.values), dtype=bool)
+            self.mask[start:stop] = array.is_null().to_numpy(zero_copy_only=False)
+            array = pc.fill_null(array, False if pa.types.is_boolean(self.type) else 0)
+        # floats' nulls are NaN already
+        self.values[start:stop] = array.to_numpy(zero_copy_only=False)
+        self.length = stop
+
+    def finish(self):
+        values = self.values[: self.length]
+        if self.length < len(self.values) // 2:
+            # do not keep a much larger allocation alive
+            values = values.copy()
+        self.values = None
+        if self.mask is None or not self.mask[: self.length].any():
+            return values
+        mask = self.mask[: self.length]
+        if pa.types.is_boolean(self.type):
+            values = values.astype(object)
+            values[mask] = None
+        else:
+            values = values.astype(np.float64)
+            values[mask] = np.nan
+        return values
+
+
+class _ArrowColumn:
+    """Any other column, its chunks converted at the end"""
+
+    def __init__(self, typ):
+        self.type = typ
+        self.chunks = []
+
+    def append(self, array):
+        self.chunks.append(array)
+
+    def finish(self):
+        chunked = pa.chunked_array(self.chunks, type=self.type)
+        self.chunks = None
+        return chunked.to_pandas(timestamp_as_object=True, split_blocks=True)
+
+
+def batches_to_pandas(batches, schema, num_rows=-1):
+    """
+    Convert a stream of record batches to a DataFrame as they arrive
+
+    Numeric columns are copied batch by batch into NumPy arrays allocated
+    for num_rows rows, e.g. a FlightInfo's total_records, and grown if it
+    was an underestimate. Each batch is released once copied, so the peak
+    memory is about the DataFrame plus one batch, rather than the whole
+    Arrow result plus the DataFrame. Other columns are kept as Arrow and
+    converted once the stream is read.
+    """
+    capacity = max(num_rows, 0)
+    columns = [
+        _NumpyColumn(field.type, capacity) if _numeric(field.type) else _ArrowColumn(field.type)
+        for field in schema
+    ]
+    for batch in batches:
+        for column, array in zip(columns, batch.columns):
+            column.append(array)
+        del batch, array
+    # one block per column: assembling them does not copy
+    return pd.DataFrame(
+        {
+            field.name: pd.Series(column.finish(), name=field.name, copy=False)
+            for field, column in zip(schema, columns)
+        },
+        copy=False,
+    )
+
+
+def pandas_result(expr, df):
+    """expr.__pandas_result__(df), without copying a table's columns"""
+    if not isinstance(expr, ir.Table):
+        return expr.__pandas_result__(df)
+    return pd.DataFrame(
+        {
+            name: PandasData.convert_column(df[name], dtype)
+            for name, dtype in expr.schema().items()
+        },
+        copy=False,
+    )
+
+
+def arrow_pandas_result(expr, df):
+    """The result of expr from a DataFrame of pandas.ArrowDtype columns"""
+    # ibis would convert the columns back to NumPy dtypes
+    if isinstance(expr, ir.Table):
+        return df
+    if isinstance(expr, ir.Column):
+        return df.iloc[:, 0].rename(expr.get_name())
+    return df.iat[0, 0]
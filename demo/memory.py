@@ -0,0 +1,341 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from demo.stats import TableStats
+
+
+def read_ipc(path):
+    """
+    An Arrow IPC file or stream, memory-mapped
+
+    The buffers of an uncompressed file are its pages, read in through the
+    page cache on access. Compressed buffers are decompressed to the heap.
+    """
+    source = pa.memory_map(path)
+    try:
+        return pa.ipc.open_file(source).read_all()
+    except pa.ArrowInvalid:
+        # no file footer, e.g. a stream written with pa.ipc.new_stream
+        source.seek(0)
+        return pa.ipc.open_stream(source).read_all()
+
+
+class ManagedTable:
+    def __init__(self, name, data, stats=None):
+        self.name = name
+        self.schema = data.schema
+        # the same buffers the backend reads from, dropped once spilled
+        self.data = data
+        # the Arrow data registered with the backend, mapped ones once spilled
+        # to IPC, None once spilled to parquet, a view the catalog has
+        self.registered = data
+        self.nbytes = data.nbytes
+        self.last_access = time.monotonic()
+        # the files the table lives in once spilled, or was mapped from, one
+        # per segment: what was spilled, then each append after that
+        self.paths = []
+        # "ipc" or "parquet", the format of paths
+        self.format = None
+        # the paths that go along with the table
+        self.owned = set()
+        # see demo.stats, kept when spilled
+        self.stats = TableStats.from_table(data) if stats is None else stats
+
+    @property
+    def spilled(self):
+        return bool(self.paths)
+
+    @property
+    def path(self):
+        return self.paths[0] if self.paths else None
+
+    def to_dict(self):
+        return {
+            "nbytes": self.nbytes,
+            "spilled": self.spilled,
+            "idle": time.monotonic() - self.last_access,
+        }
+
+
+class MemoryManager:
+    """
+    Track the Arrow tables uploaded to a server and keep them under a budget
+
+    When the in-memory tables exceed `budget` bytes, the least recently used
+    ones are written to `spill_dir` and re-registered from disk: IPC files are
+    memory-mapped, so the data is paged back in on access instead of living on
+    the heap. Tables that have not been accessed for `idle_ttl` seconds are
+    spilled the same way. Tables mapped from IPC files with map_files start
+    out as spilled ones.
+
+    Parameters
+    ----------
+    budget: int
+        The maximum number of bytes of in-memory tables, None for no limit.
+    spill_dir: str
+        Where to spill tables, a temporary directory by default.
+    spill_format: str
+        "ipc" or "parquet".
+    idle_ttl: float
+        Seconds after which an unused table is spilled, None to never do so.
+    """
+
+    def __init__(self, budget=None, spill_dir=None, spill_format="ipc", idle_ttl=None):
+        if spill_format not in ("ipc", "parquet"):
+            raise ValueError(f"unknown spill_format {spill_format!r}")
+        self.budget = budget
+        self.spill_format = spill_format
+        self.idle_ttl = idle_ttl
+        self._spill_dir = spill_dir
+        self._own_spill_dir = spill_dir is None
+        self.tables = {}
+        self._lock = threading.RLock()
+
+    @property
+    def spill_dir(self):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="ephemeral-flight-")
+        return self._spill_dir
+
+    @property
+    def nbytes(self):
+        """The bytes held in memory by tracked tables"""
+        return sum(table.nbytes for table in self.tables.values() if not table.spilled)
+
+    def _replace(self, conn, table_name):
+        """
+        Drop a table the manager does not track, e.g. one read from parquet,
+        DuckDB only registers data under the name of another registered table
+        """
+        if table_name in self.tables or table_name not in conn.tables:
+            return
+        try:
+            conn.drop_table(table_name)
+        except Exception:
+            conn.drop_view(table_name)
+
+    def register(self, conn, table_name, data, stats=None):
+        with self._lock:
+            self._replace(conn, table_name)
+        conn.register(data, table_name=table_name)
+        with self._lock:
+            self._remove_file(self.tables.pop(table_name, None))
+            self.tables[table_name] = ManagedTable(table_name, data, stats)
+            self.enforce(conn)
+
+    def schema(self, conn, table_name):
+        """The Arrow schema of a table, None if there is no such table"""
+        with self._lock:
+            if (table := self.tables.get(table_name)) is not None:
+                return table.schema
+            if table_name not in conn.tables:
+                return None
+            return conn.table(table_name).schema().to_pyarrow()
+
+    def read(self, conn, table_name):
+        """The Arrow data of a table, None if there is no such table"""
+        with self._lock:
+            table = self.tables.get(table_name)
+            if table is None:
+                if table_name not in conn.tables:
+                    return None
+                return conn.table(table_name).to_pyarrow()
+            if not table.spilled:
+                return table.data
+            if table.format == "ipc":
+                return pa.concat_tables(map(read_ipc, table.paths))
+            return pq.read_table(table.paths)
+
+    def append(self, conn, table_name, data, stats=None):
+        """
+        Append data to a table, creating it if need be
+
+        Returns the table's number of rows. The table keeps its chunks, so
+        appending does not copy what is already there. Appending to a spilled
+        table writes data as a segment of its own, the files already there
+        are neither read nor written. stats are those of data, gathered from
+        it if not given.
+        """
+        if stats is None:
+            stats = TableStats.from_table(data)
+        with self._lock:
+            schema = self.schema(conn, table_name)
+            if schema is not None and not schema.equals(data.schema):
+                raise ValueError(
+                    f"can not append {data.schema} to {table_name}"
+                    f" of schema {schema}"
+                )
+            table = self.tables.get(table_name)
+            if table is not None and table.spilled:
+                return self._append_segment(conn, table, data, stats)
+            existing = None if schema is None else self.read(conn, table_name)
+            if existing is None:
+                combined = data
+            else:
+                combined = pa.concat_tables([existing, data])
+                # only the new rows are looked at
+                stats = None if table is None else table.stats.merge(stats)
+            self.register(conn, table_name, combined, stats)
+            return combined.num_rows
+
+    def _append_segment(self, conn, table, data, stats):
+        """
+        Append data to a spilled table as a new file, in a table of its own
+        so that a snapshot keeps the one it had
+        """
+        path = self._write(data, table.format)
+        appended = ManagedTable(table.name, data, table.stats.merge(stats))
+        appended.data = None
+        appended.nbytes = table.nbytes + data.nbytes
+        appended.paths = [*table.paths, path]
+        appended.format = table.format
+        appended.owned = table.owned | {path}
+        if table.format == "ipc":
+            appended.registered = pa.concat_tables(
+                [table.registered, read_ipc(path)]
+            )
+            conn.register(appended.registered, table_name=table.name)
+        else:
+            appended.registered = None
+            conn.read_parquet(appended.paths, table_name=table.name)
+        self.tables[table.name] = appended
+        return appended.stats.num_rows
+
+    def map_files(self, conn, table_name, paths, owned=False):
+        """
+        Create or replace a table from Arrow IPC files, without copying them
+
+        The files are memory-mapped, see read_ipc, so the table takes page
+        cache rather than heap and counts as spilled against the budget. Its
+        statistics are only those the files' metadata has, counts and sizes.
+        Owned files are removed along with the table, others are left alone.
+        """
+        paths = list(paths)
+        if not paths:
+            raise ValueError(f"no files to map for {table_name}")
+        data = pa.concat_tables(map(read_ipc, paths))
+        with self._lock:
+            self._replace(conn, table_name)
+        conn.register(data, table_name=table_name)
+        with self._lock:
+            self._remove_file(self.tables.pop(table_name, None))
+            table = ManagedTable(table_name, data, TableStats.from_layout(data))
+            table.data = None
+            table.registered = data
+            table.paths, table.format = paths, "ipc"
+            table.owned = set(paths) if owned else set()
+            self.tables[table_name] = table
+        return data.num_rows
+
+    def registered(self):
+        """The Arrow data registered with the backend by table name"""
+        with self._lock:
+            return {
+                name: table.registered
+                for name, table in self.tables.items()
+                if table.registered is not None
+            }
+
+    def touch(self, table_names):
+        now = time.monotonic()
+        with self._lock:
+            for name in table_names:
+                if (table := self.tables.get(name)) is not None:
+                    table.last_access = now
+
+    def forget(self, table_name, remove_files=True):
+        """
+        Stop managing a table, and remove its files unless remove_files is
+        False, e.g. when the backend may still read them
+        """
+        with self._lock:
+            table = self.tables.pop(table_name, None)
+            if remove_files:
+                self._remove_file(table)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.tables)
+
+    def restore(self, snapshot):
+        """Go back to the tables of a snapshot, after a rolled back transaction"""
+        with self._lock:
+            for name, table in list(self.tables.items()):
+                if (kept := snapshot.get(name)) is not table:
+                    # an append shares the files the snapshot has
+                    self._remove_file(
+                        self.tables.pop(name), () if kept is None else kept.paths
+                    )
+            self.tables.update(snapshot)
+
+    def enforce(self, conn):
+        """Spill idle tables, then the coldest ones until under budget"""
+        with self._lock:
+            resident = sorted(
+                (table for table in self.tables.values() if not table.spilled),
+                key=lambda table: table.last_access,
+            )
+            if self.idle_ttl is not None:
+                cutoff = time.monotonic() - self.idle_ttl
+                for table in resident:
+                    if table.last_access <= cutoff:
+                        self._spill(conn, table)
+            if self.budget is not None:
+                nbytes = self.nbytes
+                for table in resident:
+                    if nbytes <= self.budget:
+                        break
+                    if not table.spilled:
+                        self._spill(conn, table)
+                        nbytes -= table.nbytes
+
+    def _write(self, data, format):
+        """Write data to a new file in spill_dir, returning its path"""
+        if format == "ipc":
+            path = os.path.join(self.spill_dir, f"{uuid.uuid4().hex}.arrow")
+            with pa.OSFile(path, "wb") as sink:
+                with pa.ipc.new_file(sink, data.schema) as writer:
+                    writer.write_table(data)
+        else:
+            path = os.path.join(self.spill_dir, f"{uuid.uuid4().hex}.parquet")
+            pq.write_table(data, path)
+        return path
+
+    def _spill(self, conn, table):
+        data, table.data = table.data, None
+        path = self._write(data, self.spill_format)
+        del data
+        if self.spill_format == "ipc":
+            table.registered = read_ipc(path)
+            conn.register(table.registered, table_name=table.name)
+        else:
+            table.registered = None
+            conn.read_parquet(path, table_name=table.name)
+        table.paths, table.format, table.owned = [path], self.spill_format, {path}
+
+    def _remove_file(self, table, kept=()):
+        if table is not None and table.spilled:
+            for path in table.owned.difference(kept):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        with self._lock:
+            for table in self.tables.values():
+                self._remove_file(table)
+            self.tables = {}
+
+    def close(self):
+        self.clear()
+        if self._own_spill_dir and self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
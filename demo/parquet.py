@@ -0,0 +1,209 @@
+import glob
+import os
+import threading
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# only prune on types whose parquet min/max statistics are exact
+def _prunable(typ):
+    return (
+        pa.types.is_integer(typ)
+        or pa.types.is_floating(typ)
+        or pa.types.is_date(typ)
+        or pa.types.is_boolean(typ)
+    )
+
+
+class ColumnChunkInfo:
+    def __init__(self, name, min, max, null_count, nbytes):
+        self.name = name
+        self.min = min
+        self.max = max
+        self.null_count = null_count
+        self.nbytes = nbytes
+
+    def may_match(self, op, value):
+        """Can any value in this chunk satisfy `column <op> value`?"""
+        if self.min is None or self.max is None:
+            return True
+        try:
+            if op == "==":
+                return self.min <= value <= self.max
+            elif op == "!=":
+                return not (self.min == self.max == value)
+            elif op == ">":
+                return self.max > value
+            elif op == ">=":
+                return self.max >= value
+            elif op == "<":
+                return self.min < value
+            elif op == "<=":
+                return self.min <= value
+        except TypeError:
+            pass
+        return True
+
+
+class RowGroupInfo:
+    def __init__(self, num_rows, columns):
+        self.num_rows = num_rows
+        self.columns = columns
+
+    def may_match(self, predicates):
+        return all(
+            self.columns[name].may_match(op, value)
+            for name, op, value in predicates
+            if name in self.columns
+        )
+
+    def nbytes(self, columns=None):
+        names = self.columns if columns is None else columns
+        return sum(self.columns[name].nbytes for name in names if name in self.columns)
+
+
+class ParquetFileInfo:
+    """The parts of a parquet footer the server uses for planning"""
+
+    def __init__(self, path, size, mtime_ns, schema, row_groups):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.schema = schema
+        self.row_groups = row_groups
+
+    @property
+    def key(self):
+        return (self.path, self.size, self.mtime_ns)
+
+    @property
+    def num_rows(self):
+        return sum(row_group.num_rows for row_group in self.row_groups)
+
+    @classmethod
+    def from_metadata(cls, path, stat, metadata):
+        schema = metadata.schema.to_arrow_schema()
+        row_groups = []
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            nbytes, stats = {}, {}
+            for j in range(row_group.num_columns):
+                chunk = row_group.column(j)
+                # nested columns are accounted to their top level field
+                name = chunk.path_in_schema.split(".")[0]
+                nbytes[name] = nbytes.get(name, 0) + chunk.total_uncompressed_size
+                if name == chunk.path_in_schema:
+                    stats[name] = chunk.statistics
+            columns = {}
+            for name, size in nbytes.items():
+                statistics = stats.get(name)
+                has_min_max = (
+                    statistics is not None
+                    and statistics.has_min_max
+                    and _prunable(schema.field(name).type)
+                )
+                columns[name] = ColumnChunkInfo(
+                    name,
+                    min=statistics.min if has_min_max else None,
+                    max=statistics.max if has_min_max else None,
+                    null_count=(
+                        statistics.null_count
+                        if statistics is not None and statistics.has_null_count
+                        else None
+                    ),
+                    nbytes=size,
+                )
+            row_groups.append(RowGroupInfo(row_group.num_rows, columns))
+        return cls(path, stat.st_size, stat.st_mtime_ns, schema, tuple(row_groups))
+
+
+def expand_paths(source_list, patterns=("*.parquet",)):
+    """
+    Resolve a read_parquet source_list to local files
+
+    Directories are searched recursively for files matching patterns.
+    Returns None if any source is not a local file, directory or glob.
+    """
+    if isinstance(source_list, (str, os.PathLike)):
+        source_list = (source_list,)
+    paths = []
+    for source in map(str, source_list):
+        if "://" in source:
+            return None
+        if os.path.isdir(source):
+            paths.extend(
+                sorted(
+                    path
+                    for pattern in patterns
+                    for path in glob.glob(
+                        os.path.join(source, "**", pattern), recursive=True
+                    )
+                )
+            )
+        elif glob.has_magic(source):
+            paths.extend(sorted(glob.glob(source, recursive=True)))
+        elif os.path.isfile(source):
+            paths.append(source)
+        else:
+            return None
+    return tuple(os.path.abspath(path) for path in paths)
+
+
+class ParquetMetadataCache:
+    """
+    Parquet footers keyed by path, size and mtime
+
+    A file that has not changed on disk is only ever stat-ed, never re-read.
+    """
+
+    def __init__(self):
+        self._infos = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            info = self._infos.get(key)
+            if info is not None:
+                self.hits += 1
+                return info
+        info = ParquetFileInfo.from_metadata(path, stat, pq.read_metadata(path))
+        with self._lock:
+            self.misses += 1
+            # a rewritten file gets a new key, forget the stale footer
+            for stale in [k for k in self._infos if k[0] == path]:
+                del self._infos[stale]
+            self._infos[key] = info
+        return info
+
+    def get_all(self, paths):
+        return tuple(map(self.get, paths))
+
+    def clear(self):
+        with self._lock:
+            self._infos.clear()
+
+
+def estimate(infos, columns=None, predicates=(), limit=None):
+    """
+    Estimate (num_rows, nbytes) of a scan over parquet files
+
+    Row groups whose statistics rule out the predicates are skipped and only
+    the projected columns are counted, so num_rows is an upper bound when
+    there are predicates and exact otherwise.
+    """
+    num_rows = nbytes = 0
+    for info in infos:
+        for row_group in info.row_groups:
+            if row_group.may_match(predicates):
+                num_rows += row_group.num_rows
+                nbytes += row_group.nbytes(columns)
+    if limit is not None and num_rows > limit:
+        nbytes = nbytes * limit // num_rows
+        num_rows = limit
+    return num_rows, nbytes
+
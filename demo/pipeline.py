@@ -0,0 +1,246 @@
+import concurrent.futures
+import json
+import queue
+import threading
+
+import pyarrow as pa
+
+from demo.coalesce import Chunk
+from demo.exchanger import AbstractExchanger
+from demo.expr import ExprExchanger, is_expr
+
+
+DEFAULT_QUEUE_SIZE = 8
+
+_END = object()
+
+
+def is_pipeline(command):
+    """A pipeline command is a JSON list of exchanger commands"""
+    return command.startswith("[")
+
+
+class _Pipe:
+    """The bounded queue of chunks from one stage of a pipeline to the next"""
+
+    def __init__(self, failed, maxsize=DEFAULT_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize)
+        self._schema = concurrent.futures.Future()
+        self._failed = failed
+        # the consumer is done, what is still put is dropped
+        self.closed = threading.Event()
+
+    def _check(self):
+        if self._failed.is_set():
+            raise pa.ArrowInvalid("another stage of the pipeline failed")
+
+    def put(self, item):
+        while not self.closed.is_set():
+            self._check()
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def get(self):
+        while True:
+            self._check()
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def begin(self, schema):
+        if not self._schema.done():
+            self._schema.set_result(schema)
+
+    @property
+    def schema(self):
+        while True:
+            self._check()
+            try:
+                return self._schema.result(timeout=0.1)
+            except concurrent.futures.TimeoutError:
+                pass
+
+    def finish(self, schema):
+        # a stage that wrote nothing still has a schema
+        self.begin(schema)
+        self.put(_END)
+
+
+class _PipeWriter:
+    """What a stage writes to, feeding the next stage"""
+
+    def __init__(self, pipe):
+        self._pipe = pipe
+
+    def begin(self, schema, options=None):
+        self._pipe.begin(schema)
+
+    def write_batch(self, batch):
+        self._pipe.put(Chunk(batch))
+
+    def write_table(self, table, max_chunksize=None):
+        for batch in table.to_batches(max_chunksize=max_chunksize):
+            self.write_batch(batch)
+
+    def write_with_metadata(self, batch, buf):
+        self._pipe.put(Chunk(batch, buf))
+
+    def write_metadata(self, buf):
+        self._pipe.put(Chunk(None, buf))
+
+
+class _PipeReader:
+    """What a stage reads from, fed by the previous stage"""
+
+    def __init__(self, pipe):
+        self._pipe = pipe
+
+    @property
+    def schema(self):
+        return self._pipe.schema
+
+    def __iter__(self):
+        while (chunk := self._pipe.get()) is not _END:
+            yield chunk
+
+    def read_chunk(self):
+        chunk = self._pipe.get()
+        if chunk is _END:
+            raise StopIteration
+        return chunk
+
+    def read_all(self):
+        batches = [chunk.data for chunk in self if chunk.data is not None]
+        return pa.Table.from_batches(batches, schema=self.schema)
+
+
+class PipelineExchanger(AbstractExchanger):
+    """
+    Exchangers chained in one do_exchange, each stage's output the next's input
+
+    The stages' schemas are checked up front through their calc_schema_out,
+    then every stage runs in its own thread and batches flow between them
+    through bounded queues, so nothing goes back over the wire between
+    stages. The first failure stops the whole pipeline.
+
+    Parameters
+    ----------
+    stages: list of exchangers
+        In order, as registered on the server.
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+
+    @classmethod
+    def from_command(cls, command, exchangers):
+        commands = json.loads(command)
+        if not commands:
+            raise pa.ArrowInvalid("An empty pipeline")
+        unknown = [
+            name for name in commands if name not in exchangers and not is_expr(name)
+        ]
+        if unknown:
+            raise pa.ArrowInvalid(f"Unknown commands in pipeline: {unknown}")
+        return cls(
+            [
+                ExprExchanger.from_command(name) if is_expr(name) else exchangers[name]
+                for name in commands
+            ]
+        )
+
+    def schemas(self, schema_in):
+        """The input schema of every stage and the pipeline's output schema"""
+        schemas = [schema_in]
+        for i, stage in enumerate(self.stages):
+            if not stage.schema_in_condition(schemas[-1]):
+                raise pa.ArrowInvalid(
+                    f"stage {i} ({stage.command}) does not accept {schemas[-1]}"
+                )
+            schemas.append(stage.calc_schema_out(schemas[-1]))
+        return schemas
+
+    @property
+    def exchange_f(self):
+        def exchange_pipeline(context, reader, writer, **kwargs):
+            schemas = self.schemas(reader.schema)
+            failed = threading.Event()
+            pipes = [_Pipe(failed) for _ in self.stages[1:]]
+            readers = [reader, *map(_PipeReader, pipes)]
+            writers = [*map(_PipeWriter, pipes), writer]
+            errors = []
+
+            def run(i):
+                try:
+                    self.stages[i].exchange_f(context, readers[i], writers[i])
+                except BaseException as e:
+                    if not failed.is_set():
+                        errors.append(e)
+                        failed.set()
+                finally:
+                    if i > 0:
+                        pipes[i - 1].closed.set()
+                    if i < len(pipes) and not failed.is_set():
+                        try:
+                            pipes[i].finish(schemas[i + 1])
+                        except pa.ArrowInvalid:
+                            pass
+
+            threads = [
+                threading.Thread(target=run, args=(i,), name=f"pipeline-{i}")
+                for i in range(len(self.stages) - 1)
+            ]
+            for thread in threads:
+                thread.start()
+            # the last stage writes to the client from the handler's thread
+            run(len(self.stages) - 1)
+            for thread in threads:
+                thread.join()
+            if errors:
+                raise errors[0]
+
+        return exchange_pipeline
+
+    @property
+    def schema_in_required(self):
+        return self.stages[0].schema_in_required
+
+    @property
+    def schema_in_condition(self):
+        def condition(schema_in):
+            try:
+                self.schemas(schema_in)
+            except pa.ArrowInvalid:
+                return False
+            return True
+
+        return condition
+
+    @property
+    def calc_schema_out(self):
+        def f(schema_in):
+            return self.schemas(schema_in)[-1]
+
+        return f
+
+    @property
+    def description(self):
+        return " | ".join(stage.command for stage in self.stages)
+
+    @property
+    def command(self):
+        return json.dumps([stage.command for stage in self.stages])
+
+    @property
+    def query_result(self):
+        return {
+            "schema-in-required": self.schema_in_required,
+            "schema-in-condition": self.schema_in_condition,
+            "calc-schema-out": self.calc_schema_out,
+            "description": self.description,
+            "command": self.command,
+        }
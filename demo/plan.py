@@ -0,0 +1,155 @@
+from ibis.expr import operations as ops
+
+
+comparisons = {
+    ops.Equals: "==",
+    ops.NotEquals: "!=",
+    ops.Greater: ">",
+    ops.GreaterEqual: ">=",
+    ops.Less: "<",
+    ops.LessEqual: "<=",
+}
+flipped = {"==": "==", "!=": "!=", ">": "<", ">=": "<=", "<": ">", "<=": ">="}
+
+
+class Scan:
+    """
+    A simple read of one table: an optional projection, a conjunction of
+    column-vs-literal predicates and an optional limit.
+
+    Predicates that are not of that form are left out, so the predicates
+    describe a superset of the rows the expression returns.
+    """
+
+    def __init__(self, table, columns=None, predicates=(), limit=None):
+        self.table = table
+        self.columns = columns
+        self.predicates = tuple(predicates)
+        self.limit = limit
+
+    def __repr__(self):
+        return (
+            f"Scan(table={self.table!r}, columns={self.columns!r}, "
+            f"predicates={self.predicates!r}, limit={self.limit!r})"
+        )
+
+
+def table_names(expr):
+    """Get the names of all the tables an expression reads"""
+    tables = expr.op().find((ops.UnboundTable, ops.DatabaseTable))
+    return tuple(sorted({table.name for table in tables}))
+
+
+def _to_predicates(op, rel):
+    if isinstance(op, ops.And):
+        return _to_predicates(op.left, rel) + _to_predicates(op.right, rel)
+    comparison = comparisons.get(type(op))
+    if comparison is None:
+        return ()
+    left, right = op.left, op.right
+    if isinstance(left, ops.Literal) and isinstance(right, ops.Field):
+        left, right, comparison = right, left, flipped[comparison]
+    if (
+        isinstance(left, ops.Field)
+        and left.rel == rel
+        and isinstance(right, ops.Literal)
+        and right.value is not None
+    ):
+        return ((left.name, comparison, right.value),)
+    return ()
+
+
+def to_scan(expr):
+    """
+    Describe an expression as a Scan
+
+    Returns None if the expression does more than project, filter and limit
+    a single table.
+    """
+    op = expr.op()
+
+    limit = None
+    if isinstance(op, ops.Limit):
+        if op.offset != 0 or not isinstance(op.n, int):
+            return None
+        limit, op = op.n, op.parent
+
+    columns = None
+    if isinstance(op, ops.Project):
+        values = tuple(op.values.values())
+        if not all(
+            isinstance(value, ops.Field) and value.rel == op.parent for value in values
+        ):
+            return None
+        columns, op = tuple(value.name for value in values), op.parent
+
+    predicates = ()
+    while isinstance(op, ops.Filter):
+        for predicate in op.predicates:
+            predicates += _to_predicates(predicate, op.parent)
+        op = op.parent
+
+    if not isinstance(op, (ops.UnboundTable, ops.DatabaseTable)):
+        return None
+    return Scan(op.name, columns=columns, predicates=predicates, limit=limit)
+
+
+def is_scan(op):
+    """Whether op filters and projects a single table row by row"""
+    if len(op.find((ops.DatabaseTable, ops.UnboundTable))) != 1:
+        return False
+    relations = (ops.Filter, ops.Project, ops.DatabaseTable, ops.UnboundTable)
+    if not all(isinstance(node, relations) for node in op.find(ops.Relation)):
+        return False
+    return not op.find((ops.Reduction, ops.WindowFunction))
+
+
+def _split_metric(name, metric):
+    """
+    The partial metrics of an aggregate metric, and how to merge them
+
+    Returns None if the metric can not be computed from partial results.
+    """
+    if isinstance(metric, (ops.Sum, ops.Count, ops.CountStar)):
+        return {name: metric}, lambda t: t[name].sum()
+    if isinstance(metric, ops.Min):
+        return {name: metric}, lambda t: t[name].min()
+    if isinstance(metric, ops.Max):
+        return {name: metric}, lambda t: t[name].max()
+    if isinstance(metric, ops.Mean) and metric.arg.dtype.is_numeric():
+        total, count = f"{name}__sum", f"{name}__count"
+        partial = {
+            total: ops.Sum(metric.arg, where=metric.where),
+            count: ops.Count(metric.arg, where=metric.where),
+        }
+        return partial, lambda t: t[total].sum() / t[count].sum()
+    return None
+
+
+def split_aggregate(op):
+    """
+    Split an aggregate of a scan into partial aggregates and their merge
+
+    Returns (partial, merge): partial is an Aggregate whose results over any
+    parts of the rows, unioned into a table t, merge(t) aggregates into the
+    final result. Returns None if op is not an aggregate of a scan of sums,
+    counts, minimums, maximums and means.
+    """
+    if not isinstance(op, ops.Aggregate) or not is_scan(op.parent):
+        return None
+    splits = [_split_metric(name, metric) for name, metric in op.metrics.items()]
+    if any(split is None for split in splits):
+        return None
+    partial_metrics = {}
+    for metrics, _ in splits:
+        partial_metrics.update(metrics)
+    partial = ops.Aggregate(op.parent, op.groups, partial_metrics)
+
+    def merge(t):
+        metrics = {
+            name: merge_metric(t).cast(metric.dtype)
+            for (name, metric), (_, merge_metric) in zip(op.metrics.items(), splits)
+        }
+        return t.aggregate(metrics, by=list(op.groups))
+
+    return partial, merge
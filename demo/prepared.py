@@ -0,0 +1,43 @@
+import uuid
+
+import ibis.expr.operations as ops
+
+
+class PreparedStatement:
+    """
+    An expression kept on the server, executed by handle with bound parameters
+
+    Parameters are the expression's ibis.param()s, bound by name.
+    """
+
+    def __init__(self, expr, **kwargs):
+        self.handle = uuid.uuid4().hex
+        self.expr = expr
+        # execution options, e.g. limit and chunk_size
+        self.kwargs = kwargs
+        self.schema = expr.as_table().schema().to_pyarrow()
+        self.parameters = {
+            op.name: op for op in expr.op().find(ops.ScalarParameter)
+        }
+
+    def bind(self, values):
+        """Map parameter names to values onto the params of to_pyarrow_batches"""
+        values = values or {}
+        unknown = set(values) - set(self.parameters)
+        if unknown:
+            raise ValueError(f"unknown parameters {sorted(unknown)}")
+        missing = set(self.parameters) - set(values)
+        if missing:
+            raise ValueError(f"missing parameters {sorted(missing)}")
+        return {
+            self.parameters[name].to_expr(): value for name, value in values.items()
+        }
+
+    def to_dict(self):
+        return {
+            "handle": self.handle,
+            "schema": self.schema,
+            "parameters": {
+                name: op.dtype for name, op in self.parameters.items()
+            },
+        }
@@ -0,0 +1,143 @@
+import multiprocessing
+
+from cloudpickle import dumps, loads
+
+# a forked child would inherit the parent's grpc threads, so always spawn
+_context = multiprocessing.get_context("spawn")
+
+
+def _serve(
+    pipe,
+    con_callable,
+    location,
+    tls_certificates,
+    verify_client,
+    root_certificates,
+    auth,
+    kwargs,
+):
+    from demo import to_basic_auth_middleware
+    from demo.server import FlightServer, NoOpAuthHandler
+
+    try:
+        server = FlightServer(
+            loads(con_callable),
+            location,
+            tls_certificates=tls_certificates,
+            verify_client=verify_client,
+            root_certificates=root_certificates,
+            auth_handler=NoOpAuthHandler(),
+            middleware=to_basic_auth_middleware(auth),
+            **kwargs,
+        )
+    except Exception as e:
+        pipe.send(("error", repr(e)))
+        pipe.close()
+        return
+
+    pipe.send(("ready", server.port))
+    try:
+        while (message := pipe.recv()) != "shutdown":
+            if message == "reset":
+                server.reset()
+                pipe.send("reset")
+    except EOFError:
+        # the parent went away without saying goodbye
+        pass
+    finally:
+        server.shutdown()
+        pipe.close()
+
+
+class FlightServerProcess:
+    """
+    A FlightServer running in a child process.
+
+    The server is constructed in the child, so server-side Python work
+    (unpickling, exchanger UDFs, pandas conversions) does not contend with the
+    caller for the GIL. The constructor returns once the child reports that the
+    server is listening and connected to its backend.
+
+    Parameters
+    ----------
+    con_callable: Callable
+        A cloudpickle-able callable that returns the backend connection.
+    timeout: float
+        Seconds to wait for the child to report readiness.
+    **kwargs
+        Passed on to the FlightServer.
+    """
+
+    def __init__(
+        self,
+        con_callable,
+        location=None,
+        tls_certificates=None,
+        verify_client=False,
+        root_certificates=None,
+        auth=None,
+        timeout=60,
+        **kwargs,
+    ):
+        self._pipe, child_pipe = _context.Pipe()
+        self._process = _context.Process(
+            target=_serve,
+            args=(
+                child_pipe,
+                # backend connect functions are often closures
+                dumps(con_callable),
+                location,
+                tls_certificates,
+                verify_client,
+                root_certificates,
+                auth,
+                kwargs,
+            ),
+            daemon=True,
+        )
+        self._process.start()
+        child_pipe.close()
+
+        try:
+            if not self._pipe.poll(timeout):
+                raise TimeoutError(f"server process not ready after {timeout} seconds")
+            status, value = self._pipe.recv()
+        except (EOFError, TimeoutError):
+            self._kill()
+            raise
+        if status != "ready":
+            self._kill()
+            raise RuntimeError(f"server process failed to start: {value}")
+        self.port = value
+
+    @property
+    def pid(self):
+        return self._process.pid
+
+    def _kill(self):
+        self._process.terminate()
+        self._process.join()
+        self._pipe.close()
+
+    def reset(self):
+        self._pipe.send("reset")
+        self._pipe.recv()
+
+    def shutdown(self, timeout=10):
+        if not self._process.is_alive():
+            return
+        try:
+            self._pipe.send("shutdown")
+        except (BrokenPipeError, OSError):
+            pass
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._kill()
+        else:
+            self._pipe.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
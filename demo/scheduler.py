@@ -0,0 +1,170 @@
+import collections
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+import pyarrow.flight
+
+
+# priority classes, lower runs first
+CATALOG = 0
+WRITE = 1
+QUERY = 2
+
+
+class _Waiter:
+    def __init__(self, priority, seq, user, nbytes):
+        self.priority = priority
+        self.seq = seq
+        self.user = user
+        self.nbytes = nbytes
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Scheduler:
+    """
+    Admission control for the calls a FlightServer executes
+
+    A call waits until it can run without exceeding `max_concurrency` calls
+    in total, `max_concurrency_per_user` calls of its user, or `memory_budget`
+    bytes of estimated results in flight. Waiting calls are admitted by
+    priority class (CATALOG, then WRITE, then QUERY) and then in arrival
+    order. A call that waited `queue_timeout` seconds, or finds `max_queued`
+    calls already waiting, fails with a FlightUnavailableError telling the
+    client to back off and retry.
+
+    Parameters
+    ----------
+    max_concurrency: int
+        Calls running at once, None for no limit.
+    max_concurrency_per_user: int
+        Calls running at once per authenticated user, None for no limit.
+    memory_budget: int
+        Estimated bytes of results in flight, None for no limit. A call larger
+        than the budget runs alone.
+    queue_timeout: float
+        Seconds a call may wait to be admitted.
+    max_queued: int
+        Calls that may wait at once, None for no limit.
+    retry_after: float
+        Seconds the back-off error tells clients to wait.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=None,
+        max_concurrency_per_user=None,
+        memory_budget=None,
+        queue_timeout=10.0,
+        max_queued=None,
+        retry_after=1.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_concurrency_per_user = max_concurrency_per_user
+        self.memory_budget = memory_budget
+        self.queue_timeout = queue_timeout
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self.running = 0
+        self.running_by_user = collections.Counter()
+        self.reserved = 0
+        self.rejected = 0
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    @property
+    def enabled(self):
+        return (
+            self.max_concurrency is not None
+            or self.max_concurrency_per_user is not None
+            or self.memory_budget is not None
+        )
+
+    def _blocked_by(self, waiter):
+        """Why waiter can not run now, None if it can"""
+        if self.max_concurrency is not None and self.running >= self.max_concurrency:
+            return f"{self.running} calls running"
+        if (
+            self.max_concurrency_per_user is not None
+            and waiter.user is not None
+            and self.running_by_user[waiter.user] >= self.max_concurrency_per_user
+        ):
+            n_running = self.running_by_user[waiter.user]
+            return f"user {waiter.user!r} has {n_running} calls running"
+        if (
+            self.memory_budget is not None
+            and self.running
+            and self.reserved + waiter.nbytes > self.memory_budget
+        ):
+            return f"{self.reserved} bytes of results in flight"
+        return None
+
+    def _may_run(self, waiter):
+        if self._blocked_by(waiter) is not None:
+            return False
+        # a call that could run yields to waiting calls ahead of it that could too
+        return not any(
+            other < waiter and self._blocked_by(other) is None
+            for other in self._waiting
+        )
+
+    def _busy(self, reason):
+        self.rejected += 1
+        return pyarrow.flight.FlightUnavailableError(
+            f"server busy ({reason}), retry in {self.retry_after:g}s",
+            f"retry-after={self.retry_after:g}".encode(),
+        )
+
+    @contextmanager
+    def admit(self, priority=QUERY, user=None, nbytes=0):
+        """Hold a slot while the body runs, waiting for one if need be"""
+        if not self.enabled:
+            yield
+            return
+        waiter = _Waiter(priority, next(self._seq), user, nbytes or 0)
+        with self._cond:
+            if (
+                self.max_queued is not None
+                and len(self._waiting) >= self.max_queued
+                and self._blocked_by(waiter) is not None
+            ):
+                raise self._busy(f"{len(self._waiting)} calls queued")
+            self._waiting.append(waiter)
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while not self._may_run(waiter):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._busy(self._blocked_by(waiter) or "queued")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting.remove(waiter)
+                # the calls behind this one may be next now
+                self._cond.notify_all()
+            self.running += 1
+            self.running_by_user[user] += 1
+            self.reserved += waiter.nbytes
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.running -= 1
+                self.running_by_user[user] -= 1
+                self.reserved -= waiter.nbytes
+                self._cond.notify_all()
+
+    def to_dict(self):
+        with self._cond:
+            return {
+                "running": self.running,
+                "queued": len(self._waiting),
+                "reserved": self.reserved,
+                "rejected": self.rejected,
+                "running_by_user": {
+                    user: n for user, n in self.running_by_user.items() if n
+                },
+            }
@@ -1,15 +1,37 @@
 import argparse
 import base64
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import itertools
+import json
 import secrets
+import threading
 
-import duckdb
 import pyarrow as pa
 import pyarrow.flight
 
 import demo.action as A
 import demo.exchanger as E
+import demo.flightsql as FS
+import demo.parquet as P
+import demo.scheduler as S
+import demo.tracing as T
+import demo.wire as W
 
-from cloudpickle import loads
+from demo.cancel import QueryRegistry, check_cancelled, interrupt_backend
+from demo.coalesce import coalesce_options, coalesce_table
+from demo.ingest import append_stream, encode_ack, parse_put_command
+from demo.memory import MemoryManager
+from demo.expr import ExprExchanger, is_expr
+from demo.pipeline import PipelineExchanger, is_pipeline
+from demo.spool import ResultSpool
+from demo.stats import TableStats
+
+from cloudpickle import dumps, loads
+
+from demo.utils import with_port
 
 class BasicAuthServerMiddlewareFactory(pa.flight.ServerMiddlewareFactory):
     """
@@ -45,7 +67,8 @@ class BasicAuthServerMiddlewareFactory(pa.flight.ServerMiddlewareFactory):
         if auth_type == "Basic":
             # Initial "login". The user provided a username/password
             # combination encoded in the same way as HTTP Basic Auth.
-            decoded = base64.b64decode(value).decode("utf-8")
+            # Go clients, e.g. ADBC's Flight SQL driver, leave out the padding
+            decoded = base64.b64decode(value + "=" * (-len(value) % 4)).decode("utf-8")
             username, _, password = decoded.partition(":")
             if not password or password != self.creds.get(username):
                 raise pa.flight.FlightUnauthenticatedError(
@@ -54,13 +77,13 @@ class BasicAuthServerMiddlewareFactory(pa.flight.ServerMiddlewareFactory):
             # Generate a secret, random bearer token for future calls.
             token = secrets.token_urlsafe(32)
             self.tokens[token] = username
-            return BasicAuthServerMiddleware(token)
+            return BasicAuthServerMiddleware(token, username)
         elif auth_type == "Bearer":
             # An actual call. Validate the bearer token.
             username = self.tokens.get(value)
             if username is None:
                 raise pa.flight.FlightUnauthenticatedError("Invalid token")
-            return BasicAuthServerMiddleware(value)
+            return BasicAuthServerMiddleware(value, username)
 
         raise pa.flight.FlightUnauthenticatedError("No credentials supplied")
 
@@ -68,8 +91,9 @@ class BasicAuthServerMiddlewareFactory(pa.flight.ServerMiddlewareFactory):
 class BasicAuthServerMiddleware(pa.flight.ServerMiddleware):
     """Middleware that implements username-password authentication."""
 
-    def __init__(self, token):
+    def __init__(self, token, username=None):
         self.token = token
+        self.username = username
 
     def sending_headers(self):
         """Return the authentication token to the client."""
@@ -93,6 +117,24 @@ class NoOpAuthHandler(pa.flight.ServerAuthHandler):
         return ""
 
 
+# cheap actions that only touch the catalog, scheduled ahead of queries
+catalog_actions = {
+    "list_tables",
+    "table_info",
+    "drop_table",
+    "drop_view",
+    "list-exchanges",
+    "query-exchange",
+    "memory_usage",
+    "scheduler_stats",
+    "table_stats",
+    "prepare",
+    "close-prepared",
+}
+# never queued, so a busy server still answers them
+unscheduled_actions = {"healthcheck", "shutdown", "cancel-query"}
+
+
 class FlightServer(pyarrow.flight.FlightServerBase):
     def __init__(
         self,
@@ -103,7 +145,26 @@ class FlightServer(pyarrow.flight.FlightServerBase):
         root_certificates=None,
         auth_handler=None,
         middleware=None,
+        memory_budget=None,
+        spill_dir=None,
+        spill_format="ipc",
+        idle_ttl=None,
+        coalesce=False,
+        spool_dir=None,
+        spool_ttl=600,
+        max_concurrency=None,
+        max_concurrency_per_user=None,
+        admission_budget=None,
+        queue_timeout=10.0,
+        max_queued=None,
+        trace_exporter=None,
     ):
+        if trace_exporter is not None:
+            # calls and their phases are timed in spans, see demo.tracing
+            middleware = {
+                **(middleware or {}),
+                "tracing": T.TracingServerMiddlewareFactory(trace_exporter),
+            }
         super(FlightServer, self).__init__(
             location=location,
             auth_handler=auth_handler,
@@ -112,61 +173,581 @@ class FlightServer(pyarrow.flight.FlightServerBase):
             root_certificates=root_certificates,
             middleware=middleware,
         )
-        self._conn = con_callable()
+        self._con_callable = con_callable
+        # name -> VectorizedUDF, registered with every connection, see demo.udf
+        self.udfs = {}
+        self._connect()
+        # backend connections are not safe to use from several grpc threads,
+        # on DuckDB queries run on cursors of their own and only the catalog
+        # is guarded, on other backends one call runs at a time, see
+        # _query_backend
+        self._conn_lock = threading.RLock()
+        # binding to port 0 picks a free port, advertise the real one
+        if isinstance(location, str):
+            location = with_port(location, self.port)
         self._location = location
-        self.exchangers = E.exchangers
-        self.actions = A.actions
+        self.exchangers = dict(E.exchangers)
+        self.actions = {**A.actions, **FS.actions}
+        self.parquet_cache = P.ParquetMetadataCache()
+        # table name -> ParquetFileInfo of the files it was read from
+        self.parquet_tables = {}
+        # table name -> how many times it was written, part of spool keys
+        self.table_versions = collections.Counter()
+        self.memory = MemoryManager(
+            budget=memory_budget,
+            spill_dir=spill_dir,
+            spill_format=spill_format,
+            idle_ttl=idle_ttl,
+        )
+        # how uploaded tables are re-chunked, if at all, see demo.coalesce;
+        # exchangers always see the batches their client sent
+        self.coalesce = coalesce_options(coalesce)
+        # admission control for the calls that execute, see demo.scheduler
+        self.scheduler = S.Scheduler(
+            max_concurrency=max_concurrency,
+            max_concurrency_per_user=max_concurrency_per_user,
+            memory_budget=admission_budget,
+            queue_timeout=queue_timeout,
+            max_queued=max_queued,
+        )
+        # running queries by id, see demo.cancel
+        self.queries = QueryRegistry(lambda: interrupt_backend(self._conn))
+        # handle -> PreparedStatement, see demo.prepared
+        self.prepared = {}
+        # handle -> Flight SQL prepared statement, see demo.flightsql
+        self.sql_statements = {}
+        # results of do_get calls made with spool=True
+        self.spool = ResultSpool(ttl=spool_ttl, spool_dir=spool_dir)
+        try:
+            # a backend that can not connect fails the server, not its first
+            # query
+            self._conn_future.result()
+        except BaseException:
+            self.shutdown()
+            raise
+
+    def _connect(self):
+        """
+        Create the backend connection in the background
 
-    def _make_flight_info(self, query):
+        Creating it imports the backend (letsql, ibis, duckdb), which takes
+        about as long as starting the server and setting it up: both happen
+        at once, and __init__ waits for the connection last.
+        """
+        future = concurrent.futures.Future()
+
+        def connect():
+            try:
+                con = self._con_callable()
+                for udf in self.udfs.values():
+                    udf.register(con)
+                future.set_result(con)
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=connect, name="connect", daemon=True).start()
+        self._conn_future = future
+
+    @property
+    def _conn(self):
+        return self._conn_future.result()
+
+    def clear(self):
+        """
+        Drop all tables and release their memory and spill files
+        """
+        with self._conn_lock:
+            conn = self._conn
+            self._connect()
+            self._conn_future.result()
+            try:
+                conn.disconnect()
+            except Exception:
+                pass
+            self.parquet_tables = {}
+            self.memory.clear()
+            self.spool.clear()
+            self.prepared = {}
+            self.sql_statements = {}
+
+    def reset(self):
+        """
+        Drop all tables and any custom actions, exchangers or UDFs
+        """
+        self.udfs = {}
+        self.clear()
+        self.exchangers = dict(E.exchangers)
+        self.actions = {**A.actions, **FS.actions}
+
+    def add_udf(self, udf):
+        """Register a VectorizedUDF with the backend, it survives clear"""
+        with self._conn_lock:
+            udf.register(self._conn)
+            self.udfs[udf.name] = udf
+
+    def shutdown(self):
+        super().shutdown()
+        self.memory.close()
+        self.spool.close()
+
+    def __exit__(self, *args):
+        # FlightServerBase.__exit__ does not dispatch to our shutdown
+        super().__exit__(*args)
+        self.memory.close()
+        self.spool.close()
+
+    def _estimate(self, expr, limit=None):
+        """
+        Estimate (num_rows, nbytes) of an expression without executing it
+
+        Returns None if the expression is not a simple scan of a table read
+        from parquet files or uploaded to this server.
+        """
+        from demo.plan import to_scan
+
+        scan = to_scan(expr)
+        if scan is None:
+            return None
+        if scan.limit is not None:
+            limit = scan.limit if limit is None else min(limit, scan.limit)
+        if (table := self.memory.tables.get(scan.table)) is not None:
+            return table.stats.estimate(
+                columns=scan.columns, predicates=scan.predicates, limit=limit
+            )
+        if scan.table in self.parquet_tables:
+            return P.estimate(
+                self.parquet_tables[scan.table],
+                columns=scan.columns,
+                predicates=scan.predicates,
+                limit=limit,
+            )
+        return None
+
+    def table_stats(self, table_name):
+        """The TableStats of a table, None if the server did not gather any"""
+        if (table := self.memory.tables.get(table_name)) is not None:
+            return table.stats
+        if (infos := self.parquet_tables.get(table_name)) is not None:
+            return TableStats.from_parquet(infos)
+        return None
+
+    def table_written(self, table_name):
+        """
+        Drop what the server cached about a table that was created, replaced,
+        appended to or dropped, every write to a table calls it
+        """
+        self.parquet_tables.pop(table_name, None)
+        self.table_versions[table_name] += 1
+
+    def _spool_id(self, command, expr):
+        """
+        The spool key of a command, which changes once a table its
+        expression reads is written
+        """
+        from demo.plan import table_names
+
+        versions = [(name, self.table_versions[name]) for name in table_names(expr)]
+        return hashlib.sha256(command + repr(versions).encode()).hexdigest()
+
+    def _user(self, context):
+        """The user authenticated by the basic auth middleware, if any"""
+        middleware = context.get_middleware("basic") if context else None
+        return getattr(middleware, "username", None)
+
+    def _make_flight_info(self, query, context=None):
         """
         Create Flight info for a given SQL query
 
         Args:
             query: SQL query string
+            context: the call's ServerCallContext
         """
-        # Execute query to get schema and metadata
-        kwargs = loads(query)
-        expr = kwargs.pop("expr")
-        result = self._conn.to_pyarrow_batches(expr, **kwargs).read_all()
+        with T.server_span(context, "unpickle"):
+            kwargs = loads(query)
+        expr, params, statement = self._resolve(kwargs)
+        kwargs.pop("wire_optimize", None)
+        query_id = kwargs.pop("query_id", None)
+        ticket = query
+        if kwargs.pop("spool", False):
+            # the same command gets the same spooled result, until the
+            # tables it reads are written
+            spool_id = self._spool_id(query, expr)
+            ticket = dumps({**loads(query), "spool_id": spool_id})
+        limit = kwargs.get("limit")
+        with T.server_span(context, "estimate"):
+            estimate = self._estimate(expr, limit if isinstance(limit, int) else None)
+        if ticket is not query:
+            # the result is computed once, by do_get
+            spooled = self.spool.get(spool_id)
+            schema = expr.as_table().schema().to_pyarrow()
+            if spooled is not None and spooled.done.is_set():
+                num_rows, nbytes = spooled.num_rows, spooled.nbytes
+            else:
+                num_rows, nbytes = estimate or (-1, -1)
+        elif statement is not None:
+            # the schema is known, only do_get executes
+            schema = statement.schema
+            num_rows, nbytes = estimate or (-1, -1)
+        elif estimate is None:
+            # Execute query to get schema and metadata
+            with (
+                self.queries.track(query_id, context) as running,
+                self.scheduler.admit(S.QUERY, self._user(context)),
+            ):
+                result = self._execute(running, expr, params=params, **kwargs)
+            schema, num_rows, nbytes = result.schema, result.num_rows, result.nbytes
+        else:
+            schema = expr.as_table().schema().to_pyarrow()
+            num_rows, nbytes = estimate
         descriptor = pyarrow.flight.FlightDescriptor.for_command(query)
 
-        endpoints = [pyarrow.flight.FlightEndpoint(query, [self._location])]
+        endpoints = [pyarrow.flight.FlightEndpoint(ticket, [self._location])]
 
         return pyarrow.flight.FlightInfo(
-            result.schema, descriptor, endpoints, result.num_rows, result.nbytes
+            schema, descriptor, endpoints, num_rows, nbytes
         )
 
+    def _cursor(self):
+        """
+        A backend on a new cursor of the DuckDB connection, None for other
+        backends, call it holding the lock
+
+        A cursor is a connection to the same database: it sees the catalog
+        and the UDFs, but not the connection's temporary views, e.g. of
+        read_parquet, nor the Arrow data registered with it. So the tables
+        the memory manager tracks are registered with the cursor too, and the
+        views are created again.
+        """
+        cursor = getattr(self._conn.con, "cursor", None)
+        if cursor is None:
+            return None
+        views = self._conn.con.sql(
+            "SELECT view_name, sql FROM duckdb_views()"
+            " WHERE temporary AND NOT internal ORDER BY view_oid"
+        ).fetchall()
+        con = cursor()
+        registered = self.memory.registered()
+        for name, sql in views:
+            if sql:
+                con.execute(sql)
+            elif name in registered:
+                # Arrow data, unless it was dropped behind the manager's back
+                con.register(name, registered[name])
+        return type(self._conn).from_connection(con)
+
+    @contextlib.contextmanager
+    def _query_backend(self):
+        """
+        The (backend, lock) to run a query on, the lock to hold while using it
+
+        On DuckDB every query gets a cursor of its own, see _cursor, so queries
+        run concurrently with each other and with catalog calls, the server's
+        lock is only held to make it. The backends of others are not safe to
+        use from several threads, their queries hold the server's lock.
+        """
+        with self._conn_lock:
+            self.memory.enforce(self._conn)
+            conn = self._cursor()
+        if conn is None:
+            yield self._conn, self._conn_lock
+            return
+        try:
+            yield conn, contextlib.nullcontext()
+        finally:
+            conn.con.close()
+
+    def _execute(self, query, expr, params=None, **kwargs):
+        """
+        Execute expr on the backend, stopping between batches once the
+        RunningQuery is cancelled
+        """
+        try:
+            with (
+                T.server_span(query.context, "execute") as span,
+                self._query_backend() as (conn, lock),
+                lock,
+                self.queries.executing(query, lambda: interrupt_backend(conn)),
+            ):
+                reader = conn.to_pyarrow_batches(expr, params=params, **kwargs)
+                batches = []
+                for batch in reader:
+                    query.check()
+                    batches.append(batch)
+                if span is not None:
+                    span.set(num_rows=sum(batch.num_rows for batch in batches))
+        except Exception:
+            # an interrupted backend raises its own error, report why
+            query.check()
+            raise
+        return pa.Table.from_batches(batches, schema=reader.schema)
+
+    def _resolve(self, kwargs):
+        """
+        Pop the expression and its params off a command or ticket
+
+        A command either carries the expression or the handle of a prepared
+        statement with parameter values. Returns (expr, params, statement).
+        """
+        if "handle" not in kwargs:
+            return kwargs.pop("expr"), kwargs.pop("params", None), None
+        handle = kwargs.pop("handle")
+        statement = self.prepared.get(handle)
+        if statement is None:
+            raise pyarrow.flight.FlightServerError(
+                f"Unknown prepared statement {handle}"
+            )
+        try:
+            params = statement.bind(kwargs.pop("params", None))
+        except ValueError as e:
+            raise pyarrow.flight.FlightServerError(str(e))
+        kwargs.update(statement.kwargs)
+        return statement.expr, params, statement
+
     def get_flight_info(self, context, descriptor):
         """
         Get info about a specific query
         """
         query = descriptor.command
-        return self._make_flight_info(query)
+        if (command := FS.unpack(query)) is not None:
+            return FS.get_flight_info(self, context, descriptor, *command)
+        return self._make_flight_info(query, context)
 
     def do_get(self, context, ticket):
         """
         Execute SQL query and return results
         """
-        kwargs = loads(ticket.ticket)
-        expr = kwargs.pop("expr")
+        if (command := FS.unpack(ticket.ticket)) is not None:
+            return FS.do_get(self, context, *command)
+        # the ticket's expression has loaded ibis by now
+        from demo.plan import table_names
+
+        with T.server_span(context, "unpickle"):
+            kwargs = loads(ticket.ticket)
+        expr, params, statement = self._resolve(kwargs)
+        wire_optimize = W.wire_options(kwargs.pop("wire_optimize", None))
+        self.memory.touch(table_names(expr))
+        # for admission only: the catalog may have changed behind the
+        # statistics' back, e.g. through SQL, so they never stand in for results
+        limit = kwargs.get("limit")
+        with T.server_span(context, "estimate"):
+            estimate = self._estimate(expr, limit if isinstance(limit, int) else None)
+        query_id = kwargs.pop("query_id", None)
+        nbytes = estimate[1] if estimate else 0
+        spool = kwargs.pop("spool", False)
+        spool_id = kwargs.pop("spool_id", None)
+        offset = kwargs.pop("offset", 0)
+        # the rest, e.g. limit and chunk_size, go to the backend as they did
+        # in get_flight_info
+        kwargs = {key: value for key, value in kwargs.items() if value is not None}
+        if spool:
+            return self._do_get_spooled(
+                context,
+                expr,
+                spool_id or self._spool_id(ticket.ticket, expr),
+                query_id=query_id,
+                nbytes=nbytes,
+                offset=offset,
+                params=params,
+                wire_optimize=wire_optimize,
+                **kwargs,
+            )
+        stream = self._results(
+            context,
+            expr,
+            query_id=query_id,
+            nbytes=nbytes,
+            params=params,
+            wire_optimize=wire_optimize,
+            **kwargs,
+        )
         try:
-            # Execute query and convert to Arrow table
-            result = self._conn.to_pyarrow_batches(expr).read_all()
-            return pyarrow.flight.RecordBatchStream(result)
+            schema = next(stream)
+        except pyarrow.flight.FlightError:
+            raise
         except Exception as e:
             raise pyarrow.flight.FlightServerError(f"Error executing query: {str(e)}")
+        return pyarrow.flight.GeneratorStream(schema, stream)
 
-    def do_put(self, context, descriptor, reader, writer):
+    def _results(
+        self,
+        context,
+        expr,
+        query_id=None,
+        nbytes=0,
+        params=None,
+        wire_optimize=None,
+        **kwargs,
+    ):
+        """
+        Execute a query, yielding the schema of its result and then the result
+
+        The query is tracked and admitted until its result was streamed, or
+        until the generator is closed, so start it before streaming it.
+        """
+        with (
+            self.queries.track(query_id, context) as query,
+            self.scheduler.admit(S.QUERY, self._user(context), nbytes),
+        ):
+            # Execute query and convert to Arrow table
+            result = self._execute(query, expr, params=params, **kwargs)
+            if wire_optimize:
+                with T.server_span(context, "wire_optimize"):
+                    result = W.optimize_table(result, **wire_optimize)
+            yield result.schema
+            yield result
+
+    def _spooled_batches(
+        self,
+        context,
+        expr,
+        query_id=None,
+        nbytes=0,
+        params=None,
+        **kwargs,
+    ):
         """
-        Handle data upload - creates or updates a table
+        Run a query for the spool, yielding the schema of its result and then
+        its batches, kwargs go to the backend's to_pyarrow_batches
+
+        The query is tracked and admitted until its last batch was read, or
+        until the generator is closed, so start it before streaming it. It
+        outlives the call, which can be resumed, and is only stopped by a
+        cancel action.
         """
-        table_name = descriptor.command.decode("utf-8")
-        data = reader.read_all()
+        with (
+            self.queries.track(query_id) as query,
+            self.scheduler.admit(S.QUERY, self._user(context), nbytes),
+            self._query_backend() as (conn, lock),
+        ):
+            with lock:
+                reader = conn.to_pyarrow_batches(expr, params=params, **kwargs)
+            schema, batches = reader.schema, self._locked_batches(reader, lock, query)
+            yield schema
+            yield from batches
+
+    def _locked_batches(self, reader, lock, query):
+        # pull every batch under the backend's lock, stopping once cancelled
+        reader = iter(reader)
+        while True:
+            query.check()
+            with lock:
+                batch = next(reader, None)
+            if batch is None:
+                return
+            yield batch
+
+    def _do_get_spooled(
+        self, context, expr, spool_id, offset=0, wire_optimize=None, **kwargs
+    ):
+        """
+        Stream a result from the spool, running the query if it is not there
+
+        The spool holds the result as the backend returned it, an IPC file
+        can not change dictionaries between batches: the batches are encoded
+        for the wire as they are streamed.
+        """
+        self.spool.expire()
+        result, created = self.spool.get_or_create(spool_id)
+        if not created:
+            try:
+                schema, batches = self.spool.read(result, offset)
+            except Exception as e:
+                raise pyarrow.flight.FlightServerError(
+                    f"Error executing query: {str(e)}"
+                )
+            return self._spooled_stream(schema, batches, wire_optimize)
 
+        stream = self._spooled_batches(context, expr, **kwargs)
         try:
-            self._conn.register(data, table_name=table_name)
+            schema = next(stream)
         except Exception as e:
-            raise pyarrow.flight.FlightServerError(f"Error creating table: {str(e)}")
+            self.spool.discard(result)
+            result.error = e
+            result.done.set()
+            if isinstance(e, pyarrow.flight.FlightError):
+                raise
+            raise pyarrow.flight.FlightServerError(f"Error executing query: {str(e)}")
+        batches = self.spool.write(result, schema, stream)
+        return self._spooled_stream(
+            schema, itertools.islice(batches, offset, None), wire_optimize
+        )
+
+    def _spooled_stream(self, schema, batches, wire_optimize):
+        if wire_optimize:
+            schema, batches = W.optimize_batches(batches, schema, **wire_optimize)
+            # each batch has a dictionary of its own, which a GeneratorStream
+            # only sends for tables
+            batches = (pa.Table.from_batches([batch]) for batch in batches)
+        return pyarrow.flight.GeneratorStream(schema, batches)
+
+    def do_put(self, context, descriptor, reader, writer):
+        """
+        Handle data upload - creates or updates a table, or appends to one
+        """
+        if (command := FS.unpack(descriptor.command)) is not None:
+            return FS.do_put(self, context, *command, reader, writer)
+        try:
+            table_name, append = parse_put_command(descriptor.command)
+        except ValueError as e:
+            raise pyarrow.flight.FlightServerError(str(e))
+        if append is not None:
+            return self._do_put_append(context, table_name, reader, writer, append)
+        with self.scheduler.admit(S.WRITE, self._user(context)):
+            # an optimized upload carries its original schema, see demo.wire
+            with T.server_span(context, "read"):
+                data = W.restore(reader.read_all())
+            if self.coalesce:
+                data = coalesce_table(data, **self.coalesce)
+            # gathered before taking the lock, queries need not wait for it
+            with T.server_span(context, "stats"):
+                stats = TableStats.from_table(data)
+
+            try:
+                with T.server_span(context, "register"), self._conn_lock:
+                    self.memory.register(self._conn, table_name, data, stats)
+                    self.table_written(table_name)
+            except Exception as e:
+                raise pyarrow.flight.FlightServerError(
+                    f"Error creating table: {str(e)}"
+                )
+
+    def _do_put_append(self, context, table_name, reader, writer, options):
+        """
+        Append a stream to table_name, committing as it goes
+
+        The stream may stay open for as long as the writer has data, each
+        commit is acknowledged with a JSON message, see demo.ingest.
+        """
+        schema = reader.schema
+        restored_schema = W.original_schema(schema) or schema
+        with self._conn_lock:
+            existing = self.memory.schema(self._conn, table_name)
+        if existing is not None and not existing.equals(restored_schema):
+            raise pyarrow.flight.FlightServerError(
+                f"can not append {restored_schema} to {table_name}"
+                f" of schema {existing}"
+            )
+
+        def commit(batches):
+            data = W.restore(pa.Table.from_batches(batches, schema=schema))
+            if self.coalesce:
+                data = coalesce_table(data, **self.coalesce)
+            stats = TableStats.from_table(data)
+            with self.scheduler.admit(S.WRITE, self._user(context)):
+                with self._conn_lock:
+                    try:
+                        num_rows = self.memory.append(
+                            self._conn, table_name, data, stats
+                        )
+                    except ValueError as e:
+                        raise pyarrow.flight.FlightServerError(str(e))
+                    # the table is in memory from now on
+                    self.table_written(table_name)
+            return num_rows
+
+        for ack in append_stream(reader, commit, **options):
+            check_cancelled(context)
+            writer.write(encode_ack({"table_name": table_name, **ack}))
 
     def list_actions(self, context):
         """
@@ -178,7 +759,14 @@ class FlightServer(pyarrow.flight.FlightServerBase):
         cls = self.actions.get(action.type)
         if cls:
             print(f"doing action: {action.type}")
-            yield from cls.do_action(self, context, action)
+            if action.type in unscheduled_actions:
+                yield from cls.do_action(self, context, action)
+                return
+            priority = S.CATALOG if action.type in catalog_actions else S.WRITE
+            if (span := T.call_span(context)) is not None:
+                span.set(action=action.type)
+            with self.scheduler.admit(priority, self._user(context)):
+                yield from cls.do_action(self, context, action)
         else:
             raise KeyError("Unknown action {!r}".format(action.type))
 
@@ -186,22 +774,42 @@ class FlightServer(pyarrow.flight.FlightServerBase):
         if descriptor.descriptor_type != pyarrow.flight.DescriptorType.CMD:
             raise pa.ArrowInvalid("Must provide a command descriptor")
         command = descriptor.command.decode("ascii")
-        if command in self.exchangers:
+        exchanger = self.get_exchanger(command)
+        if exchanger is not None:
             print(f"Doing exchange: {command}")
-            return self.exchangers[command].exchange_f(context, reader, writer)
+            with self.scheduler.admit(S.QUERY, self._user(context)):
+                return exchanger.exchange_f(context, reader, writer)
         else:
             raise pa.ArrowInvalid("Unknown command: {}".format(descriptor.command))
 
+    def get_exchanger(self, command):
+        """
+        The exchanger of a command, None if there is none
+
+        A list of commands, or its JSON, gets a PipelineExchanger chaining them,
+        an expression command an ExprExchanger evaluating it.
+        """
+        if isinstance(command, (list, tuple)):
+            command = json.dumps(list(command))
+        if command in self.exchangers:
+            return self.exchangers[command]
+        if is_pipeline(command):
+            return PipelineExchanger.from_command(command, self.exchangers)
+        if is_expr(command):
+            return ExprExchanger.from_command(command)
+        return None
+
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--tls", nargs=2, default=None, metavar=("CERTFILE", "KEYFILE"))
+    parser.add_argument("--port", type=int, default=5005)
     args = parser.parse_args()
     tls_certificates = []
 
     scheme = "grpc+tls"
     host = "localhost"
-    port = "5005"
+    port = args.port
 
     with open(args.tls[0], "rb") as cert_file:
         tls_cert_chain = cert_file.read()
@@ -212,8 +820,10 @@ def main():
 
     location = "{}://{}:{}".format(scheme, host, port)
 
+    from demo import default_connection
+
     server = FlightServer(
-        duckdb.connect(":memory:"),
+        default_connection,
         location,
         tls_certificates=tls_certificates,
         auth_handler=NoOpAuthHandler(),
@@ -0,0 +1,228 @@
+import hashlib
+import itertools
+import threading
+import time
+
+import pyarrow
+import pyarrow.flight
+
+from demo.tracing import TracingClientMiddlewareFactory
+
+
+class Session:
+    """
+    A gRPC channel to a flight server and a bearer token for it
+
+    Sessions are shared by the FlightClients of a SessionPool. A call the
+    server rejects because it no longer knows the token authenticates again
+    and is retried once. A call the server is unavailable for marks the
+    session unhealthy, so the next FlightClient to acquire it waits for a
+    healthcheck first.
+
+    Parameters
+    ----------
+    location: str
+        The server's location, e.g. grpc+tls://localhost:5005.
+    username: str
+    password: str
+    tls_root_certs: bytes
+        Trusted certificates, None for the system's.
+    """
+
+    def __init__(self, location, username, password, tls_root_certs=None):
+        kwargs = {}
+        if tls_root_certs:
+            kwargs["tls_root_certs"] = tls_root_certs
+        self.location = location
+        self.username = username
+        self._password = password
+        # calls are traced while demo.tracing is enabled
+        self.client = pyarrow.flight.FlightClient(
+            location, middleware=[TracingClientMiddlewareFactory()], **kwargs
+        )
+        self.token_pair = None
+        self.options = None
+        self.healthy = False
+        self.refcount = 0
+        self.released_at = None
+        self._lock = threading.Lock()
+
+    def _wait_on_healthcheck(self):
+        while True:
+            try:
+                list(
+                    self.client.do_action(
+                        pyarrow.flight.Action("healthcheck", b""),
+                        options=pyarrow.flight.FlightCallOptions(timeout=1),
+                    )
+                )
+                print("done healthcheck")
+                break
+            except pyarrow.ArrowIOError as e:
+                if "Deadline" in str(e):
+                    print("Server is not ready, waiting...")
+                else:
+                    raise e
+            except pyarrow.flight.FlightUnavailableError:
+                pass
+            except pyarrow.flight.FlightUnauthenticatedError:
+                break
+            n_seconds = 0.1
+            print(f"Flight server unavailable, sleeping {n_seconds} seconds")
+            time.sleep(n_seconds)
+
+    def _authenticate(self):
+        self.token_pair = self.client.authenticate_basic_token(
+            self.username.encode(), self._password.encode()
+        )
+        self.options = pyarrow.flight.FlightCallOptions(headers=[self.token_pair])
+
+    def check(self):
+        """Wait for the server to answer and authenticate"""
+        with self._lock:
+            if self.healthy:
+                return
+            self._wait_on_healthcheck()
+            self._authenticate()
+            self.healthy = True
+
+    def refresh(self, options):
+        """Get a new token, unless another thread replaced options already"""
+        with self._lock:
+            if self.options is options:
+                self._authenticate()
+
+    def call(self, f, *args, **kwargs):
+        """Call f, a method of self.client, see the class docstring"""
+        options = self.options
+        try:
+            return f(*args, **kwargs)
+        except pyarrow.flight.FlightUnauthenticatedError:
+            # only calls made with this session's token can be retried
+            if not any(arg is options for arg in (*args, *kwargs.values())):
+                raise
+            self.refresh(options)
+            args = [self.options if arg is options else arg for arg in args]
+            kwargs = {
+                key: self.options if value is options else value
+                for key, value in kwargs.items()
+            }
+            return f(*args, **kwargs)
+        except pyarrow.flight.FlightUnavailableError as e:
+            # a busy server is still a healthy one, see demo.scheduler
+            if "server busy" not in str(e):
+                self.healthy = False
+            raise
+
+    def close(self):
+        self.client.close()
+
+
+class SessionClient:
+    """A pyarrow FlightClient whose calls go through a Session"""
+
+    def __init__(self, session):
+        self._session = session
+
+    def __getattr__(self, name):
+        method = getattr(self._session.client, name)
+        if name not in ("get_flight_info", "do_get", "do_put", "do_exchange"):
+            return method
+
+        def call(*args, **kwargs):
+            return self._session.call(method, *args, **kwargs)
+
+        return call
+
+    def do_action(self, *args, **kwargs):
+        # errors surface while iterating, so the first result is read inside
+        # the call, the others stream
+        def f(*args, **kwargs):
+            results = self._session.client.do_action(*args, **kwargs)
+            return next(results, None), results
+
+        first, results = self._session.call(f, *args, **kwargs)
+        if first is None:
+            return iter(())
+        return itertools.chain([first], results)
+
+
+class SessionPool:
+    """
+    Sessions shared across the FlightClients of a process
+
+    Sessions are keyed by location and credentials. Acquiring one that is
+    in use costs no TLS handshake, authentication or healthcheck. A session
+    no FlightClient holds stays open for `idle_ttl` seconds, its channel is
+    reused but it authenticates again.
+
+    Parameters
+    ----------
+    idle_ttl: float
+        Seconds an unused session is kept open.
+    """
+
+    def __init__(self, idle_ttl=300.0):
+        self.idle_ttl = idle_ttl
+        self.sessions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(location, username, password, tls_root_certs):
+        secret = hashlib.sha256(password.encode() + (tls_root_certs or b""))
+        return location, username, secret.hexdigest()
+
+    def acquire(self, location, username, password, tls_root_certs=None):
+        key = self._key(location, username, password, tls_root_certs)
+        with self._lock:
+            self._expire()
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.sessions[key] = Session(
+                    location, username, password, tls_root_certs
+                )
+            elif session.refcount == 0:
+                # an idle session's server may have been replaced since, e.g.
+                # by another on the same port, and a put can not be retried
+                # once its token is rejected
+                session.healthy = False
+            session.refcount += 1
+        try:
+            session.check()
+        except BaseException:
+            self.release(session)
+            raise
+        return session
+
+    def release(self, session):
+        with self._lock:
+            session.refcount -= 1
+            if session.refcount == 0:
+                session.released_at = time.monotonic()
+            self._expire()
+
+    def _expire(self):
+        now = time.monotonic()
+        for key, session in list(self.sessions.items()):
+            if session.refcount == 0 and now - session.released_at >= self.idle_ttl:
+                del self.sessions[key]
+                session.close()
+
+    def clear(self):
+        """Close the sessions no FlightClient holds"""
+        with self._lock:
+            for key, session in list(self.sessions.items()):
+                if session.refcount == 0:
+                    del self.sessions[key]
+                    session.close()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "sessions": len(self.sessions),
+                "in_use": sum(1 for s in self.sessions.values() if s.refcount),
+            }
+
+
+# shared by every FlightClient unless given another pool
+pool = SessionPool()
@@ -0,0 +1,255 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, Mapping
+
+import ibis
+import ibis.expr.operations as ops
+import letsql as ls
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from ibis import util
+from ibis.expr import types as ir, schema as sch
+from letsql.backends.duckdb import Backend as DuckDBBackend
+
+from demo.parquet import expand_paths
+from demo.plan import is_scan, split_aggregate
+
+
+def partition(table, n, by=None, method="hash"):
+    """
+    Split table into n tables
+
+    Rows go by a hash of the `by` columns, or by ranges of the single `by`
+    column cut at its quantiles, so each shard gets about as many rows. With
+    no `by` the table is cut into n contiguous slices.
+    """
+    if by is None:
+        bounds = np.linspace(0, table.num_rows, n + 1).astype(int)
+        return [table.slice(lo, hi - lo) for lo, hi in zip(bounds, bounds[1:])]
+    by = [by] if isinstance(by, str) else list(by)
+    if method == "hash":
+        keys = pd.util.hash_pandas_object(table.select(by).to_pandas(), index=False)
+        shards = keys.to_numpy() % n
+    elif method == "range":
+        if len(by) != 1:
+            raise ValueError("range partitioning takes a single column")
+        values = table[by[0]]
+        quantiles = [i / n for i in range(1, n)]
+        bounds = pc.quantile(values, q=quantiles, interpolation="lower")
+        shards = np.searchsorted(
+            bounds.to_numpy(zero_copy_only=False),
+            values.to_numpy(zero_copy_only=False),
+            side="right",
+        )
+    else:
+        raise ValueError(f"Unknown partitioning method {method!r}")
+    return [table.filter(pa.array(shards == i)) for i in range(n)]
+
+
+class ShardedBackend(DuckDBBackend):
+    """
+    A coordinator that spreads tables over several flight servers
+
+    Tables are partitioned over the shards when loaded, and queries are
+    scattered to all shards and their partial results merged locally:
+    filters and projections of a table run on every shard, limits and sorts
+    are pushed down and finished here, and aggregates of sums, counts,
+    minimums, maximums and means run as partial aggregates per shard. Any
+    other query gathers the tables it reads from the shards and runs on a
+    local DuckDB connection.
+
+    Parameters
+    ----------
+    shards: list of demo.backend.Backend
+        A connected Backend per server.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shards = []
+        self.con = None
+
+    def do_connect(self, shards=()) -> None:
+        self.shards = list(shards)
+        # merges the partial results
+        self.con = ls.duckdb.connect()
+
+    def _map(self, f, *iterables):
+        with ThreadPoolExecutor(max(len(self.shards), 1)) as executor:
+            return list(executor.map(f, self.shards, *iterables))
+
+    def get_schema(
+        self,
+        table_name: str,
+        *,
+        catalog: str | None = None,
+        database: str | None = None,
+    ) -> sch.Schema:
+        return self.shards[0].get_schema(table_name)
+
+    def read_in_memory(
+        self,
+        source: pd.DataFrame | pa.Table | pa.RecordBatchReader,
+        table_name: str | None = None,
+        partition_by: str | Iterable[str] | None = None,
+        method: str = "hash",
+    ) -> ir.Table:
+        table_name = table_name or util.gen_name("read_in_memory")
+        if isinstance(source, pd.DataFrame):
+            source = pa.Table.from_pandas(source, preserve_index=False)
+        elif isinstance(source, pa.RecordBatchReader):
+            source = source.read_all()
+        parts = partition(source, len(self.shards), by=partition_by, method=method)
+
+        def upload(shard, part):
+            shard.flush()
+            shard.con.upload_data(table_name, part)
+
+        self._map(upload, parts)
+        return self.table(table_name)
+
+    def read_parquet(
+        self,
+        source_list: str | Iterable[str],
+        table_name: str | None = None,
+        partition_by: str | Iterable[str] | None = None,
+        method: str = "hash",
+        **kwargs: Any,
+    ) -> ir.Table:
+        table_name = table_name or util.gen_name("read_parquet")
+        paths = expand_paths(source_list)
+        if partition_by is not None or not paths:
+            return self.read_in_memory(
+                pq.read_table(list(paths) if paths else source_list),
+                table_name=table_name,
+                partition_by=partition_by,
+                method=method,
+            )
+
+        # spread the files, shards without any get an empty table
+        n = len(self.shards)
+        files = [paths[i::n] for i in range(n)]
+        empty = pq.read_schema(paths[0]).empty_table()
+
+        def read(shard, files):
+            if files:
+                shard.read_parquet(list(files), table_name=table_name)
+            else:
+                shard.read_in_memory(empty, table_name=table_name)
+
+        self._map(read, files)
+        return self.table(table_name)
+
+    def register(
+        self,
+        source: Any,
+        table_name: str | None = None,
+        **kwargs: Any,
+    ) -> ir.Table:
+        if isinstance(source, ir.Table):
+            source = source.to_pyarrow()
+        return self.read_in_memory(source, table_name=table_name, **kwargs)
+
+    @property
+    def tables(self):
+        return self.shards[0].tables
+
+    def drop_table(
+        self,
+        name: str,
+        database: tuple[str, str] | str | None = None,
+        force: bool = False,
+    ) -> None:
+        for shard in self.shards:
+            shard.drop_table(name, force=force)
+
+    def drop_view(
+        self,
+        name: str,
+        *,
+        database: str | None = None,
+        schema: str | None = None,
+        force: bool = False,
+    ) -> None:
+        for shard in self.shards:
+            shard.drop_view(name, force=force)
+
+    def _scatter(self, op, params=None):
+        """Run op on every shard, returns the concatenated results"""
+        expr = op.to_expr().unbind()
+        results = self._map(
+            lambda shard: shard.to_pyarrow_batches(expr, params=params).read_all()
+        )
+        return pa.concat_tables(results)
+
+    def _gather(self, expr, params=None):
+        """Run expr locally over the whole of the tables it reads"""
+        for table in expr.op().find(ops.DatabaseTable):
+            self.con.con.register(table.name, self._scatter(table))
+        return self.con.to_pyarrow_batches(expr.unbind(), params=params).read_all()
+
+    def _execute(self, expr, params=None):
+        op = expr.op()
+        limit = keys = None
+        if isinstance(op, ops.Limit) and isinstance(op.n, int) and op.offset == 0:
+            limit, op = op.n, op.parent
+        if isinstance(op, ops.Sort) and all(
+            isinstance(key.expr, ops.Field) and key.expr.rel == op.parent
+            for key in op.keys
+        ):
+            keys, op = op.keys, op.parent
+
+        if is_scan(op):
+            # every shard returns its first rows, in order if need be
+            pushed = op
+            if limit is not None:
+                pushed = ops.Limit(ops.Sort(op, keys) if keys else op, limit, 0)
+            merged = ibis.memtable(self._scatter(pushed, params))
+        elif (split := split_aggregate(op)) is not None:
+            partial, merge = split
+            merged = merge(ibis.memtable(self._scatter(partial, params)))
+        else:
+            return self._gather(expr, params)
+
+        if keys:
+            merged = merged.order_by(
+                [
+                    ibis.asc(key.expr.name) if key.ascending else ibis.desc(key.expr.name)
+                    for key in keys
+                ]
+            )
+        if limit is not None:
+            merged = merged.limit(limit)
+        return self.con.to_pyarrow_batches(merged).read_all()
+
+    def to_pyarrow_batches(
+        self,
+        expr: ir.Expr,
+        *,
+        params: Mapping[ir.Scalar, Any] | None = None,
+        limit: int | str | None = None,
+        chunk_size: int = 10_000,
+        **_: Any,
+    ) -> pa.ipc.RecordBatchReader:
+        for shard in self.shards:
+            shard.flush()
+        table_expr = expr.as_table()
+        if limit == "default":
+            limit = ibis.options.sql.default_limit
+        if limit is not None:
+            table_expr = table_expr.limit(limit)
+        result = self._execute(table_expr, params)
+        return result.to_reader(max_chunksize=chunk_size)
+
+    def to_pyarrow(
+        self,
+        expr: ir.Expr,
+        *,
+        params: Mapping[ir.Scalar, Any] | None = None,
+        limit: int | str | None = None,
+        **kwargs: Any,
+    ) -> pa.Table:
+        table = self.to_pyarrow_batches(expr, params=params, limit=limit).read_all()
+        return expr.__pyarrow_result__(table)
@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import pyarrow as pa
+
+
+class SpooledResult:
+    def __init__(self, key, path):
+        self.key = key
+        self.path = path
+        # set once the file is complete, or the query failed
+        self.done = threading.Event()
+        self.error = None
+        self.num_batches = 0
+        self.num_rows = 0
+        self.nbytes = 0
+        self.last_access = time.monotonic()
+
+    def to_dict(self):
+        return {
+            "done": self.done.is_set(),
+            "num_batches": self.num_batches,
+            "num_rows": self.num_rows,
+            "nbytes": self.nbytes,
+            "idle": time.monotonic() - self.last_access,
+        }
+
+
+class ResultSpool:
+    """
+    Query results written to Arrow IPC files as they are streamed
+
+    A result is kept for `ttl` seconds after it was last read, so a client
+    whose stream broke can resume from the last batch it received, and other
+    clients asking for the same result read the memory-mapped file instead of
+    running the query again.
+
+    Parameters
+    ----------
+    ttl: float
+        Seconds a result is kept after it was last read.
+    spool_dir: str
+        Where to write results, a temporary directory by default.
+    """
+
+    def __init__(self, ttl=600, spool_dir=None):
+        self.ttl = ttl
+        self._spool_dir = spool_dir
+        self._own_spool_dir = spool_dir is None
+        self.results = {}
+        self._lock = threading.Lock()
+
+    @property
+    def spool_dir(self):
+        if self._spool_dir is None:
+            self._spool_dir = tempfile.mkdtemp(prefix="ephemeral-flight-spool-")
+        return self._spool_dir
+
+    def get_or_create(self, key):
+        """
+        Return (result, created), the caller of a created result must write it
+        """
+        with self._lock:
+            result = self.results.get(key)
+            if result is not None:
+                result.last_access = time.monotonic()
+                return result, False
+            path = os.path.join(self.spool_dir, f"{uuid.uuid4().hex}.arrow")
+            result = self.results[key] = SpooledResult(key, path)
+            return result, True
+
+    def get(self, key):
+        with self._lock:
+            return self.results.get(key)
+
+    def write(self, result, schema, batches):
+        """
+        Write batches to the result's file, yielding them as they are written
+
+        If the consumer goes away (the client's stream broke) the remaining
+        batches are still written, so the result can be resumed.
+        """
+        consumed = True
+        try:
+            with pa.OSFile(result.path, "wb") as sink:
+                with pa.ipc.new_file(sink, schema) as writer:
+                    for batch in batches:
+                        writer.write_batch(batch)
+                        result.num_batches += 1
+                        result.num_rows += batch.num_rows
+                        result.nbytes += batch.nbytes
+                        if consumed:
+                            try:
+                                yield batch
+                            except GeneratorExit:
+                                consumed = False
+        except Exception as e:
+            result.error = e
+            self.discard(result)
+            raise
+        finally:
+            result.done.set()
+
+    def read(self, result, offset=0):
+        """
+        Return the schema and batches of a result from batch `offset` on
+
+        Waits for a result that is still being written.
+        """
+        result.done.wait()
+        if result.error is not None:
+            raise result.error
+        result.last_access = time.monotonic()
+        reader = pa.ipc.open_file(pa.memory_map(result.path))
+
+        def gen():
+            for i in range(offset, reader.num_record_batches):
+                yield reader.get_batch(i)
+
+        return reader.schema, gen()
+
+    def discard(self, result):
+        with self._lock:
+            if self.results.get(result.key) is result:
+                del self.results[result.key]
+        try:
+            os.remove(result.path)
+        except FileNotFoundError:
+            pass
+
+    def expire(self):
+        """Remove the finished results that were not read for ttl seconds"""
+        if self.ttl is None:
+            return
+        cutoff = time.monotonic() - self.ttl
+        with self._lock:
+            expired = [
+                result
+                for result in self.results.values()
+                if result.done.is_set() and result.last_access <= cutoff
+            ]
+        for result in expired:
+            self.discard(result)
+
+    def clear(self):
+        with self._lock:
+            results = list(self.results.values())
+        for result in results:
+            self.discard(result)
+
+    def close(self):
+        self.clear()
+        if self._own_spool_dir and self._spool_dir is not None:
+            shutil.rmtree(self._spool_dir, ignore_errors=True)
+            self._spool_dir = None
+
@@ -0,0 +1,286 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from demo.parquet import ColumnChunkInfo
+
+
+DEFAULT_PRECISION = 12
+
+# the selectivity assumed of a predicate the statistics say nothing about
+DEFAULT_SELECTIVITY = 1 / 3
+
+
+class HyperLogLog:
+    """
+    An approximate distinct count, mergeable across batches
+
+    Uses 2 ** precision one byte registers, for a relative error of about
+    1.04 / sqrt(2 ** precision), 1.6% by default.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = (
+            np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+        )
+
+    def add(self, values):
+        """Add the values of an Arrow array, nulls are ignored"""
+        import pandas as pd
+
+        values = pc.unique(values.drop_null())
+        if not len(values):
+            return
+        hashes = pd.util.hash_array(values.to_numpy(zero_copy_only=False))
+        rest_bits = 64 - self.precision
+        index = (hashes >> np.uint64(rest_bits)).astype(np.int64)
+        rest = hashes & np.uint64((1 << rest_bits) - 1)
+        # rest has at most 52 bits, so its float64 log2 is exact enough
+        nonzero = rest > 0
+        log2 = np.log2(rest.astype(np.float64), where=nonzero, out=np.zeros(len(rest)))
+        bit_length = np.where(nonzero, np.floor(log2) + 1, 0)
+        rank = (rest_bits - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        return HyperLogLog(
+            self.precision, np.maximum(self.registers, other.registers)
+        )
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            return round(m * np.log(m / zeros))
+        return round(raw)
+
+
+def _orderable(typ):
+    return not (
+        pa.types.is_nested(typ)
+        or pa.types.is_dictionary(typ)
+        or pa.types.is_null(typ)
+    )
+
+
+# types whose min and max convert to Python exactly, so they can rule out rows
+def _exact(typ):
+    return (
+        pa.types.is_integer(typ)
+        or pa.types.is_floating(typ)
+        or pa.types.is_decimal(typ)
+        or pa.types.is_boolean(typ)
+        or pa.types.is_date(typ)
+        or pa.types.is_string(typ)
+        or pa.types.is_large_string(typ)
+        or (pa.types.is_timestamp(typ) and typ.unit != "ns")
+    )
+
+
+class ColumnStats(ColumnChunkInfo):
+    """The statistics of a column: nulls, bytes, min, max and distinct values"""
+
+    def __init__(self, name, min, max, null_count, nbytes, hll=None, distinct=None):
+        super().__init__(name, min, max, null_count, nbytes)
+        self.hll = hll
+        # an exact count, when there is no hll to estimate it
+        self._distinct = distinct
+
+    @classmethod
+    def from_array(cls, name, array):
+        min = max = hll = None
+        if _orderable(array.type):
+            try:
+                if _exact(array.type):
+                    min_max = pc.min_max(array)
+                    min, max = min_max["min"].as_py(), min_max["max"].as_py()
+                hll = HyperLogLog()
+                hll.add(array)
+            except (pa.ArrowNotImplementedError, TypeError):
+                # e.g. extension types, left without statistics
+                min = max = hll = None
+        return cls(name, min, max, array.null_count, array.nbytes, hll)
+
+    def merge(self, other):
+        def pick(f, a, b):
+            if a is None or b is None:
+                return b if a is None else a
+            return f(a, b)
+
+        hll = None
+        if self.hll is not None and other.hll is not None:
+            hll = self.hll.merge(other.hll)
+        return ColumnStats(
+            self.name,
+            pick(min, self.min, other.min),
+            pick(max, self.max, other.max),
+            self.null_count + other.null_count,
+            self.nbytes + other.nbytes,
+            hll,
+        )
+
+    @property
+    def distinct(self):
+        return self._distinct if self.hll is None else self.hll.estimate()
+
+    def selectivity(self, op, value, num_rows):
+        """The estimated fraction of rows for which `column <op> value` holds"""
+        if not self.may_match(op, value):
+            return 0.0
+        if not num_rows:
+            return 1.0
+        non_null = 1 - self.null_count / num_rows
+        distinct = self.distinct or 1
+        if op == "==":
+            return non_null / distinct
+        if op == "!=":
+            return non_null * (1 - 1 / distinct)
+        try:
+            span = self.max - self.min
+            if span > 0:
+                if op in (">", ">="):
+                    return non_null * min(1.0, (self.max - value) / span)
+                return non_null * min(1.0, (value - self.min) / span)
+        except TypeError:
+            pass
+        return non_null * DEFAULT_SELECTIVITY
+
+    def to_dict(self):
+        return {
+            "min": self.min,
+            "max": self.max,
+            "null_count": self.null_count,
+            "nbytes": self.nbytes,
+            "distinct": self.distinct,
+        }
+
+
+class TableStats:
+    """
+    The statistics of a table, gathered as its data arrives
+
+    Tables uploaded to the server get them from their data, appends merge
+    the statistics of the new rows in. Tables read from parquet get them
+    from the files' footers, which have no distinct counts. Others, e.g.
+    views, get them from a query, see from_expr.
+    """
+
+    def __init__(self, num_rows, nbytes, columns):
+        self.num_rows = num_rows
+        self.nbytes = nbytes
+        # name -> ColumnStats
+        self.columns = columns
+
+    @classmethod
+    def from_table(cls, table):
+        columns = {
+            name: ColumnStats.from_array(name, table[name]) for name in table.column_names
+        }
+        return cls(table.num_rows, table.nbytes, columns)
+
+    @classmethod
+    def from_expr(cls, expr, execute):
+        """
+        The statistics of an ibis table expression, e.g. a view, aggregated
+        by the backend
+
+        execute runs an expression to a pyarrow Table, of one row here, so the
+        data is not read into the server. There are no byte counts.
+        """
+        metrics = {"num_rows": expr.count()}
+        for i, (name, typ) in enumerate(expr.schema().items()):
+            column = expr[name]
+            metrics[f"null_count_{i}"] = column.isnull().sum()
+            arrow_type = typ.to_pyarrow()
+            if _orderable(arrow_type):
+                metrics[f"distinct_{i}"] = column.nunique()
+                if _exact(arrow_type):
+                    metrics[f"min_{i}"] = column.min()
+                    metrics[f"max_{i}"] = column.max()
+        (row,) = execute(expr.aggregate(**metrics)).to_pylist()
+        columns = {
+            name: ColumnStats(
+                name,
+                row.get(f"min_{i}"),
+                row.get(f"max_{i}"),
+                row[f"null_count_{i}"] or 0,
+                None,
+                distinct=row.get(f"distinct_{i}"),
+            )
+            for i, name in enumerate(expr.columns)
+        }
+        return cls(row["num_rows"], None, columns)
+
+    @classmethod
+    def from_layout(cls, table):
+        """
+        The statistics that need not read the data, e.g. of a memory-mapped
+        table: row, null and byte counts, no min, max or distinct counts
+        """
+        columns = {
+            name: ColumnStats(name, None, None, table[name].null_count, table[name].nbytes)
+            for name in table.column_names
+        }
+        return cls(table.num_rows, table.nbytes, columns)
+
+    @classmethod
+    def from_parquet(cls, infos):
+        num_rows = nbytes = 0
+        columns = {}
+        for info in infos:
+            for row_group in info.row_groups:
+                num_rows += row_group.num_rows
+                for name, chunk in row_group.columns.items():
+                    nbytes += chunk.nbytes
+                    stats = ColumnStats(
+                        name, chunk.min, chunk.max, chunk.null_count or 0, chunk.nbytes
+                    )
+                    columns[name] = (
+                        stats if name not in columns else columns[name].merge(stats)
+                    )
+        return cls(num_rows, nbytes, columns)
+
+    def merge(self, other):
+        return TableStats(
+            self.num_rows + other.num_rows,
+            self.nbytes + other.nbytes,
+            {
+                name: column.merge(other.columns[name])
+                if name in other.columns
+                else column
+                for name, column in self.columns.items()
+            },
+        )
+
+    def estimate(self, columns=None, predicates=(), limit=None):
+        """
+        Estimate (num_rows, nbytes) of a scan over the table
+
+        num_rows is 0 only when the statistics rule out every row, and exact
+        when there are no predicates.
+        """
+        fraction = 1.0
+        for name, op, value in predicates:
+            if (column := self.columns.get(name)) is not None:
+                fraction *= column.selectivity(op, value, self.num_rows)
+        num_rows = self.num_rows if fraction == 1.0 else round(self.num_rows * fraction)
+        if fraction > 0 and self.num_rows:
+            num_rows = max(num_rows, 1)
+        names = self.columns if columns is None else columns
+        width = sum(self.columns[name].nbytes for name in names if name in self.columns)
+        nbytes = width * num_rows // self.num_rows if self.num_rows else 0
+        if limit is not None and num_rows > limit:
+            nbytes = nbytes * limit // num_rows
+            num_rows = limit
+        return num_rows, nbytes
+
+    def to_dict(self):
+        return {
+            "num_rows": self.num_rows,
+            "nbytes": self.nbytes,
+            "columns": {name: column.to_dict() for name, column in self.columns.items()},
+        }
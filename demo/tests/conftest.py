@@ -0,0 +1,26 @@
+import pytest
+
+from demo import EphemeralServer, BasicAuth
+from util import certificate_path, key_path, scheme, host
+
+
+def _make_server(**kwargs):
+    return EphemeralServer(
+        location="{}://{}:{}".format(scheme, host, 0),
+        certificate_path=certificate_path,
+        key_path=key_path,
+        auth=BasicAuth("test", "password"),
+        **kwargs,
+    )
+
+
+@pytest.fixture(scope="session")
+def make_server():
+    """Start an EphemeralServer on a free port, kwargs are passed on to it"""
+    return _make_server
+
+
+@pytest.fixture
+def main(make_server):
+    with make_server() as main:
+        yield main
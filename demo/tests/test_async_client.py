@@ -0,0 +1,77 @@
+import asyncio
+import threading
+
+import ibis
+import pyarrow as pa
+
+from demo.async_client import AsyncFlightClient
+from demo.udf import VectorizedUDF
+from util import certificate_path, host
+
+
+def test_concurrent_queries_and_exchanges(make_server):
+    data = pa.table({"a": range(1_000), "b": range(1_000, 2_000)})
+
+    async def run(port):
+        client = await AsyncFlightClient.connect(
+            host=host, port=port, tls_roots=certificate_path
+        )
+        await client.upload("data", data.to_reader(max_chunksize=100))
+
+        t = ibis.table(data.schema, name="data")
+        queries = [client.execute_query(t.filter(t.a < i)) for i in range(1, 101)]
+        exchanges = [
+            client.exchange("echo", data.to_reader(max_chunksize=100))
+            for _ in range(10)
+        ]
+        results = await asyncio.gather(*queries)
+        streams = await asyncio.gather(*exchanges)
+        echoed = await asyncio.gather(*(stream.read_all() for stream in streams))
+        (tables,) = await client.action("list_tables")
+        return results, echoed, tables
+
+    with make_server() as main:
+        results, echoed, tables = asyncio.run(run(main.port))
+
+    assert [result.num_rows for result in results] == list(range(1, 101))
+    assert all(table.equals(data) for table in echoed)
+    assert "data" in tables
+
+
+def test_queries_run_concurrently(make_server):
+    # every query waits for the others and for a catalog call, which only
+    # returns if they all run at the same time
+    barrier = threading.Barrier(3)
+    met = threading.Event()
+
+    def wait(a):
+        # get_flight_info executes the query and do_get again, only the
+        # first meet
+        if not met.is_set():
+            barrier.wait(timeout=10)
+            met.set()
+        return a
+
+    async def run(port):
+        client = await AsyncFlightClient.connect(
+            host=host, port=port, tls_roots=certificate_path
+        )
+        await client.upload("data", pa.table({"a": [1, 2, 3]}).to_reader())
+        t = ibis.table({"a": "int64"}, name="data")
+        # calls the server's function by name, without pickling the barrier
+        call = VectorizedUDF(lambda a: a, [pa.int64()], pa.int64(), name="wait")
+        expr = t.select(a=call.to_ibis()(t.a))
+        queries = [
+            asyncio.create_task(client.execute_query(expr)) for _ in range(2)
+        ]
+        (tables,) = await client.action("list_tables")
+        await asyncio.to_thread(barrier.wait, 10)
+        return await asyncio.gather(*queries), tables
+
+    udf = VectorizedUDF(wait, [pa.int64()], pa.int64())
+    with make_server() as main:
+        main.server.add_udf(udf)
+        results, tables = asyncio.run(run(main.port))
+
+    assert [result["a"].to_pylist() for result in results] == [[1, 2, 3]] * 2
+    assert "data" in tables
@@ -0,0 +1,74 @@
+import pyarrow as pa
+import pyarrow.flight
+import pytest
+
+from demo import make_con
+from demo.client import FlightClient
+from util import certificate_path, host
+
+
+class CountingClient:
+    """A pyarrow FlightClient that counts its actions"""
+
+    def __init__(self, client):
+        self._client = client
+        self.actions = []
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def do_action(self, action, options=None):
+        self.actions.append(action.type)
+        return self._client.do_action(action, options=options)
+
+
+def read_parquet(table_name):
+    args = {"source_list": "data/batting.parquet", "table_name": table_name}
+    return ("read_parquet", args)
+
+
+def test_batch(main):
+    client = FlightClient(host=host, port=main.port, tls_roots=certificate_path)
+    results = client.do_batch(
+        [
+            read_parquet("b"),
+            ("list_tables", "list_tables"),
+            ("table_info", b"b"),
+        ]
+    )
+    assert results[0] == ("read parquet file b",)
+    assert results[1] == (("b",),)
+    assert "teamID" in results[2][0]
+
+    with pytest.raises(pyarrow.flight.FlightServerError, match=r"batch action 1"):
+        client.do_batch(
+            [
+                read_parquet("c"),
+                ("drop_view", "missing"),
+            ],
+            transaction=True,
+        )
+    # rolled back
+    assert client.list_tables() == [("b",)]
+
+
+def test_backend_groups_catalog_calls(main):
+    con = make_con(main)
+    con.con._client = counting = CountingClient(con.con._client)
+    t = con.read_parquet("data/batting.parquet", table_name="b")
+    assert "teamID" in t.columns
+    assert counting.actions == ["batch"]
+    con.read_in_memory(pa.table({"a": [1]}), table_name="scratch1")
+    con.read_in_memory(pa.table({"a": [1]}), table_name="scratch2")
+
+    # drops are sent right away
+    del counting.actions[:]
+    con.drop_table("scratch1")
+    con.drop_view("scratch2")
+    assert counting.actions == ["batch", "batch"]
+    assert sorted(con.tables) == ["b"]
+
+    with pytest.raises(pyarrow.flight.FlightServerError):
+        con.drop_table("scratch1")
+    con.drop_table("scratch1", force=True)
+    con.drop_view("scratch2", force=True)
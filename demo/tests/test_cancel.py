@@ -0,0 +1,90 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.flight
+import pytest
+
+import letsql as ls
+from cloudpickle import dumps
+
+from demo.client import FlightClient
+from demo.coalesce import Chunk
+from demo.exchanger import streaming_exchange
+from util import certificate_path, host
+
+
+class Context:
+    def __init__(self, cancel_after):
+        self.n_calls = 0
+        self.cancel_after = cancel_after
+
+    def is_cancelled(self):
+        self.n_calls += 1
+        return self.n_calls > self.cancel_after
+
+
+def slow_expr():
+    t = ls.table({"a": "int64"}, name="t")
+    u = t.view().rename(b="a")
+    return t.cross_join(u).filter(lambda x: (x.a + x.b) % 7 == 3).count().as_table()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_streaming_exchange_stops_when_cancelled():
+    batches = pa.table({"a": range(10)}).to_batches(max_chunksize=1)
+    seen = []
+
+    def f(batch, metadata=None):
+        seen.append(batch)
+        return batch
+
+    class Writer:
+        def begin(self, schema, options=None):
+            pass
+
+        def write_batch(self, batch):
+            pass
+
+    with pytest.raises(pyarrow.flight.FlightCancelledError):
+        streaming_exchange(f, Context(2), [Chunk(b) for b in batches], Writer())
+    assert len(seen) == 2
+
+
+def test_cancel_query(main):
+    client = FlightClient(host=host, port=main.port, tls_roots=certificate_path)
+    client.upload_data("t", pa.table({"a": range(200_000)}))
+    queries = main.server.queries
+
+    # by id, from another client
+    with ThreadPoolExecutor(1) as executor:
+        started = time.monotonic()
+        future = executor.submit(
+            lambda: client.execute_batches(slow_expr(), query_id="q1").read_all()
+        )
+        wait_for(lambda: "q1" in queries.queries)
+        other = FlightClient(host=host, port=main.port, tls_roots=certificate_path)
+        assert other.cancel_query("q1")
+        with pytest.raises(pyarrow.flight.FlightCancelledError):
+            future.result()
+        assert time.monotonic() - started < 5
+    assert not other.cancel_query("q1")
+
+    # by the client going away, here when its deadline passes
+    with pytest.raises(pyarrow.flight.FlightTimedOutError):
+        client._client.do_get(
+            pyarrow.flight.Ticket(dumps({"expr": slow_expr(), "query_id": "q2"})),
+            options=pyarrow.flight.FlightCallOptions(
+                headers=[client._token_pair], timeout=0.5
+            ),
+        ).read_all()
+    wait_for(lambda: not queries.queries, timeout=2)
+    # the server is free for the next query
+    t = ls.table({"a": "int64"}, name="t")
+    assert client.execute_query(t).num_rows == 200_000
@@ -0,0 +1,74 @@
+import threading
+
+import pyarrow as pa
+
+from demo.client import FlightClient
+from demo.coalesce import Chunk, coalesce_batches, coalesce_chunks
+from util import certificate_path, host
+
+
+def test_coalesce_batches():
+    table = pa.table({"a": range(1_000)})
+    batches = list(
+        coalesce_batches(table.to_batches(max_chunksize=10), target_rows=300)
+    )
+    assert [batch.num_rows for batch in batches] == [300, 300, 300, 100]
+    assert pa.Table.from_batches(batches).equals(table)
+
+    (big,) = table.to_batches()
+    batches = list(coalesce_batches([big], target_rows=400))
+    assert [batch.num_rows for batch in batches] == [400, 400, 200]
+
+    batches = list(
+        coalesce_batches(table.to_batches(max_chunksize=10), max_latency=0)
+    )
+    assert len(batches) == 100
+
+
+def test_stalled_upstream_is_flushed():
+    (a, b) = pa.table({"a": range(2)}).to_batches(max_chunksize=1)
+    replied = threading.Event()
+
+    def request_response():
+        # like a peer that sends its next request once it has a reply
+        yield a
+        assert replied.wait(5), "the first batch was held back"
+        yield b
+
+    batches = coalesce_batches(request_response(), max_latency=0.01)
+    assert next(batches).equals(a)
+    replied.set()
+    assert [batch.num_rows for batch in batches] == [1]
+
+
+def test_metadata_chunks_pass_through():
+    (a, b, c) = pa.table({"a": range(3)}).to_batches(max_chunksize=1)
+    chunks = list(
+        coalesce_chunks([Chunk(a), Chunk(b, b"meta"), Chunk(c)], target_rows=10)
+    )
+    assert [(chunk.data.num_rows, chunk.app_metadata) for chunk in chunks] == [
+        (1, None),
+        (1, b"meta"),
+        (1, None),
+    ]
+
+
+def test_exchange_is_coalesced(make_server):
+    data = pa.table({"a": range(100_000)})
+    with make_server(
+        # the server only coalesces uploads, so the echo shows what the
+        # client sent
+        coalesce=True,
+    ) as main:
+        client = FlightClient(host=host, port=main.port, tls_roots=certificate_path)
+        counts = {}
+        for coalesce in (False, True):
+            fut, rbr = client.do_exchange_batches(
+                "echo", data.to_reader(max_chunksize=100), coalesce=coalesce
+            )
+            batches = list(rbr)
+            fut.result()
+            assert pa.Table.from_batches(batches).equals(data)
+            counts[coalesce] = len(batches)
+
+    assert counts[True] < counts[False]
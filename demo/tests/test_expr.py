@@ -0,0 +1,88 @@
+import letsql as ls
+import pyarrow as pa
+import pytest
+
+from demo.client import FlightClient
+from util import certificate_path, host
+
+
+@pytest.fixture
+def client(main):
+    return FlightClient(host=host, port=main.port, tls_roots=certificate_path)
+
+
+@pytest.fixture
+def data():
+    return pa.table(
+        {
+            "a": range(100_000),
+            "b": [str(i % 7) for i in range(100_000)],
+            "c": [float(i) for i in range(100_000)],
+        }
+    )
+
+
+def exchange(client, expr, data, **kwargs):
+    fut, reader = client.do_exchange_expr(expr, data.to_reader(10_000), **kwargs)
+    result = reader.read_all()
+    fut.result()
+    return result
+
+
+def test_streaming_filter_project(client, data):
+    t = ls.table({"a": "int64", "b": "string"}, name="input")
+    expr = t.filter(t.a % 3 == 0).select(d=t.a * 2, b=t.b)
+    result = exchange(client, expr, data, coalesce=False)
+    assert result.column_names == ["d", "b"]
+    assert result["d"].to_pylist() == [a * 2 for a in range(0, 100_000, 3)]
+    # results streamed back per batch rather than once at the end
+    assert len(result.to_batches()) > 1
+
+
+def test_limit(client, data):
+    t = ls.table({"a": "int64"}, name="input")
+    result = exchange(client, t.filter(t.a > 15_000).limit(5), data, coalesce=False)
+    assert result["a"].to_pylist() == list(range(15_001, 15_006))
+
+
+def test_aggregate(client, data):
+    t = ls.table(data.schema, name="input")
+    expr = (
+        t.group_by("b")
+        .aggregate(n=t.count(), s=t.a.sum(), m=t.c.mean(), lo=t.a.min())
+        .order_by("b")
+    )
+    result = exchange(client, expr, data, coalesce=False)
+    df = data.to_pandas().groupby("b").agg(
+        n=("a", "size"), s=("a", "sum"), m=("c", "mean"), lo=("a", "min")
+    )
+    assert result["b"].to_pylist() == list(df.index)
+    assert result["n"].to_pylist() == list(df.n)
+    assert result["s"].to_pylist() == list(df.s)
+    assert result["m"].to_pylist() == pytest.approx(list(df.m))
+    assert result["lo"].to_pylist() == list(df.lo)
+
+
+def test_buffered(client, data):
+    t = ls.table({"a": "int64"}, name="input")
+    expr = t.order_by(t.a.desc()).limit(3)
+    assert exchange(client, expr, data)["a"].to_pylist() == [99_999, 99_998, 99_997]
+
+
+def test_in_pipeline(client, data):
+    from demo.expr import ExprExchanger
+
+    t = ls.table({"a": "int64"}, name="input")
+    stage = ExprExchanger(t.select(a=t.a + 1))
+    fut, reader = client.do_exchange_batches(
+        [stage.command, "row-sum-append"], data.select(["a"]).to_reader(10_000)
+    )
+    result = reader.read_all()
+    fut.result()
+    assert result["sum"].to_pylist() == [a + 1 for a in range(100_000)]
+
+
+def test_schema_mismatch(client, data):
+    t = ls.table({"a": "string"}, name="input")
+    with pytest.raises(ValueError, match="expr needs"):
+        client.do_exchange_expr(t, data.to_reader())
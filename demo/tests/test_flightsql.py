@@ -0,0 +1,184 @@
+import letsql as ls
+import pyarrow as pa
+import pyarrow.flight
+import pytest
+
+from demo.client import FlightClient
+from demo.flightsql import (
+    IF_EXISTS_APPEND,
+    IF_EXISTS_FAIL,
+    IF_EXISTS_REPLACE,
+    IF_NOT_EXIST_CREATE,
+    IF_NOT_EXIST_FAIL,
+    decode,
+    encode,
+    pack,
+    unpack,
+)
+from util import certificate_path, host
+
+
+data = pa.table({"a": [1, 2, 3], "b": ["x", "y", "z"]})
+
+
+@pytest.fixture
+def client(main):
+    return FlightClient(host=host, port=main.port, tls_roots=certificate_path)
+
+
+def descriptor(name, *fields):
+    return pyarrow.flight.FlightDescriptor.for_command(pack(name, encode(*fields)))
+
+
+def query(client, name, *fields):
+    info = client._client.get_flight_info(
+        descriptor(name, *fields), options=client._options
+    )
+    (endpoint,) = info.endpoints
+    reader = client._client.do_get(endpoint.ticket, options=client._options)
+    return info.schema, reader.read_all()
+
+
+def put(client, name, table, *fields):
+    writer, metadata_reader = client._client.do_put(
+        descriptor(name, *fields), table.schema, options=client._options
+    )
+    writer.write_table(table)
+    writer.done_writing()
+    result = metadata_reader.read()
+    writer.close()
+    return decode(result.to_pybytes())
+
+
+def ingest(client, table_name, table, if_not_exist=IF_NOT_EXIST_CREATE, if_exists=IF_EXISTS_FAIL):
+    options = encode((1, if_not_exist), (2, if_exists))
+    (count,) = put(
+        client, "CommandStatementIngest", table, (1, options), (2, table_name)
+    )[1]
+    return count
+
+
+def test_codec():
+    message = encode((1, "query"), (2, b"\x00\xff"), (3, -1), (4, True), (5, ["a", "b"]))
+    assert decode(message) == {
+        1: [b"query"],
+        2: [b"\x00\xff"],
+        3: [2**64 - 1],
+        4: [1],
+        5: [b"a", b"b"],
+    }
+    assert unpack(pack("CommandGetTables", message)) == ("CommandGetTables", message)
+    # the server's own commands are not Flight SQL ones
+    assert unpack(b"\x80\x05...") is None
+    assert unpack(b"table_name") is None
+
+
+def test_ingest_and_query(client):
+    assert ingest(client, "t", data) == 3
+    with pytest.raises(pyarrow.flight.FlightServerError, match="already exists"):
+        ingest(client, "t", data)
+    # append
+    count = ingest(
+        client, "t", data, if_not_exist=IF_NOT_EXIST_FAIL, if_exists=IF_EXISTS_APPEND
+    )
+    assert count == 3
+
+    schema, result = query(
+        client, "CommandStatementQuery", (1, "SELECT b, sum(a) AS s FROM t GROUP BY b ORDER BY b")
+    )
+    assert schema.names == ["b", "s"]
+    assert result.to_pydict() == {"b": ["x", "y", "z"], "s": [2, 4, 6]}
+
+    # replace
+    assert ingest(client, "t", data.slice(0, 1), if_exists=IF_EXISTS_REPLACE) == 1
+    _, result = query(client, "CommandStatementQuery", (1, "SELECT count(*) AS n FROM t"))
+    assert result["n"].to_pylist() == [1]
+    # the table is the server's like any uploaded one
+    assert ("t",) in client.list_tables()
+
+
+def test_update(client):
+    (count,) = put(
+        client, "CommandStatementUpdate", pa.table({}), (1, "CREATE TABLE u (a INT)")
+    )[1]
+    assert count == 2**64 - 1
+    (count,) = put(
+        client,
+        "CommandStatementUpdate",
+        pa.table({}),
+        (1, "INSERT INTO u VALUES (1), (2)"),
+    )[1]
+    assert count == 2
+
+
+def test_update_forgets_cached_tables(main, client):
+    client.upload_data("t", pa.table({"a": [1, 2]}))
+    assert "t" in main.server.memory.tables
+    for statement in ("DROP VIEW t", "CREATE TABLE t AS SELECT 1000::BIGINT AS a"):
+        put(client, "CommandStatementUpdate", pa.table({}), (1, statement))
+    assert "t" not in main.server.memory.tables
+
+    t = ls.table({"a": "int64"}, name="t")
+    assert client.execute_query(t.filter(t.a > 500)).num_rows == 1
+
+
+def test_prepared_statement(client):
+    ingest(client, "t", data)
+    request = pack("ActionCreatePreparedStatementRequest", encode((1, "SELECT b FROM t WHERE a >= ?")))
+    (result,) = client._client.do_action(
+        pyarrow.flight.Action("CreatePreparedStatement", request), options=client._options
+    )
+    name, message = unpack(result.body.to_pybytes())
+    assert name == "ActionCreatePreparedStatementResult"
+    (handle,) = decode(message)[1]
+
+    bound = put(
+        client, "CommandPreparedStatementQuery", pa.table({"p": [2]}), (1, handle)
+    )
+    assert bound[1] == [handle]
+    _, result = query(client, "CommandPreparedStatementQuery", (1, handle))
+    assert result["b"].to_pylist() == ["y", "z"]
+
+    request = pack("ActionClosePreparedStatementRequest", encode((1, handle)))
+    client._client.do_action(
+        pyarrow.flight.Action("ClosePreparedStatement", request), options=client._options
+    )
+    with pytest.raises(pyarrow.flight.FlightServerError, match="Unknown prepared"):
+        query(client, "CommandPreparedStatementQuery", (1, handle))
+
+
+def test_catalog(client):
+    ingest(client, "t", data)
+    ingest(client, "other", data)
+
+    _, schemas = query(client, "CommandGetDbSchemas")
+    assert schemas["db_schema_name"].to_pylist() == ["main"]
+
+    _, tables = query(client, "CommandGetTables")
+    assert sorted(tables["table_name"].to_pylist()) == ["other", "t"]
+
+    _, tables = query(client, "CommandGetTables", (3, "o%"), (5, True))
+    assert tables["table_name"].to_pylist() == ["other"]
+    (serialized,) = tables["table_schema"].to_pylist()
+    assert pa.ipc.read_schema(pa.py_buffer(serialized)).names == ["a", "b"]
+
+    _, tables = query(client, "CommandGetTables", (4, ["VIEW"]))
+    assert tables.num_rows == 0
+
+
+def test_adbc(main):
+    dbapi = pytest.importorskip("adbc_driver_flightsql.dbapi")
+    with open(certificate_path, "rb") as f:
+        certs = f.read().decode()
+    with dbapi.connect(
+        f"grpc+tls://{host}:{main.port}",
+        db_kwargs={
+            "username": "test",
+            "password": "password",
+            "adbc.flight.sql.client_option.tls_root_certs": certs,
+        },
+    ) as conn:
+        with conn.cursor() as cursor:
+            cursor.adbc_ingest("t", data, mode="create")
+            cursor.execute("SELECT sum(a) AS s FROM t")
+            assert cursor.fetch_arrow_table()["s"].to_pylist() == [6]
@@ -0,0 +1,83 @@
+import time
+
+import pyarrow as pa
+import pyarrow.flight
+import pyarrow.parquet as pq
+import pytest
+
+import letsql as ls
+
+from demo import make_con
+from demo.client import FlightClient
+from demo.coalesce import Chunk
+from demo.ingest import COMMIT, append_stream
+from util import certificate_path, host
+
+
+def test_append_stream_commits():
+    batch = pa.record_batch({"a": range(10)})
+    committed = []
+
+    def commit(batches):
+        committed.append(sum(b.num_rows for b in batches))
+        return sum(committed)
+
+    chunks = [Chunk(batch), Chunk(batch), Chunk(None, COMMIT), Chunk(batch)]
+    acks = list(append_stream(chunks, commit, commit_rows=25))
+    assert committed == [20, 10]
+    assert [ack["appended"] for ack in acks] == [20, 30]
+
+    committed.clear()
+    acks = list(append_stream([Chunk(batch)] * 3, commit, commit_rows=25))
+    assert committed == [30]
+    assert acks[-1]["num_rows"] == 30
+
+
+def test_appender(main):
+    client = FlightClient(host=host, port=main.port, tls_roots=certificate_path)
+    t = ls.table({"a": "int64"}, name="events")
+    schema = pa.schema([("a", pa.int64())])
+    batch = pa.record_batch({"a": range(100)})
+
+    with client.appender("events", schema, commit_rows=250) as appender:
+        for _ in range(3):
+            appender.write(batch)
+        # committed by size
+        deadline = time.monotonic() + 5
+        while not appender.acks:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        assert client.execute_query(t).num_rows == 300
+
+        appender.write(batch)
+        ack = appender.commit()
+        assert ack["appended"] == 400
+        assert client.execute_query(t).num_rows == 400
+        appender.write(batch)
+    assert appender.acks[-1]["num_rows"] == 500
+    assert client.execute_query(t).num_rows == 500
+
+    with pytest.raises(pyarrow.flight.FlightServerError, match="can not append"):
+        client.append_batches("events", pa.table({"a": ["x"]}))
+
+
+def test_backend_insert(main):
+    con = make_con(main)
+    t = con.read_in_memory(pa.table({"a": [1, 2]}), table_name="t")
+    con.insert("t", pa.table({"a": [3]}))
+    con.insert("t", t.filter(t.a > 1))
+    assert sorted(t.a.execute()) == [1, 2, 2, 3, 3]
+    con.insert("t", pa.table({"a": [7]}), overwrite=True)
+    assert t.a.execute().tolist() == [7]
+
+
+def test_insert_into_parquet_table(main, tmp_path):
+    path = tmp_path / "t.parquet"
+    pq.write_table(pa.table({"a": range(100)}), path)
+    con = make_con(main)
+    t = con.read_parquet(str(path), table_name="t")
+    con.insert("t", pa.table({"a": [1000]}))
+    assert t.count().execute() == 101
+    # an in-memory table from now on
+    assert "t" not in main.server.parquet_tables
+    assert main.server.memory.tables["t"].stats.num_rows == 101
@@ -0,0 +1,57 @@
+import os
+
+import pyarrow as pa
+import pyarrow.feather
+
+from demo import make_con
+
+
+def test_read_ipc_maps_without_copying(main, tmp_path):
+    n = 10_000_000
+    path = str(tmp_path / "big.arrow")
+    pyarrow.feather.write_feather(
+        pa.table({"a": pa.array(range(n), pa.int64())}), path, compression="uncompressed"
+    )
+    con = make_con(main)
+    before = pa.total_allocated_bytes()
+    t = con.read_ipc(path, "big")
+    # 80MB of data, none of it on the heap
+    assert pa.total_allocated_bytes() - before < 8 * 1024 * 1024
+    assert t.count().execute() == n
+    assert t.a.max().execute() == n - 1
+
+    (table,) = main.server.memory.tables.values()
+    assert table.spilled and table.format == "ipc"
+    assert main.server.memory.nbytes == 0
+    assert main.server.table_stats("big").num_rows == n
+
+    # the server does not own the file
+    con.drop_table("big")
+    con.flush()
+    assert os.path.exists(path)
+
+
+def test_read_ipc_directory(main, tmp_path):
+    for i in range(3):
+        with pa.OSFile(str(tmp_path / f"part-{i}.arrow"), "wb") as sink:
+            with pa.ipc.new_file(sink, pa.schema({"a": pa.int64()})) as writer:
+                writer.write_table(pa.table({"a": [i] * 10}))
+    con = make_con(main)
+    t = con.read_ipc(str(tmp_path), "parts")
+    assert t.a.sum().execute() == 30
+
+
+def test_read_in_memory_through_ipc(main, tmp_path):
+    con = make_con(main, ipc_dir=str(tmp_path))
+    data = pa.table({"a": range(1000), "b": [str(i) for i in range(1000)]})
+    t = con.read_in_memory(data, "t")
+    assert t.count().execute() == 1000
+    (path,) = os.listdir(tmp_path)
+    assert path.endswith(".arrow")
+
+    t = con.read_in_memory(data.to_reader(100), "t")
+    assert t.b.nunique().execute() == 1000
+    # replacing the table removed the file it was mapped from
+    assert len(os.listdir(tmp_path)) == 1
+    main.server.clear()
+    assert os.listdir(tmp_path) == []
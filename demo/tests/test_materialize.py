@@ -0,0 +1,60 @@
+import ibis
+import pandas as pd
+import pyarrow as pa
+import pytest
+from pandas.testing import assert_frame_equal
+
+from demo import make_con
+from demo.materialize import batches_to_pandas
+
+
+data = pa.table(
+    {
+        "i": pa.array([1, None, 3, 4, 5], pa.int64()),
+        "j": pa.array([1, 2, 3, 4, 5], pa.int32()),
+        "f": [1.5, None, 2.5, 3.5, 4.5],
+        "b": [True, None, False, True, True],
+        "c": [True, False, False, True, True],
+        "s": ["a", None, "c", "d", "e"],
+        "ts": pa.array([1, 2, None, 4, 5], pa.timestamp("us")),
+    }
+)
+
+
+@pytest.mark.parametrize("num_rows", [-1, 0, 2, 5, 100])
+def test_batches_to_pandas(num_rows):
+    df = batches_to_pandas(data.to_batches(max_chunksize=2), data.schema, num_rows)
+    assert_frame_equal(df, data.to_pandas(timestamp_as_object=True))
+
+
+def test_batches_to_pandas_without_nulls_keeps_dtypes():
+    table = data.drop_null()
+    df = batches_to_pandas(table.to_batches(max_chunksize=1), table.schema)
+    assert df.dtypes.tolist() == table.to_pandas(timestamp_as_object=True).dtypes.tolist()
+
+
+@pytest.fixture
+def con(main):
+    return make_con(main)
+
+
+def test_execute(con):
+    t = con.read_in_memory(data, "t")
+    expected = ibis.memtable(data)
+    assert_frame_equal(t.execute(), expected.execute())
+    assert t.i.sum().execute() == 13
+    assert t.s.execute().tolist() == expected.s.execute().tolist()
+    assert con.to_pyarrow(t).equals(data)
+
+    param = ibis.param("int64")
+    filtered = t.filter(t.j > param)
+    assert filtered.execute(params={param: 3}).j.tolist() == [4, 5]
+
+
+def test_execute_arrow_dtypes(con):
+    t = con.read_in_memory(data, "t")
+    df = t.execute(arrow_dtypes=True)
+    assert all(isinstance(dtype, pd.ArrowDtype) for dtype in df.dtypes)
+    assert pa.Table.from_pandas(df, preserve_index=False).equals(data)
+    assert t.j.execute(arrow_dtypes=True).dtype == pd.ArrowDtype(pa.int32())
+    assert t.j.sum().execute(arrow_dtypes=True) == 15
@@ -0,0 +1,73 @@
+import os
+
+import letsql as ls
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from demo import make_con
+from demo.action import ClearAction, MemoryUsageAction
+
+
+def memory_usage(con):
+    (usage,) = con.con.do_action(MemoryUsageAction.name, options=con.con._options)
+    return usage
+
+
+@pytest.mark.parametrize("spill_format", ["ipc", "parquet"])
+def test_spill_over_budget(make_server, spill_format):
+    df = pd.DataFrame({"a": range(10_000)})
+    with make_server(memory_budget=100_000, spill_format=spill_format) as main:
+        con = make_con(main)
+        first = con.register(df, table_name="first")
+        con.register(df, table_name="second")
+
+        usage = memory_usage(con)
+        assert usage["first"]["spilled"]
+        assert not usage["second"]["spilled"]
+        assert main.server.memory.nbytes <= 100_000
+
+        # spilled tables are still queryable
+        pd.testing.assert_frame_equal(ls.execute(first), df)
+
+        (path,) = (table.path for table in main.server.memory.tables.values() if table.spilled)
+        assert os.path.exists(path)
+
+        con.con.do_action(ClearAction.name, options=con.con._options)
+        assert not con.tables
+        assert not memory_usage(con)
+        assert not os.path.exists(path)
+
+
+def test_idle_ttl(make_server):
+    with make_server(idle_ttl=0) as main:
+        con = make_con(main)
+        t = con.register(pd.DataFrame({"a": [1, 2, 3]}), table_name="idle")
+        assert memory_usage(con)["idle"]["spilled"]
+        assert main.server.memory.nbytes == 0
+        assert ls.execute(t)["a"].tolist() == [1, 2, 3]
+
+
+@pytest.mark.parametrize("spill_format", ["ipc", "parquet"])
+def test_append_to_spilled_table(make_server, spill_format):
+    df = pd.DataFrame({"a": range(10_000)})
+    with make_server(memory_budget=100_000, spill_format=spill_format) as main:
+        con = make_con(main)
+        t = con.register(df, table_name="t")
+        con.register(df, table_name="other")
+        (spilled,) = main.server.memory.tables["t"].paths
+        written = os.stat(spilled).st_mtime_ns
+
+        for i in range(2):
+            con.con.append_batches("t", pa.table({"a": [-i]}))
+        table = main.server.memory.tables["t"]
+        # each append is a file of its own, the spilled one is left alone
+        assert table.spilled and len(table.paths) == 3
+        assert table.paths[0] == spilled
+        assert os.stat(spilled).st_mtime_ns == written
+        assert table.stats.num_rows == 10_002
+        assert ls.execute(t.count()) == 10_002
+        assert ls.execute(t.a.min()) == -1
+
+        con.con.do_action(ClearAction.name, options=con.con._options)
+        assert not any(os.path.exists(path) for path in table.paths)
@@ -0,0 +1,76 @@
+import ibis
+import letsql as ls
+import pyarrow as pa
+import pyarrow.flight
+import pyarrow.parquet as pq
+import pytest
+from cloudpickle import dumps
+
+from demo import make_con
+from demo.parquet import ParquetMetadataCache, estimate
+from demo.plan import to_scan
+
+
+@pytest.fixture
+def parquet_path(tmp_path):
+    path = tmp_path / "data.parquet"
+    table = pa.table({"a": range(100), "b": [str(i) for i in range(100)]})
+    pq.write_table(table, path, row_group_size=10)
+    return path
+
+
+def test_to_scan():
+    t = ibis.table({"a": "int64", "b": "string"}, name="t")
+    scan = to_scan(t.filter(t.a >= 90, 5 > t.a).select("b").limit(3))
+    assert scan.table == "t"
+    assert scan.columns == ("b",)
+    assert scan.predicates == (("a", ">=", 90), ("a", "<", 5))
+    assert scan.limit == 3
+
+    assert to_scan(t.group_by("b").agg(t.a.sum())) is None
+
+
+def test_estimate(parquet_path):
+    cache = ParquetMetadataCache()
+    infos = cache.get_all((str(parquet_path),))
+    nbytes = sum(row_group.nbytes() for row_group in infos[0].row_groups)
+    assert estimate(infos) == (100, nbytes)
+    assert estimate(infos, columns=("a",))[1] < nbytes
+    assert estimate(infos, predicates=(("a", ">=", 85),))[0] == 20
+    assert estimate(infos, predicates=(("a", ">", 99),))[0] == 0
+    assert estimate(infos, limit=5)[0] == 5
+
+    cache.get_all((str(parquet_path),))
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_read_parquet_uses_metadata_cache(main, parquet_path):
+    con = make_con(main)
+    cache = main.server.parquet_cache
+
+    t = con.read_parquet(str(parquet_path), table_name="data")
+    con.read_parquet(str(parquet_path), table_name="data")
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    expr = t.filter(t.a >= 95).select("a")
+    flight_info = con.con._client.get_flight_info(
+        pyarrow.flight.FlightDescriptor.for_command(dumps({"expr": expr})),
+        options=con.con._options,
+    )
+    assert flight_info.total_records == 10
+    assert 0 < flight_info.total_bytes
+    assert len(ls.execute(expr)) == 5
+
+    assert ls.execute(t.filter(t.a > 1000)).empty
+
+
+def test_upload_replaces_parquet_table(make_server, parquet_path):
+    with make_server(connection=ls.connect) as main:
+        con = make_con(main)
+        con.read_parquet(str(parquet_path), table_name="t")
+        con.con.upload_data("t", pa.table({"a": [1000, 2000], "b": ["x", "y"]}))
+        assert "t" not in main.server.parquet_tables
+
+        t = ls.table({"a": "int64", "b": "string"}, name="t")
+        # the footers of the files no longer rule out every row
+        assert con.con.execute_query(t.filter(t.a > 500)).num_rows == 2
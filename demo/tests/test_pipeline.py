@@ -0,0 +1,60 @@
+import pyarrow as pa
+import pyarrow.flight
+import pytest
+
+from demo.action import AddExchangeAction
+from demo.client import FlightClient
+from demo.exchanger import UDFExchanger
+from util import certificate_path, host
+
+
+def double(df):
+    return df["a"] * 2
+
+
+@pytest.fixture
+def client(main):
+    return FlightClient(host=host, port=main.port, tls_roots=certificate_path)
+
+
+def test_pipeline(client):
+    udf_exchanger = UDFExchanger(
+        double,
+        schema_in=pa.schema((pa.field("a", pa.int64()),)),
+        name="b",
+        typ=pa.int64(),
+    )
+    client.do_action(AddExchangeAction.name, udf_exchanger, options=client._options)
+    data = pa.table({"a": range(100_000)})
+
+    pipeline = [udf_exchanger.command, "echo", "row-sum-append"]
+    fut, reader = client.do_exchange_batches(pipeline, data.to_reader(10_000))
+    result = reader.read_all()
+    fut.result()
+    assert result.column_names == ["a", "b", "sum"]
+    assert result["sum"].to_pylist() == [3 * a for a in range(100_000)]
+
+    (query_result,) = client.do_action(
+        "query-exchange", pipeline, options=client._options
+    )
+    assert query_result["calc-schema-out"](data.schema).names == ["a", "b", "sum"]
+
+
+def test_pipeline_checks_schemas(client):
+    data = pa.table({"a": ["x", "y"]})
+    descriptor = pyarrow.flight.FlightDescriptor.for_command('["echo", "row-sum"]')
+    writer, reader = client._client.do_exchange(descriptor, client._options)
+    with pytest.raises(pa.ArrowInvalid, match=r"stage 1 \(row-sum\)"):
+        with writer:
+            writer.begin(data.schema)
+            writer.write_table(data)
+            writer.done_writing()
+            reader.read_all()
+
+    descriptor = pyarrow.flight.FlightDescriptor.for_command('["echo", "missing"]')
+    writer, reader = client._client.do_exchange(descriptor, client._options)
+    with pytest.raises(pa.ArrowInvalid, match="Unknown commands"):
+        with writer:
+            writer.begin(data.schema)
+            writer.done_writing()
+            reader.read_all()
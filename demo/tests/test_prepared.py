@@ -0,0 +1,65 @@
+import ibis
+import pyarrow as pa
+import pyarrow.flight
+import pytest
+
+from demo import make_con
+from demo.client import FlightClient
+from util import certificate_path, host
+
+
+def test_prepared_statement(make_server):
+    data = pa.table({"a": range(100), "s": [str(i % 3) for i in range(100)]})
+    with make_server() as main:
+        client = FlightClient(host=host, port=main.port, tls_roots=certificate_path)
+        client.upload_data("t", data)
+        con = make_con(main)
+        t = con.table("t")
+        lo, s = ibis.param("int64"), ibis.param("string")
+        expr = t.filter(t.a >= lo, t.s == s).select("a")
+
+        executions = []
+        execute = main.server._execute
+
+        def counting(query, expr, **kwargs):
+            executions.append(kwargs.get("params"))
+            return execute(query, expr, **kwargs)
+
+        main.server._execute = counting
+
+        with client.prepare(expr.unbind()) as statement:
+            assert statement.schema == pa.schema([("a", pa.int64())])
+            assert set(statement.parameters) == {lo.op().name, s.op().name}
+            result = statement.execute({lo: 90, s.op().name: "0"})
+            assert result["a"].to_pylist() == [90, 93, 96, 99]
+            result = statement.execute({lo: 95, s: "1"})
+            assert result["a"].to_pylist() == [97]
+            # get_flight_info does not execute a prepared statement
+            assert len(executions) == 2
+
+            with pytest.raises(pyarrow.flight.FlightServerError, match="missing"):
+                statement.execute({lo: 1})
+        with pytest.raises(pyarrow.flight.FlightServerError, match="Unknown"):
+            statement.execute({lo: 1, s: "1"})
+
+        # the backend prepares queries with params once
+        assert con.execute(expr, params={lo: 98, s: "2"})["a"].tolist() == [98]
+        assert con.execute(expr, params={lo: 0, s: "2"})["a"].tolist()[:2] == [2, 5]
+        assert len(con._prepared) == 1
+        main.server.clear()
+        client.upload_data("t", data)
+        assert con.execute(expr, params={lo: 98, s: "2"})["a"].tolist() == [98]
+
+        # the least recently used statement is closed on the server
+        con._max_prepared = 1
+        other = t.filter(t.a < lo).select("a")
+        assert con.execute(other, params={lo: 2})["a"].tolist() == [0, 1]
+        assert len(con._prepared) == 1
+        assert len(main.server.prepared) == 1
+
+        # the limit reaches the backend, prepared or not
+        with client.prepare(other.unbind(), limit=2) as statement:
+            assert statement.execute({lo: 10}).num_rows == 2
+        assert len(con.execute(other, params={lo: 10}, limit=2)) == 2
+        assert len(con.execute(t, limit=2)) == 2
+        assert con.to_pyarrow_batches(t, limit=2).read_all().num_rows == 2
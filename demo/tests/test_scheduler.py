@@ -0,0 +1,110 @@
+import threading
+import time
+
+import pyarrow as pa
+import pyarrow.flight
+import pytest
+
+import letsql as ls
+
+import demo.scheduler as S
+from demo.client import FlightClient
+from demo.server import BasicAuthServerMiddlewareFactory, FlightServer, NoOpAuthHandler
+from util import certificate_path, key_path, scheme, host
+
+
+def test_priority_classes():
+    scheduler = S.Scheduler(max_concurrency=1)
+    order = []
+
+    def call(priority, name):
+        with scheduler.admit(priority):
+            order.append(name)
+
+    with scheduler.admit(S.QUERY):
+        threads = [
+            threading.Thread(target=call, args=(S.QUERY, "scan")),
+            threading.Thread(target=call, args=(S.CATALOG, "list_tables")),
+        ]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.1)
+        assert scheduler.to_dict()["queued"] == 2
+    for thread in threads:
+        thread.join()
+    assert order == ["list_tables", "scan"]
+
+
+def test_memory_admission():
+    scheduler = S.Scheduler(memory_budget=100, queue_timeout=0.1)
+    with scheduler.admit(nbytes=60):
+        with pytest.raises(pyarrow.flight.FlightUnavailableError, match="in flight"):
+            with scheduler.admit(nbytes=60):
+                pass
+        with scheduler.admit(nbytes=40):
+            pass
+    # a call over budget still runs alone
+    with scheduler.admit(nbytes=1_000):
+        pass
+
+
+def test_per_user_limits_and_back_off():
+    with open(certificate_path, "rb") as cert_file, open(key_path, "rb") as key_file:
+        tls_certificates = [(cert_file.read(), key_file.read())]
+    server = FlightServer(
+        ls.duckdb.connect,
+        "{}://{}:{}".format(scheme, host, 0),
+        tls_certificates=tls_certificates,
+        auth_handler=NoOpAuthHandler(),
+        middleware={
+            "basic": BasicAuthServerMiddlewareFactory(
+                {"test": "password", "other": "secret"}
+            )
+        },
+        max_concurrency_per_user=1,
+        queue_timeout=0.2,
+    )
+    with server:
+        test = FlightClient(host=host, port=server.port, tls_roots=certificate_path)
+        other = FlightClient(
+            host=host,
+            port=server.port,
+            username="other",
+            password="secret",
+            tls_roots=certificate_path,
+        )
+        test.upload_data("t", pa.table({"a": [1, 2, 3]}))
+        expr = ls.table({"a": "int64"}, name="t")
+
+        # a long running call of user test
+        with server.scheduler.admit(S.QUERY, user="test"):
+            with pytest.raises(pyarrow.flight.FlightUnavailableError) as excinfo:
+                test.execute_query(expr)
+            assert "server busy" in str(excinfo.value)
+            assert excinfo.value.extra_info == b"retry-after=1"
+            # other users are not held up
+            assert other.execute_query(expr).num_rows == 3
+
+        assert test.execute_query(expr).num_rows == 3
+        (stats,) = test.do_action("scheduler_stats", options=test._options)
+        assert stats["rejected"] == 1
+
+
+def test_admitted_until_streamed():
+    with open(certificate_path, "rb") as cert_file, open(key_path, "rb") as key_file:
+        tls_certificates = [(cert_file.read(), key_file.read())]
+    server = FlightServer(
+        ls.duckdb.connect,
+        "{}://{}:{}".format(scheme, host, 0),
+        tls_certificates=tls_certificates,
+        max_concurrency=2,
+    )
+    with server:
+        server._conn.raw_sql("CREATE TABLE t AS SELECT range AS a FROM range(10)")
+        stream = server._results(None, server._conn.table("t"), nbytes=80)
+        next(stream)
+        # the result is held for the transfer, so is its reservation
+        assert server.scheduler.to_dict()["reserved"] == 80
+        (result,) = stream
+        assert result.num_rows == 10
+        assert server.scheduler.to_dict()["reserved"] == 0
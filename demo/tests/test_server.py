@@ -1,3 +1,4 @@
+import os
 import socket
 
 import letsql as ls
@@ -5,8 +6,12 @@ import pandas as pd
 import pytest
 import pyarrow as pa
 
-from demo import EphemeralServer, BasicAuth, make_con
-from util import certificate_path, key_path, scheme, host
+from demo import EphemeralServerPool, BasicAuth, make_con
+from demo.action import AddExchangeAction
+from demo.backend import into_backend
+from demo.exchanger import UDFExchanger
+from demo.utils import with_port
+from util import certificate_path, key_path, host
 
 def port_in_use(port, host='localhost'):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -17,24 +22,16 @@ def port_in_use(port, host='localhost'):
             return True
 
 @pytest.mark.parametrize(
-    "connection,port",
+    "connection",
     [
-        pytest.param(ls.duckdb.connect, 5005, id="duckdb"),
-        pytest.param(ls.connect, 5005, id="letsql"),
-        pytest.param(ls.datafusion.connect, 5005, id="datafusion"),
+        pytest.param(ls.duckdb.connect, id="duckdb"),
+        pytest.param(ls.connect, id="letsql"),
+        pytest.param(ls.datafusion.connect, id="datafusion"),
     ],
 )
-def test_create_and_list_tables(connection, port):
+def test_create_and_list_tables(make_server, connection):
 
-    assert not port_in_use(port), f"Port {port} already in use"
-
-    with EphemeralServer(
-        location="{}://{}:{}".format(scheme, host, port),
-        certificate_path=certificate_path,
-        key_path=key_path,
-        auth=BasicAuth("test", "password"),
-        connection=connection,
-    ) as main:
+    with make_server(connection=connection) as main:
         con = make_con(main)
 
         data = pa.table(
@@ -44,6 +41,95 @@ def test_create_and_list_tables(connection, port):
         t = con.register(data, table_name="users")
         actual = ls.execute(t)
 
-        assert port_in_use(port)
+        assert main.port != 0
+        assert port_in_use(main.port)
         assert "users" in con.tables
         assert isinstance(actual, pd.DataFrame)
+
+
+def test_process_server(make_server):
+    with make_server(process=True) as main:
+        assert main.server.pid != os.getpid()
+        con = make_con(main)
+
+        data = pd.DataFrame({"id": [1, 2, 3], "name": ["Alice", "Bob", "Charlie"]})
+        t = con.register(data, table_name="users")
+        actual = ls.execute(t)
+
+        assert "users" in con.tables
+        pd.testing.assert_frame_equal(actual, data)
+
+    assert not main.server._process.is_alive()
+
+
+@pytest.mark.parametrize("process", [False, True], ids=["thread", "process"])
+def test_connection_error_fails_the_server(make_server, process):
+    def connection():
+        raise ConnectionError("no backend")
+
+    with pytest.raises((ConnectionError, RuntimeError), match="no backend"):
+        make_server(connection=connection, process=process)
+
+
+def test_with_port():
+    assert with_port("grpc+tls://localhost:0", 1234) == "grpc+tls://localhost:1234"
+    assert with_port("grpc://[::1]:0", 1234) == "grpc://[::1]:1234"
+
+
+def my_f(df):
+    return df["a"] + 1
+
+
+@pytest.mark.parametrize("process", [False, True], ids=["thread", "process"])
+def test_server_pool(process):
+    with EphemeralServerPool(
+        size=1,
+        certificate_path=certificate_path,
+        key_path=key_path,
+        auth=BasicAuth("test", "password"),
+        process=process,
+    ) as pool:
+        with pool.server() as first:
+            con = make_con(first)
+            con.register(pd.DataFrame({"a": [1, 2, 3]}), table_name="scratch")
+            udf_exchanger = UDFExchanger(
+                my_f,
+                schema_in=pa.schema((pa.field("a", pa.int64()),)),
+                name="b",
+                typ=pa.int64(),
+            )
+            con.con.do_action(
+                AddExchangeAction.name, udf_exchanger, options=con.con._options
+            )
+            assert "scratch" in con.tables
+
+        port = first.port
+        with pool.server() as second:
+            # the warm server, reset
+            assert second is first
+            assert second.port == port
+            (exchanges,) = con.con.do_action("list-exchanges", options=con.con._options)
+            assert udf_exchanger.command not in exchanges
+            assert "scratch" not in con.tables
+
+    assert not pool.servers
+
+
+def test_into_backend_pulls_server_to_server(make_server, monkeypatch):
+    with make_server() as main, make_server() as second:
+        con0 = make_con(main)
+        con1 = make_con(second)
+
+        data = pd.DataFrame({"id": [1, 2, 3], "name": ["Alice", "Bob", "Charlie"]})
+        t = con0.register(data, table_name="users")
+
+        def fail(*args, **kwargs):
+            raise AssertionError("data went through the client")
+
+        monkeypatch.setattr(con1.con, "upload_batches", fail)
+        remote = into_backend(t.filter(t.id > 1), con1, "remote-users")
+
+        assert "remote-users" in second.server.memory.tables
+        pd.testing.assert_frame_equal(
+            ls.execute(remote), data[data.id > 1].reset_index(drop=True)
+        )
@@ -0,0 +1,96 @@
+import threading
+
+import pyarrow as pa
+import pyarrow.flight
+
+import letsql as ls
+from cloudpickle import loads
+
+from demo import make_con
+from demo.action import AbstractAction
+from demo.client import FlightClient
+from demo.server import BasicAuthServerMiddlewareFactory, FlightServer, NoOpAuthHandler
+from demo.session import SessionPool
+from demo.utils import make_flight_result
+from util import certificate_path, key_path, scheme, host
+
+
+def test_clients_share_sessions(main):
+    con = make_con(main)
+    other = make_con(main)
+    assert other.con._session is con.con._session
+    assert con.con._session.refcount == 2
+
+    con.read_in_memory(pa.table({"a": [1, 2]}), table_name="t")
+    assert other.table("t").count().execute() == 2
+
+    pool = SessionPool(idle_ttl=0)
+    first = FlightClient(
+        host=host, port=main.port, tls_roots=certificate_path, pool=pool
+    )
+    second = FlightClient(
+        host=host, port=main.port, tls_roots=certificate_path, pool=pool
+    )
+    assert first._session is second._session
+    assert first._session is not con.con._session
+    first.close()
+    second.close()
+    # released by both, and closed right away
+    assert pool.to_dict() == {"sessions": 0, "in_use": 0}
+
+
+def test_token_refresh():
+    with open(certificate_path, "rb") as cert_file, open(key_path, "rb") as key_file:
+        tls_certificates = [(cert_file.read(), key_file.read())]
+    auth = BasicAuthServerMiddlewareFactory({"test": "password"})
+    server = FlightServer(
+        ls.duckdb.connect,
+        "{}://{}:{}".format(scheme, host, 0),
+        tls_certificates=tls_certificates,
+        auth_handler=NoOpAuthHandler(),
+        middleware={"basic": auth},
+    )
+    with server:
+        client = FlightClient(host=host, port=server.port, tls_roots=certificate_path)
+        client.upload_data("t", pa.table({"a": [1, 2, 3]}))
+        token_pair = client._token_pair
+
+        # the server forgot the token, e.g. it restarted on the same port
+        auth.tokens.clear()
+        assert client.list_tables() == [("t",)]
+        assert client._token_pair != token_pair
+        t = ls.table({"a": "int64"}, name="t")
+        assert client.execute_query(t).num_rows == 3
+
+
+released = threading.Event()
+
+
+class StreamingAction(AbstractAction):
+    @classmethod
+    @property
+    def name(cls):
+        return "stream"
+
+    @classmethod
+    @property
+    def description(cls):
+        return "Yield a result, then whether the client read it in time."
+
+    @classmethod
+    def do_action(cls, server, context, action):
+        yield make_flight_result(None)
+        yield make_flight_result(released.wait(10))
+
+
+def test_action_results_stream(main):
+    main.server.actions[StreamingAction.name] = StreamingAction
+    client = FlightClient(host=host, port=main.port, tls_roots=certificate_path)
+    results = client._client.do_action(
+        pyarrow.flight.Action(StreamingAction.name, b""), options=client._options
+    )
+    # the first result arrives while the action still runs
+    next(results)
+    released.set()
+    (result,) = results
+    assert loads(result.body.to_pybytes())
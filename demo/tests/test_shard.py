@@ -0,0 +1,95 @@
+import ibis
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import letsql as ls
+
+from demo import make_sharded_con
+from demo.shard import partition
+
+
+@pytest.fixture(scope="module")
+def servers(make_server):
+    servers = [make_server() for _ in range(3)]
+    yield servers
+    for server in servers:
+        server.__exit__(None, None, None)
+
+
+@pytest.fixture
+def con(servers):
+    yield make_sharded_con(servers)
+    for server in servers:
+        server.reset()
+
+
+def assert_frame_equal(left, right, by):
+    left = left.sort_values(by).reset_index(drop=True)
+    right = right.sort_values(by).reset_index(drop=True)
+    pd.testing.assert_frame_equal(left, right, check_dtype=False)
+
+
+def test_partition():
+    table = pa.table({"a": range(100), "b": [i % 7 for i in range(100)]})
+    for by, method in [(None, "hash"), ("b", "hash"), ("a", "range")]:
+        parts = partition(table, 3, by=by, method=method)
+        assert sum(part.num_rows for part in parts) == 100
+    # equal keys land on the same shard
+    parts = partition(table, 3, by="b")
+    keys = [set(part["b"].to_pylist()) for part in parts]
+    assert not (keys[0] & keys[1]) and not (keys[1] & keys[2])
+    # ranges are ordered
+    parts = partition(table, 3, by="a", method="range")
+    assert max(parts[0]["a"].to_pylist()) < min(parts[1]["a"].to_pylist())
+
+
+@pytest.mark.parametrize("partition_by", [None, "playerID"])
+def test_scatter_gather(con, servers, partition_by):
+    local = ls.duckdb.connect()
+    expected = local.read_parquet("data/batting.parquet", table_name="batting")
+    t = con.read_parquet(
+        "data/batting.parquet", table_name="batting", partition_by=partition_by
+    )
+    counts = [
+        server.server._conn.table("batting").count().execute() for server in servers
+    ]
+    assert sum(counts) == expected.count().execute()
+    if partition_by is not None:
+        assert all(counts)
+
+    def check(f, by):
+        assert_frame_equal(f(t).execute(), f(expected).execute(), by)
+
+    check(
+        lambda t: t.filter(t.yearID == 2015).select("playerID", "H"),
+        ["playerID", "H"],
+    )
+    check(
+        lambda t: t.group_by("teamID").aggregate(
+            n=t.count(),
+            hits=t.H.sum(),
+            mean=t.H.mean(),
+            first=t.yearID.min(),
+            last=t.yearID.max(),
+        ),
+        ["teamID"],
+    )
+    # not decomposable, gathered and run locally
+    check(lambda t: t.group_by("teamID").aggregate(n=t.playerID.nunique()), ["teamID"])
+
+    top = t.order_by(ibis.desc("H"), "playerID").limit(5).execute()
+    assert top.equals(expected.order_by(ibis.desc("H"), "playerID").limit(5).execute())
+    assert t.count().execute() == expected.count().execute()
+
+
+def test_in_memory(con):
+    table = pa.table({"k": [i % 10 for i in range(1_000)], "v": range(1_000)})
+    t = con.read_in_memory(table, table_name="t", partition_by="k")
+    assert t.schema() == ibis.schema({"k": "int64", "v": "int64"})
+    result = t.group_by("k").aggregate(v=t.v.sum()).order_by("k").execute()
+    assert result.v.sum() == sum(range(1_000))
+    assert len(result) == 10
+
+    con.drop_table("t")
+    assert "t" not in con.tables
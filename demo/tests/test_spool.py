@@ -0,0 +1,113 @@
+import pyarrow as pa
+import pyarrow.flight
+
+import letsql as ls
+
+from demo import make_con
+from demo.client import FlightClient
+from util import certificate_path, host
+
+
+class FlakyClient:
+    """A pyarrow FlightClient whose first stream breaks after two batches"""
+
+    def __init__(self, client):
+        self._client = client
+        self.n_calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def do_get(self, ticket, options=None):
+        self.n_calls += 1
+        reader = self._client.do_get(ticket, options=options)
+        if self.n_calls > 1:
+            return reader
+        return FlakyReader(reader)
+
+
+class FlakyReader:
+    def __init__(self, reader):
+        self.reader = reader
+        self.schema = reader.schema
+
+    def __iter__(self):
+        for i, chunk in enumerate(self.reader):
+            if i == 2:
+                self.reader.cancel()
+                raise pyarrow.flight.FlightUnavailableError("connection lost")
+            yield chunk
+
+
+def test_spooled_result_is_resumed_and_shared(make_server):
+    data = pa.table({"a": range(100_000), "b": [i % 7 for i in range(100_000)]})
+    with make_server() as main:
+        client = FlightClient(host=host, port=main.port, tls_roots=certificate_path)
+        client.upload_data("t", data)
+        con = make_con(main)
+        t = con.table("t")
+        expr = t.filter(t.b > 2).order_by("a")
+        expected = ls.to_pyarrow(expr)
+
+        executions = []
+        query_backend = main.server._query_backend
+
+        def counting():
+            executions.append(expr)
+            return query_backend()
+
+        main.server._query_backend = counting
+
+        client._client = flaky = FlakyClient(client._client)
+        result = client.execute_spooled(expr.unbind(), chunk_size=1_000).read_all()
+        assert flaky.n_calls == 2
+        assert result.equals(expected)
+
+        # another client reads the spooled file
+        other = FlightClient(host=host, port=main.port, tls_roots=certificate_path)
+        assert other.execute_spooled(expr.unbind(), chunk_size=1_000).read_all().equals(
+            expected
+        )
+        assert len(executions) == 1
+        (spooled,) = main.server.spool.results.values()
+        assert spooled.num_rows == expected.num_rows
+        assert spooled.num_batches > 2
+
+        main.server.spool.ttl = 0
+        main.server.spool.expire()
+        assert not main.server.spool.results
+
+        # the query is admitted until its last batch was read
+        main.server.scheduler.max_concurrency = 2
+        stream = main.server._spooled_batches(
+            None, main.server._conn.table("t"), chunk_size=1_000
+        )
+        next(stream)
+        assert main.server.scheduler.running == 1
+        assert len(main.server.queries.queries) == 1
+        assert sum(batch.num_rows for batch in stream) == data.num_rows
+        assert main.server.scheduler.running == 0
+        assert not main.server.queries.queries
+
+        # a query reading a table that was written since is spooled again
+        spooled_expr = expr.unbind()
+        assert len(other.execute_spooled(spooled_expr).read_all()) == len(expected)
+        client.upload_data("t", data.slice(0, 10))
+        assert len(other.execute_spooled(spooled_expr).read_all()) == 4
+
+
+def test_spooled_result_is_wire_optimized(make_server):
+    data = pa.table({"s": [c for c in "abcd" for _ in range(50_000)]})
+    with make_server() as main:
+        client = FlightClient(
+            host=host, port=main.port, tls_roots=certificate_path, wire_optimize=True
+        )
+        client.upload_data("t", data)
+        expr = ls.table({"s": "string"}, name="t").order_by("s")
+        for _ in range(2):
+            # spooled, then read from the spool
+            result = client.execute_spooled(expr, chunk_size=10_000).read_all()
+            assert result.equals(data)
+        (spooled,) = main.server.spool.results.values()
+        assert spooled.num_batches > 1
+        assert client.execute_spooled(expr, limit=5).read_all().num_rows == 5
@@ -0,0 +1,110 @@
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.flight
+import pyarrow.parquet as pq
+import pytest
+from cloudpickle import dumps
+
+import letsql as ls
+
+from demo.client import FlightClient
+from demo.stats import HyperLogLog, TableStats
+from util import certificate_path, host
+
+
+def test_hyperloglog():
+    hll = HyperLogLog()
+    hll.add(pa.array(range(50_000)))
+    assert abs(hll.estimate() - 50_000) < 50_000 * 0.05
+    other = HyperLogLog()
+    other.add(pa.array(range(25_000, 75_000)))
+    assert abs(hll.merge(other).estimate() - 75_000) < 75_000 * 0.05
+
+
+def test_table_stats():
+    batting = pq.read_table("data/batting.parquet")
+    stats = TableStats.from_table(batting.slice(0, 50_000)).merge(
+        TableStats.from_table(batting.slice(50_000))
+    )
+    assert stats.num_rows == batting.num_rows
+    so = stats.columns["SO"]
+    assert so.null_count == batting["SO"].null_count
+    assert (so.min, so.max) == (0, 223)
+    distinct = len(pc.unique(batting["playerID"]))
+    assert abs(stats.columns["playerID"].distinct - distinct) < distinct * 0.05
+
+    assert stats.estimate() == (batting.num_rows, batting.nbytes)
+    assert stats.estimate(predicates=[("yearID", ">", 2015)]) == (0, 0)
+    num_rows, _ = stats.estimate(predicates=[("yearID", ">=", 2000)])
+    assert 0 < num_rows < batting.num_rows
+
+
+def test_flight_info_from_stats(main):
+    client = FlightClient(host=host, port=main.port, tls_roots=certificate_path)
+    data = pa.table({"a": range(1_000), "b": ["x"] * 1_000})
+    client.upload_data("t", data)
+    client.append_batches(
+        "t", pa.table({"a": [5_000], "b": [None]}, schema=data.schema)
+    )
+
+    stats = client.get_table_stats("t")
+    assert stats["num_rows"] == 1_001
+    assert stats["columns"]["a"]["max"] == 5_000
+    assert stats["columns"]["b"]["null_count"] == 1
+    assert stats["columns"]["b"]["distinct"] == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("executed")
+
+    main.server._execute = fail
+    t = ls.table({"a": "int64", "b": "string"}, name="t")
+    flight_info = client._client.get_flight_info(
+        pyarrow.flight.FlightDescriptor.for_command(dumps({"expr": t.select("a")})),
+        options=client._options,
+    )
+    assert flight_info.total_records == 1_001
+    del main.server._execute
+
+    # the statistics rule out every row, but only the query can tell
+    assert client.execute_query(t.filter(t.a > 10_000)).num_rows == 0
+    # the table changed behind the statistics' back
+    with main.server._conn_lock:
+        main.server._conn.raw_sql("DROP VIEW t")
+        main.server._conn.raw_sql(
+            "CREATE TABLE t AS SELECT 20000::BIGINT AS a, 'y' AS b"
+        )
+    assert client.execute_query(t.filter(t.a > 10_000)).num_rows == 1
+
+    with pytest.raises(pyarrow.flight.FlightServerError):
+        client.get_table_stats("missing")
+
+    main.server._conn.raw_sql(
+        "CREATE VIEW v AS SELECT range AS a, NULL::VARCHAR AS b FROM range(10)"
+    )
+    stats = client.get_table_stats("v")
+    assert stats["num_rows"] == 10
+    assert stats["columns"]["a"] == {
+        "min": 0,
+        "max": 9,
+        "null_count": 0,
+        "nbytes": None,
+        "distinct": 10,
+    }
+    assert stats["columns"]["b"]["null_count"] == 10
+
+
+def test_stats_gathered_outside_lock(main, monkeypatch):
+    client = FlightClient(host=host, port=main.port, tls_roots=certificate_path)
+    locked = []
+    from_table = TableStats.from_table.__func__
+
+    def record(cls, table):
+        locked.append(main.server._conn_lock._is_owned())
+        return from_table(cls, table)
+
+    monkeypatch.setattr(TableStats, "from_table", classmethod(record))
+    data = pa.table({"a": range(10)})
+    client.upload_data("t", data)
+    client.append_batches("t", data)
+    assert locked == [False, False]
+    assert client.get_table_stats("t")["num_rows"] == 20
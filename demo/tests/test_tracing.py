@@ -0,0 +1,90 @@
+import pyarrow as pa
+import pytest
+
+import demo.tracing as T
+from demo import make_con
+
+
+@pytest.fixture
+def exporter():
+    exporter = T.InMemoryExporter()
+    yield exporter
+    T.disable()
+
+
+@pytest.fixture
+def con(make_server, exporter):
+    with make_server(trace_exporter=exporter) as main:
+        yield make_con(main)
+
+
+def test_trace_across_client_and_server(con, exporter):
+    t = con.read_in_memory(pa.table({"a": [1, 2, 3]}), "t")
+    exporter.clear()
+    T.enable(exporter)
+    expr = t.filter(t.a > 1)
+    assert len(expr.execute()) == 2
+
+    spans = {span["name"]: span for span in exporter.spans}
+    (trace_id,) = {span["trace_id"] for span in exporter.spans}
+    assert trace_id == spans["execute"]["trace_id"]
+    assert spans["execute"]["parent_id"] is None
+
+    def parent(name):
+        return next(
+            span["name"]
+            for span in exporter.spans
+            if span["span_id"] == spans[name]["parent_id"]
+        )
+
+    assert parent("pickle") == "execute"
+    assert parent("get_flight_info") == "execute"
+    assert parent("server.get_flight_info") == "get_flight_info"
+    assert parent("do_get") == "execute"
+    assert parent("server.do_get") == "do_get"
+    assert parent("to_pandas") == "execute"
+    assert spans["server.do_get"]["side"] == "server"
+    # the server executes in do_get, having estimated the result in
+    # get_flight_info
+    executes = [span for span in exporter.spans if span["name"] == "execute"]
+    server_execute = next(span for span in executes if span["side"] == "server")
+    assert server_execute["attributes"] == {"num_rows": 2}
+
+    assert "server.do_get" in T.summarize(exporter.spans)
+    assert "execute;do_get;server.do_get " in T.collapsed(exporter.spans)
+
+
+def test_disabled(con, exporter):
+    exporter.clear()
+    # the server still times its calls, without a client trace
+    con.con.list_tables()
+    assert {span["parent_id"] for span in exporter.spans} == {None}
+    assert all(span["side"] == "server" for span in exporter.spans)
+    (call,) = [span for span in exporter.spans if span["name"] == "server.do_action"]
+    assert call["attributes"] == {"action": "list_tables"}
+
+    T.disable()
+    with T.span("nothing") as span:
+        assert span is None
+
+
+def test_jsonl_summary(tmp_path, capsys):
+    path = tmp_path / "spans.jsonl"
+    T.enable(T.JSONLExporter(path))
+    try:
+        with T.span("outer"):
+            for _ in range(2):
+                with T.span("inner", n=1):
+                    pass
+    finally:
+        T.disable()
+    spans = T.read_spans(path)
+    assert [span["name"] for span in spans] == ["inner", "inner", "outer"]
+
+    T.main([str(path)])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1].split()[-1] == "outer"
+    assert lines[2].split()[2] == "2" and lines[2].split()[-1] == "inner"
+
+    T.main([str(path), "--collapsed"])
+    assert capsys.readouterr().out.splitlines()[0].startswith("outer ")
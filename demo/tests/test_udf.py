@@ -0,0 +1,42 @@
+import letsql as ls
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from demo import make_con
+from demo.udf import VectorizedUDF
+
+
+def scale(a, b):
+    return pc.multiply(pc.add(a, b), 10)
+
+
+def upper(s):
+    return pc.utf8_upper(s)
+
+
+def test_udf_runs_on_server(main):
+    con = make_con(main)
+    t = con.read_in_memory(pa.table({"a": [1, 2, None], "b": [10, 20, 30]}), "t")
+    f = con.register_udf(scale, (pa.int64(), pa.int64()), pa.int64())
+    result = t.select(c=f(t.a, t.b)).order_by("c").execute()
+    assert result["c"].tolist()[:2] == [110, 220]
+    assert result["c"].isna().tolist() == [False, False, True]
+    assert "scale" in main.server.udfs
+
+
+def test_udf_survives_clear(main):
+    con = make_con(main)
+    udf = VectorizedUDF(upper, (pa.string(),), pa.string(), "upper_udf")
+    con.con.add_udf(udf)
+    main.server.clear()
+    t = con.read_in_memory(pa.table({"s": ["b", "a"]}), "t")
+    f = udf.to_ibis()
+    assert t.select(u=f(t.s)).order_by("u").execute()["u"].tolist() == ["A", "B"]
+
+
+def test_udf_datafusion():
+    con = ls.connect()
+    VectorizedUDF(scale, (pa.int64(), pa.int64()), pa.int64()).register(con)
+    t = con.register(pa.table({"a": [1, 2], "b": [10, 20]}), "t")
+    f = VectorizedUDF(scale, (pa.int64(), pa.int64()), pa.int64()).to_ibis()
+    assert con.execute(t.select(c=f(t.a, t.b)))["c"].tolist() == [110, 220]
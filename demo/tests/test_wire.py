@@ -0,0 +1,89 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import letsql as ls
+
+from demo import make_con
+from demo.client import FlightClient
+from demo.wire import optimize_batches, optimize_table, plan, restore
+from util import certificate_path, host
+
+
+def ipc_nbytes(table):
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().size
+
+
+def test_optimize_table():
+    batting = pq.read_table("data/batting.parquet")
+    schema = plan(batting)
+    # 149 teams over the years
+    assert schema.field("teamID").type == pa.dictionary(pa.int16(), pa.string())
+    assert schema.field("lgID").type == pa.dictionary(pa.int8(), pa.string())
+    assert schema.field("yearID").type == pa.uint16()
+
+    optimized = optimize_table(batting)
+    assert ipc_nbytes(optimized) < ipc_nbytes(batting) / 2
+    assert restore(optimized).equals(batting)
+    assert restore(batting) is batting
+
+    table = pa.table({"a": [-1, 1000, None], "b": ["x", "y", "z"]})
+    schema = plan(table)
+    assert schema.field("a").type == pa.int16()
+    # too many distinct values
+    assert schema.field("b").type == pa.string()
+
+
+def test_optimize_batches():
+    table = pa.table({"a": range(4), "s": ["x", "y", "z", "w"]})
+    reader = table.to_reader(max_chunksize=2)
+    schema, batches = optimize_batches(reader, reader.schema, max_dictionary_ratio=1)
+    # a sample can not bound a stream's integers
+    assert schema.field("a").type == pa.int64()
+    assert schema.field("s").type == pa.dictionary(pa.int32(), pa.string())
+    assert restore(pa.Table.from_batches(batches, schema=schema)).equals(table)
+
+
+def test_wire_optimize_round_trip(make_server):
+    batting = pq.read_table("data/batting.parquet")
+    with make_server() as main:
+        client = FlightClient(
+            host=host, port=main.port, tls_roots=certificate_path, wire_optimize=True
+        )
+        client.upload_data("batting", batting)
+        client.upload_batches("batting_batches", batting.to_reader(max_chunksize=1000))
+        # the server holds the original schema
+        assert client.get_table_info("batting") == client.get_table_info(
+            "batting_batches"
+        )
+
+        con = make_con(main)
+        con.con = client
+        t = con.table("batting")
+        expr = t.filter(t.yearID == 2015).select("playerID", "teamID", "lgID", "HR")
+        reader = client.execute_batches(expr)
+        assert reader.schema.field("teamID").type == pa.dictionary(
+            pa.int8(), pa.string()
+        )
+        expected = ls.to_pyarrow(t.filter(t.yearID == 2015)).select(
+            ["playerID", "teamID", "lgID", "HR"]
+        )
+        assert restore(reader.read_all()).equals(expected)
+        assert con.to_pyarrow_batches(expr).read_all().equals(expected)
+
+
+def test_wire_optimize_many_chunks(make_server):
+    # the values of every chunk differ, so they must share one dictionary
+    data = pa.table({"s": [c for c in "abcd" for _ in range(50_000)]})
+    with make_server() as main:
+        client = FlightClient(
+            host=host, port=main.port, tls_roots=certificate_path, wire_optimize=True
+        )
+        client.upload_batches("t", data.to_reader(max_chunksize=50_000))
+        con = make_con(main)
+        con.con = client
+        t = con.table("t").order_by("s")
+        assert con.to_pyarrow(t).equals(data)
+        assert con.to_pyarrow_batches(t).read_all().equals(data)
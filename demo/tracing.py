@@ -0,0 +1,403 @@
+import argparse
+import contextlib
+import contextvars
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+
+import pyarrow.flight
+
+
+# the W3C trace context header, "00-<trace id>-<parent span id>-01"
+TRACEPARENT = "traceparent"
+
+# the span the code running in this context is in
+_current = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    """
+    A timed phase of a call, e.g. pickling an expression or executing it
+
+    Spans of one end-to-end call share a trace id across the client and the
+    server, each span knows its parent's id. A span is exported once it ends.
+
+    Parameters
+    ----------
+    name: str
+    trace_id: str
+        32 hex digits, a new trace's if None.
+    parent_id: str
+        The span id of the parent, None for a trace's root.
+    exporter: InMemoryExporter or JSONLExporter
+        Where the span goes when it ends, the children of a span go to its.
+    side: str
+        "client" or "server".
+    """
+
+    def __init__(
+        self, name, trace_id=None, parent_id=None, exporter=None, side="client"
+    ):
+        self.name = name
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.exporter = exporter
+        self.side = side
+        self.attributes = {}
+        self.error = None
+        self.start = time.time()
+        self.duration = None
+        self._started = time.perf_counter()
+
+    def child(self, name, side=None):
+        return Span(
+            name,
+            trace_id=self.trace_id,
+            parent_id=self.span_id,
+            exporter=self.exporter,
+            side=side or self.side,
+        )
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.error = repr(error)
+        if self.exporter is not None:
+            self.exporter.export(self)
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "side": self.side,
+            "start": self.start,
+            "duration": self.duration,
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def parse_traceparent(value):
+    """(trace id, parent span id) of a traceparent header, None if invalid"""
+    parts = value.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+class InMemoryExporter:
+    """Spans kept as dicts in a list, e.g. for tests or a notebook"""
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self.spans.append(span.to_dict())
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+
+class JSONLExporter:
+    """
+    Spans appended to a file, one JSON object per line
+
+    Lines are short and appended whole, so a client and a server in another
+    process may share the file.
+
+    Parameters
+    ----------
+    path: str or Path
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+
+    @property
+    def spans(self):
+        return read_spans(self.path)
+
+    def __getstate__(self):
+        # sent to a server process, see demo.process
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+
+def read_spans(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class Tracer:
+    """Where the client's traces go, None while tracing is disabled"""
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+
+
+# the process' tracer, see enable
+tracer = Tracer()
+
+
+def enable(exporter=None):
+    """Trace client calls to exporter, an InMemoryExporter by default"""
+    tracer.exporter = InMemoryExporter() if exporter is None else exporter
+    return tracer.exporter
+
+
+def disable():
+    tracer.exporter = None
+
+
+def current_span():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def _activate(span):
+    token = _current.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.end(e)
+        raise
+    finally:
+        _current.reset(token)
+        span.end()
+
+
+def span(name, **attributes):
+    """
+    A context manager timing a phase as a span, a child of the current one
+
+    Outside of a span the phase starts a trace when tracing is enabled. It
+    yields the span, or None when there is nothing to trace.
+    """
+    parent = _current.get()
+    if parent is not None:
+        new = parent.child(name)
+    elif tracer.exporter is not None:
+        new = Span(name, exporter=tracer.exporter)
+    else:
+        return contextlib.nullcontext()
+    new.set(**attributes)
+    return _activate(new)
+
+
+def call_span(context):
+    """The span of a server call, see TracingServerMiddlewareFactory"""
+    middleware = context.get_middleware("tracing") if context else None
+    return getattr(middleware, "span", None)
+
+
+def server_span(context, name, **attributes):
+    """
+    A span of a phase of a server call, a child of the current one or of the
+    call's
+
+    The current span is kept in a context variable, which a generator does
+    not carry across its yields when grpc resumes it, e.g. do_action's: do not
+    yield within a server_span.
+    """
+    parent = _current.get() or call_span(context)
+    if parent is None:
+        return contextlib.nullcontext()
+    new = parent.child(name, side="server")
+    new.set(**attributes)
+    return _activate(new)
+
+
+def _method(info):
+    return info.method.name.lower()
+
+
+class TracingClientMiddlewareFactory(pyarrow.flight.ClientMiddlewareFactory):
+    """
+    Time every call of a client in a span and send its trace to the server
+
+    The call is a child of the span the caller is in. It ends once the call
+    completes, for streams when they are read whole. Without a current span
+    and with tracing disabled calls are not intercepted.
+    """
+
+    def start_call(self, info):
+        parent = _current.get()
+        if parent is not None:
+            call = parent.child(_method(info))
+        elif tracer.exporter is not None:
+            call = Span(_method(info), exporter=tracer.exporter)
+        else:
+            return None
+        return TracingClientMiddleware(call)
+
+
+class TracingClientMiddleware(pyarrow.flight.ClientMiddleware):
+    def __init__(self, span):
+        self.span = span
+
+    def sending_headers(self):
+        return {TRACEPARENT: self.span.traceparent}
+
+    def call_completed(self, exception):
+        self.span.end(exception)
+
+
+class TracingServerMiddlewareFactory(pyarrow.flight.ServerMiddlewareFactory):
+    """
+    Time every call to the server in a span exported to `exporter`
+
+    A call with a traceparent header continues the client's trace, one
+    without starts its own. Phases of the call are timed by server_span.
+
+    Parameters
+    ----------
+    exporter: InMemoryExporter or JSONLExporter
+    """
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+
+    def start_call(self, info, headers):
+        trace_id = parent_id = None
+        for value in headers.get(TRACEPARENT, ()):
+            if (parsed := parse_traceparent(value)) is not None:
+                trace_id, parent_id = parsed
+        call = Span(
+            f"server.{_method(info)}",
+            trace_id=trace_id,
+            parent_id=parent_id,
+            exporter=self.exporter,
+            side="server",
+        )
+        return TracingServerMiddleware(call)
+
+
+class TracingServerMiddleware(pyarrow.flight.ServerMiddleware):
+    def __init__(self, span):
+        self.span = span
+
+    def call_completed(self, exception):
+        self.span.end(exception)
+
+
+def _tree(spans):
+    """The roots of spans, and the children of every span id"""
+    ids = {span["span_id"] for span in spans}
+    children = {}
+    roots = []
+    for span in sorted(spans, key=lambda span: span["start"]):
+        if span["parent_id"] in ids:
+            children.setdefault(span["parent_id"], []).append(span)
+        else:
+            roots.append(span)
+    return roots, children
+
+
+def aggregate(spans):
+    """
+    The total seconds, self seconds and count of every stack of span names
+
+    Like a flamegraph, the spans of the same names under the same parents
+    are merged, across traces too. The self time of a span is its duration
+    less its children's, concurrent children can make it 0.
+    """
+    roots, children = _tree(spans)
+    stacks = {}
+
+    def visit(span, path):
+        path = (*path, span["name"])
+        kids = children.get(span["span_id"], [])
+        duration = span["duration"] or 0.0
+        own = max(duration - sum(kid["duration"] or 0.0 for kid in kids), 0.0)
+        total, self_time, count = stacks.get(path, (0.0, 0.0, 0))
+        stacks[path] = (total + duration, self_time + own, count + 1)
+        for kid in kids:
+            visit(kid, path)
+
+    for root in roots:
+        visit(root, ())
+    return stacks
+
+
+def collapsed(spans):
+    """Stacks in the folded format of flamegraph.pl, self microseconds each"""
+    return "\n".join(
+        f"{';'.join(path)} {round(self_time * 1e6)}"
+        for path, (_, self_time, _) in sorted(aggregate(spans).items())
+    )
+
+
+def summarize(spans, width=30):
+    """An indented tree of the stacks of spans, the slowest first"""
+    stacks = aggregate(spans)
+    grand_total = sum(total for path, (total, _, _) in stacks.items() if len(path) == 1)
+    lines = [f"{'total ms':>10} {'self ms':>10} {'calls':>6}  {'':<{width}}  span"]
+
+    def visit(path):
+        kids = [
+            other
+            for other in stacks
+            if len(other) == len(path) + 1 and other[: len(path)] == path
+        ]
+        for kid in sorted(kids, key=lambda kid: -stacks[kid][0]):
+            total, self_time, count = stacks[kid]
+            bar = "#" * round(width * total / grand_total) if grand_total else ""
+            indent = "  " * (len(kid) - 1)
+            lines.append(
+                f"{total * 1e3:>10.2f} {self_time * 1e3:>10.2f} {count:>6}  "
+                f"{bar:<{width}}  {indent}{kid[-1]}"
+            )
+            visit(kid)
+
+    visit(())
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Summarize the spans of a JSONL trace file"
+    )
+    parser.add_argument("path")
+    parser.add_argument("--trace", help="only the spans of this trace id")
+    parser.add_argument(
+        "--collapsed",
+        action="store_true",
+        help="print folded stacks for flamegraph.pl instead",
+    )
+    args = parser.parse_args(argv)
+    spans = read_spans(args.path)
+    if args.trace:
+        spans = [span for span in spans if span["trace_id"] == args.trace]
+    sys.stdout.write((collapsed(spans) if args.collapsed else summarize(spans)) + "\n")
+
+
+if __name__ == "__main__":
+    main()
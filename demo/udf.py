@@ -0,0 +1,79 @@
+import contextlib
+
+
+class VectorizedUDF:
+    """
+    A Python function of Arrow arrays, run inside the server's backend
+
+    Once registered with the server's connection, DuckDB or DataFusion, the
+    function is callable by name from any query the server executes, so it
+    is applied where the data is. It is called with a pyarrow array per
+    argument for a batch of rows at a time and returns an array as long.
+    Nulls are passed to the function as they are.
+
+    Parameters
+    ----------
+    fn: callable
+        With exactly one parameter per input type, e.g. wrapping
+        pyarrow.compute functions.
+    input_types: tuple of pyarrow DataType
+    output_type: pyarrow DataType
+    name: str
+        The function's name in queries, fn's by default.
+    """
+
+    def __init__(self, fn, input_types, output_type, name=None):
+        self.fn = fn
+        self.input_types = tuple(input_types)
+        self.output_type = output_type
+        self.name = name or fn.__name__
+
+    def register(self, con):
+        """Create or replace the function in a letsql connection"""
+        if hasattr(con.con, "create_function"):
+            self._register_duckdb(con.con)
+        else:
+            self._register_datafusion(con.con)
+
+    def _register_duckdb(self, con):
+        import duckdb
+        import ibis.expr.datatypes as dt
+        from ibis.backends.sql.datatypes import DuckDBType
+
+        def sqltype(typ):
+            return duckdb.sqltype(DuckDBType.to_string(dt.dtype(typ)))
+
+        with contextlib.suppress(duckdb.InvalidInputException):
+            con.remove_function(self.name)
+        con.create_function(
+            self.name,
+            self.fn,
+            [sqltype(typ) for typ in self.input_types],
+            sqltype(self.output_type),
+            type="arrow",
+            null_handling="special",
+        )
+
+    def _register_datafusion(self, ctx):
+        import letsql.internal as df
+
+        ctx.register_udf(
+            df.udf(
+                self.fn,
+                input_types=list(self.input_types),
+                return_type=self.output_type,
+                volatility="immutable",
+                name=self.name,
+            )
+        )
+
+    def to_ibis(self):
+        """A builtin ibis UDF calling the function by name"""
+        import ibis
+        import ibis.expr.datatypes as dt
+
+        signature = (
+            tuple(dt.dtype(typ) for typ in self.input_types),
+            dt.dtype(self.output_type),
+        )
+        return ibis.udf.scalar.builtin(self.fn, name=self.name, signature=signature)
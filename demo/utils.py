@@ -1,3 +1,5 @@
+import urllib.parse
+
 import cloudpickle
 import pyarrow as pa
 import pyarrow.flight as paf
@@ -9,3 +11,12 @@ make_flight_result = toolz.compose(
     pa.py_buffer,
     cloudpickle.dumps,
 )
+
+
+def with_port(location, port):
+    url = urllib.parse.urlparse(location)
+    host = url.hostname
+    if ":" in host:
+        # an IPv6 literal, which hostname strips of its brackets
+        host = f"[{host}]"
+    return url._replace(netloc=f"{host}:{port}").geturl()
@@ -0,0 +1,177 @@
+import base64
+import itertools
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+DEFAULT_SAMPLE_ROWS = 64 * 1024
+DEFAULT_MAX_DICTIONARY_SIZE = 64 * 1024
+DEFAULT_MAX_DICTIONARY_RATIO = 0.5
+
+# schema metadata key holding the schema the sender started from
+ORIGINAL_SCHEMA_KEY = b"ephemeral-flight:original-schema"
+
+_signed = (pa.int8(), pa.int16(), pa.int32(), pa.int64())
+_unsigned = (pa.uint8(), pa.uint16(), pa.uint32(), pa.uint64())
+
+
+def wire_options(wire_optimize):
+    """
+    Normalise a `wire_optimize` argument: None or False turn the optimizer
+    off, True uses the defaults and a dict overrides any of sample_rows,
+    max_dictionary_size and max_dictionary_ratio
+    """
+    if not wire_optimize:
+        return None
+    options = {
+        "sample_rows": DEFAULT_SAMPLE_ROWS,
+        "max_dictionary_size": DEFAULT_MAX_DICTIONARY_SIZE,
+        "max_dictionary_ratio": DEFAULT_MAX_DICTIONARY_RATIO,
+    }
+    if isinstance(wire_optimize, dict):
+        unknown = set(wire_optimize) - set(options)
+        if unknown:
+            raise ValueError(f"unknown wire_optimize options {sorted(unknown)}")
+        options.update(wire_optimize)
+    return options
+
+
+def _bounds(typ):
+    bits = typ.bit_width
+    if pa.types.is_signed_integer(typ):
+        return -(2 ** (bits - 1)), 2 ** (bits - 1) - 1
+    return 0, 2**bits - 1
+
+
+def _narrowest_int(lo, hi):
+    for typ in _unsigned if lo >= 0 else _signed:
+        lo_bound, hi_bound = _bounds(typ)
+        if lo_bound <= lo and hi <= hi_bound:
+            return typ
+    return None
+
+
+def _index_type(n_distinct):
+    # dictionary indices must be signed
+    for typ in _signed:
+        if n_distinct - 1 <= _bounds(typ)[1]:
+            return typ
+
+
+def _plan_field(
+    field,
+    column,
+    complete,
+    sample_rows,
+    max_dictionary_size,
+    max_dictionary_ratio,
+):
+    typ = field.type
+    if pa.types.is_string(typ) or pa.types.is_large_string(typ):
+        sample = column.slice(0, sample_rows)
+        n_values = len(sample) - sample.null_count
+        if n_values == 0:
+            return field
+        n_distinct = pc.count_distinct(sample).as_py()
+        if (
+            n_distinct > max_dictionary_size
+            or n_distinct > max_dictionary_ratio * n_values
+        ):
+            return field
+        if complete:
+            # we have all the data, size the indices exactly
+            index_type = _index_type(pc.count_distinct(column).as_py())
+        else:
+            # later batches may bring new values
+            index_type = pa.int32()
+        return field.with_type(pa.dictionary(index_type, typ))
+    if pa.types.is_integer(typ) and typ.bit_width > 8 and complete:
+        # narrowing is only safe when the range of every value is known
+        lo, hi = (value.as_py() for value in pc.min_max(column).values())
+        if lo is None:
+            return field
+        narrow = _narrowest_int(lo, hi)
+        if narrow is not None and narrow.bit_width < typ.bit_width:
+            return field.with_type(narrow)
+    return field
+
+
+def plan(data, complete=True, **options):
+    """
+    Pick the wire schema for a table or batch
+
+    Low-cardinality string columns, judged from the first sample_rows values,
+    are dictionary-encoded. Integer columns are narrowed to the smallest type
+    holding their range, which needs every value: with complete=False (data is
+    a sample of a stream) only dictionary encoding is planned.
+
+    Returns the wire schema, with the original schema in its metadata, or None
+    if nothing would change.
+    """
+    options = wire_options(options or True)
+    fields = [
+        _plan_field(field, data.column(i), complete, **options)
+        for i, field in enumerate(data.schema)
+    ]
+    if all(a.type == b.type for a, b in zip(fields, data.schema)):
+        return None
+    metadata = dict(data.schema.metadata or {})
+    metadata[ORIGINAL_SCHEMA_KEY] = base64.b64encode(
+        data.schema.serialize().to_pybytes()
+    )
+    return pa.schema(fields, metadata=metadata)
+
+
+def optimize_table(table, **options):
+    """Encode a table for the wire, see plan"""
+    schema = plan(table, complete=True, **options)
+    if schema is None:
+        return table
+    # a Flight stream sends one dictionary per column, not one per chunk
+    return table.cast(schema).unify_dictionaries()
+
+
+def optimize_batches(batches, schema, **options):
+    """
+    Encode a stream for the wire, planned from its first batch
+
+    Returns the wire schema and an iterator of encoded batches.
+    """
+    batches = iter(batches)
+    first = next(batches, None)
+    if first is None:
+        return schema, iter(())
+    wire_schema = plan(first, complete=False, **options)
+    if wire_schema is None:
+        return schema, itertools.chain([first], batches)
+    return wire_schema, (
+        batch.cast(wire_schema) for batch in itertools.chain([first], batches)
+    )
+
+
+def original_schema(schema):
+    """The schema the sender started from, None if it was not optimized"""
+    value = (schema.metadata or {}).get(ORIGINAL_SCHEMA_KEY)
+    if value is None:
+        return None
+    return pa.ipc.read_schema(pa.py_buffer(base64.b64decode(value)))
+
+
+def restore(data, schema=None):
+    """
+    Cast a table or batch received from the wire back to the original schema
+
+    Data that was not optimized is returned as it is.
+    """
+    schema = schema or original_schema(data.schema)
+    if schema is None:
+        return data
+    return data.cast(schema)
+
+
+def restore_batches(batches, schema):
+    """Restore every batch of a stream whose (wire) schema is given"""
+    original = original_schema(schema)
+    for batch in batches:
+        yield restore(batch, original) if original is not None else batch
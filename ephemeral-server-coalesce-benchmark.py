@@ -0,0 +1,70 @@
+import time
+
+import pyarrow as pa
+
+from demo import EphemeralServer, BasicAuth
+from demo.client import FlightClient
+from demo.coalesce import coalesce_batches, coalesce_options
+from util import certificate_path, key_path, scheme, host
+
+
+n_rows = 1_000_000
+data = pa.table({"a": range(n_rows), "b": [float(i) for i in range(n_rows)]})
+
+
+def report(name, chunksize, coalesce, n_messages, elapsed):
+    print(
+        f"{name:<8} chunksize={chunksize:<7} coalesce={str(coalesce):<5} "
+        f"messages={n_messages:<6} "
+        f"messages/s={n_messages / elapsed:>10,.0f} "
+        f"MB/s={data.nbytes / elapsed / 1e6:>8,.1f}"
+    )
+
+
+def bench_upload(client, chunksize, coalesce):
+    batches = data.to_reader(max_chunksize=chunksize)
+    if options := coalesce_options(coalesce):
+        batches = coalesce_batches(batches, **options)
+    n_messages = sum(1 for _ in batches)
+
+    start = time.perf_counter()
+    client.upload_batches(
+        "bench", data.to_reader(max_chunksize=chunksize), coalesce=coalesce
+    )
+    elapsed = time.perf_counter() - start
+    return n_messages, elapsed
+
+
+def bench_exchange(client, chunksize, coalesce):
+    start = time.perf_counter()
+    fut, rbr = client.do_exchange_batches(
+        "echo", data.to_reader(max_chunksize=chunksize), coalesce=coalesce
+    )
+    n_messages = sum(1 for _ in rbr)
+    fut.result()
+    elapsed = time.perf_counter() - start
+    return n_messages, elapsed
+
+
+for server_coalesce in (False, True):
+    print(f"server coalesce={server_coalesce}")
+    with EphemeralServer(
+        location="{}://{}:{}".format(scheme, host, 0),
+        certificate_path=certificate_path,
+        key_path=key_path,
+        auth=BasicAuth("test", "password"),
+        coalesce=server_coalesce,
+    ) as server:
+        client = FlightClient(
+            host=host,
+            port=server.port,
+            username="test",
+            password="password",
+            tls_roots=certificate_path,
+        )
+        for chunksize in (100, 10_000):
+            for coalesce in (False, True):
+                n_messages, elapsed = bench_upload(client, chunksize, coalesce)
+                report("upload", chunksize, coalesce, n_messages, elapsed)
+                n_messages, elapsed = bench_exchange(client, chunksize, coalesce)
+                report("exchange", chunksize, coalesce, n_messages, elapsed)
@@ -2,9 +2,9 @@ import pathlib
 
 import pandas as pd
 import letsql as ls
-from letsql.expr.relations import into_backend
 
 from demo import EphemeralServer, make_con, BasicAuth
+from demo.backend import into_backend
 from util import certificate_path, key_path, scheme, host, port
 
 root = pathlib.Path(__file__).resolve().parent
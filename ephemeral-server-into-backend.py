@@ -1,9 +1,8 @@
 import pyarrow as pa
 import letsql as ls
 
-from letsql.expr.relations import into_backend
-
 from demo import EphemeralServer, make_con, BasicAuth
+from demo.backend import into_backend
 from util import certificate_path, key_path, scheme, host, port
 
 
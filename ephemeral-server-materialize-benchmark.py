@@ -0,0 +1,85 @@
+import subprocess
+import sys
+import time
+
+import pyarrow as pa
+
+from demo import EphemeralServer, BasicAuth, make_con
+from util import certificate_path, key_path, scheme, host
+
+
+n_rows = 5_000_000
+variants = ("letsql execute", "execute", "execute arrow_dtypes")
+
+
+def memory_status(key):
+    """A field of /proc/self/status in MB, e.g. VmRSS or VmHWM (Linux)"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(key + ":"):
+                return int(line.split()[1]) / 1024
+
+
+def reset_peak():
+    # resets VmHWM to the current VmRSS
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def run(variant, port):
+    """Materialize the table in this process, report time and peak memory"""
+    from demo.backend import Backend
+
+    con = Backend()
+    con.do_connect(
+        host=host, port=port, tls_roots=certificate_path, arrow_dtypes="arrow" in variant
+    )
+    t = con.table("bench")
+    reset_peak()
+    before = memory_status("VmRSS")
+    start = time.perf_counter()
+    if variant == "letsql execute":
+        # what letsql's DuckDB backend does
+        df = t.__pandas_result__(
+            con.to_pyarrow_batches(t, limit="default").read_pandas(
+                timestamp_as_object=True
+            )
+        )
+    else:
+        df = t.execute()
+    elapsed = time.perf_counter() - start
+    peak = memory_status("VmHWM") - before
+    nbytes = df.memory_usage(deep=False).sum()
+    print(
+        f"{variant:<21} {elapsed:>6.2f}s  peak={peak:>7,.0f}MB  "
+        f"result={nbytes / 2**20:>6,.0f}MB"
+    )
+
+
+if __name__ == "__main__" and len(sys.argv) == 3:
+    run(sys.argv[1], int(sys.argv[2]))
+elif __name__ == "__main__":
+    data = pa.table(
+        {
+            "a": pa.array(range(n_rows), pa.int64()),
+            "b": pa.array(range(n_rows), pa.float64()),
+            "c": pa.array(range(n_rows), pa.int32()),
+            "d": pa.array(range(n_rows), pa.int64()),
+        }
+    )
+    with EphemeralServer(
+        location="{}://{}:{}".format(scheme, host, 0),
+        certificate_path=certificate_path,
+        key_path=key_path,
+        auth=BasicAuth("test", "password"),
+        process=True,
+    ) as main:
+        make_con(main).read_in_memory(data, "bench")
+        del data
+        for variant in variants:
+            # each in a fresh process, peak memory only goes up
+            subprocess.run(
+                [sys.executable, __file__, variant, str(main.port)],
+                check=True,
+                stderr=subprocess.DEVNULL,
+            )
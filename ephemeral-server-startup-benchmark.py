@@ -0,0 +1,80 @@
+import contextlib
+import io
+import re
+import socket
+import subprocess
+import sys
+import time
+
+from util import certificate_path, key_path, host
+
+import_line = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(module):
+    """Import time of module and of the slowest packages it pulls in, in ms"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total, packages = 0, {}
+    for line in result.stderr.splitlines():
+        if match := import_line.match(line):
+            _, cumulative, _, name = match.groups()
+            if name == module:
+                total = int(cumulative) / 1e3
+            elif "." not in name and name not in ("demo", "site", "encodings"):
+                packages[name] = int(cumulative) / 1e3
+    slowest = sorted(packages.items(), key=lambda item: -item[1])[:3]
+    return total, slowest
+
+
+def time_to_first_request(port):
+    """Seconds from launching the server entry point to its answers"""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "demo.server",
+            "--tls",
+            str(certificate_path),
+            str(key_path),
+            "--port",
+            str(port),
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        from demo.client import FlightClient
+
+        # a client that connects before the server listens backs off for
+        # seconds, so wait for the port first
+        while True:
+            try:
+                socket.create_connection((host, port)).close()
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.01)
+        with contextlib.redirect_stdout(io.StringIO()):
+            # waits on the healthcheck
+            client = FlightClient(host=host, port=port, tls_roots=certificate_path)
+        healthcheck = time.perf_counter() - started
+        client.list_tables()
+        catalog = time.perf_counter() - started
+        return healthcheck, catalog
+    finally:
+        process.terminate()
+        process.wait()
+
+
+for module in ("demo", "demo.client", "demo.server", "demo.backend"):
+    total, slowest = import_times(module)
+    top = ", ".join(f"{name}={ms:,.0f}ms" for name, ms in slowest)
+    print(f"import {module:<13} {total:>8,.0f}ms  ({top})")
+
+healthcheck, catalog = time_to_first_request(port=5006)
+print(f"first healthcheck {healthcheck * 1e3:>8,.0f}ms")
+print(f"first list_tables {catalog * 1e3:>8,.0f}ms")